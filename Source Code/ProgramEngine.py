@@ -1,43 +1,136 @@
 from embed_query import embed_user_query
-from similarity import get_top_chunks
+from similarity import get_exact_matches, get_top_chunks, get_vector_store
 from prompt_builder import build_prompt
 from llm_interface import query_llm, extract_fallback_info_with_history
+from response_cache import response_cache
+from sessions import ChatSession
+from query_log import QueryLogError, query_log
+import tracing
+import time
 import warnings
-import json
 from datetime import datetime
-import os
 import re
-from typing import Generator, Tuple  # Add for type hinting
+from typing import Callable, Generator, Iterable, Tuple, Union  # Add for type hinting
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
-# Track whether we are waiting for email after a fallback
-waiting_for_fallback_info = False
 fallback_trigger_phrase = "Sorry, I couldn’t find an answer to that in our support database."
-original_question = ""
 
-# Holds latest chat history globally in CLI mode
-chat_history = []
+# Used when no session is passed (single-user CLI mode); concurrent callers must pass their own ChatSession
+default_session = ChatSession("cli")
 
-def get_chatbot_response(question: str, history: list) -> Tuple[str, list, bool]:
+
+class ChatStream:
+    """
+    Iterable of response text deltas, yielded as they arrive from the LLM.
+
+    The final state is only known once the stream has been fully consumed: at that
+    point `text`, `history` and `is_fallback` are filled in (history update and
+    fallback detection run on completion, not before the first token).
+
+    Attributes:
+        live (bool): True if the deltas come from an in-flight LLM stream; False for
+            answers known up front (cache hits, fallback-email replies, errors).
+        failed (bool): True if the LLM call failed; `text` holds the error message and
+            `history` is the unchanged input history.
+    """
+
+    def __init__(self, deltas: Iterable[str], on_complete: Callable[[str], Tuple[list, bool]],
+                 live: bool = True, failed: bool = False):
+        self._deltas = deltas
+        self._on_complete = on_complete
+        self.live = live
+        self.failed = failed
+        self.done = False
+        self.text = ""
+        self.history = None
+        self.is_fallback = False
+        self.trace = None
+
+    def attach_trace(self, trace):
+        """Ties a request trace to this stream; it is finished when the last delta has been consumed."""
+        self.trace = trace
+        if trace is not None and not self.live:
+            trace.finish("error" if self.failed else "ok")
+
+    @classmethod
+    def from_text(cls, text: str, history: list, is_fallback: bool = False, failed: bool = False) -> "ChatStream":
+        """Wraps a complete answer so callers can treat every response as a stream."""
+        stream = cls([text], lambda _: (history, is_fallback), live=False, failed=failed)
+        stream.text = text
+        stream.history = history
+        stream.is_fallback = is_fallback
+        return stream
+
+    def __iter__(self) -> Generator[str, None, None]:
+        if self.done:
+            yield self.text
+            return
+        parts = []
+        try:
+            for delta in self._deltas:
+                parts.append(delta)
+                yield delta
+            self.text = "".join(parts)
+            with tracing.activate(self.trace), tracing.span("finalize"):
+                self.history, self.is_fallback = self._on_complete(self.text)
+            self.done = True
+        finally:
+            if self.trace is not None:
+                # A consumer that stops reading early leaves the trace marked as cancelled
+                self.trace.finish("ok" if self.done else "cancelled")
+
+    def consume(self) -> str:
+        """Drains the stream and returns the full text."""
+        for _ in self:
+            pass
+        return self.text
+
+
+def get_chatbot_response(question: str, history: list, stream: bool = False,
+                         session: ChatSession = None) -> Union[Tuple[str, list, bool], ChatStream]:
     """
     Orchestrates the chatbot pipeline: embedding → retrieval → prompt → LLM call.
 
     Args:
         question (str): User's latest question.
         history (list): List of past messages (role/user/assistant).
+        stream (bool): If True, return a ChatStream that yields deltas as they arrive
+            instead of waiting for the full completion.
+        session (ChatSession): Per-user conversation state (fallback email-capture mode).
+            Defaults to a process-wide session, which is only safe for a single user.
+
+    Every call is traced (see tracing.py): span timings per stage, prompt tokens, retries and
+    cache hit flags are recorded once the response has been fully produced.
 
     Returns:
-        tuple:
+        ChatStream if stream is True, otherwise a tuple:
             - response (str): Final answer from the chatbot.
             - updated_history (list): Chat history including latest exchange.
             - is_fallback (bool): True if fallback triggered, False otherwise.
     """
-    global waiting_for_fallback_info, original_question
+    session = session or default_session
+    session.touch()
+    trace = tracing.start_trace("chat", stream=stream)
+    with tracing.activate(trace):
+        chat_stream = _respond(question, history, session)
+    chat_stream.attach_trace(trace)
+    if stream:
+        return chat_stream
+    chat_stream.consume()
+    return chat_stream.text, chat_stream.history, chat_stream.is_fallback
+
+
+def _respond(question: str, history: list, session: ChatSession) -> ChatStream:
+    with session.lock:
+        waiting_for_fallback_info = session.waiting_for_fallback_info
+        original_question = session.original_question
 
     # If waiting for email, skip embedding and retrieval
     if waiting_for_fallback_info:
-        extracted = extract_fallback_info_with_history(history + [{"role": "user", "content": question}], original_question)
+        tracing.annotate(fallback_capture=True)
+        with tracing.span("fallback_extraction"):
+            extracted = extract_fallback_info_with_history(history + [{"role": "user", "content": question}], original_question)
         if extracted.get("email") and extracted.get("question"):
             try:
                 save_unanswered_question(extracted)
@@ -45,9 +138,8 @@ def get_chatbot_response(question: str, history: list) -> Tuple[str, list, bool]
                     f"✅ Thank you! We've noted your question about: \"{extracted['question']}\" "
                     f"and will contact you at {extracted['email']} shortly."
                 )
-                waiting_for_fallback_info = False
-                original_question = ""
-            except Exception as e:
+                session.clear_fallback()
+            except QueryLogError as e:
                 print(f"❌ Failed to save unanswered question: {str(e)}")
                 response = (
                     "⚠️ Sorry, we couldn’t save your question due to a technical issue. "
@@ -63,56 +155,81 @@ def get_chatbot_response(question: str, history: list) -> Tuple[str, list, bool]
             {"role": "user", "content": question},
             {"role": "assistant", "content": response}
         ]
-        return response, updated_history, False
-
-    # Step 1: Embed user query
-    query_embedding = embed_user_query(question)
-
-    # Step 2: Retrieve top 3 relevant chunks
-    top_chunks = get_top_chunks(query_embedding, top_k=3)
+        session.record_history(updated_history)
+        return ChatStream.from_text(response, updated_history)
+
+    # Step 1: A bare model number / SKU resolves from the exact-match table without embedding
+    query_embedding = None
+    with tracing.span("get_exact_matches"):
+        top_chunks = get_exact_matches(question, top_k=3)
+    tracing.annotate(exact_match=bool(top_chunks))
+
+    if not top_chunks:
+        # Step 1b: Embed user query
+        with tracing.span("embed_user_query"):
+            query_embedding = embed_user_query(question)
+
+        # Step 2: Retrieve top 3 relevant chunks (dense + BM25 fused)
+        with tracing.span("get_top_chunks"):
+            top_chunks = get_top_chunks(query_embedding, top_k=3, query_text=question)
+
+    # Step 2b: Reuse a previous answer for a paraphrased self-contained question with the same context
+    cached_response = None
+    if query_embedding is not None:
+        with tracing.span("response_cache_lookup"):
+            cached_response = response_cache.lookup(query_embedding, top_chunks, history,
+                                                    get_vector_store().content_hash, question)
+    tracing.annotate(response_cache_hit=cached_response is not None)
+    if cached_response is not None:
+        updated_history = history + [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": cached_response}
+        ]
+        session.record_history(updated_history)
+        return ChatStream.from_text(cached_response, updated_history)
 
     # Step 3: Build LLM prompt
-    messages = build_prompt(question, top_chunks, history)
+    with tracing.span("build_prompt"):
+        messages = build_prompt(question, top_chunks, history)
 
     # Step 4: Get response from OpenRouter (streaming)
-    success, result = query_llm(messages, stream=True)
+    llm_started = time.perf_counter()
+    with tracing.span("llm_request"):
+        success, result = query_llm(messages, stream=True)
 
     if not success:
         print("⚠️ Query failed. Returning error message without updating history.")
-        return result, history, False
+        return ChatStream.from_text(result, history, failed=True)
 
-    # Step 5: Collect streaming response for history and fallback detection
-    response = ""
-    for chunk in result:
-        response += chunk
+    # Steps 5-7 run once the last delta has been streamed to the caller
+    def on_complete(response: str) -> Tuple[list, bool]:
+        # Step 6: Update conversation history
+        updated_history = history + [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": response}
+        ]
 
-    # Step 6: Update conversation history
-    updated_history = history + [
-        {"role": "user", "content": question},
-        {"role": "assistant", "content": response}
-    ]
+        # Step 7: Check for fallback trigger with flexible pattern
+        fallback_pattern = r"(sorry|i couldn’t find|no answer|not found).*?(support database|our database)"
+        is_fallback = bool(re.search(fallback_pattern, response.lower())) or fallback_trigger_phrase.lower() in response.lower()
+        if is_fallback:
+            session.start_fallback(question)
+        elif query_embedding is not None:
+            # Fallback answers are never cached so the email-capture flow always runs
+            response_cache.store(query_embedding, top_chunks, history, response,
+                                 get_vector_store().content_hash, question)
 
-    # Step 7: Check for fallback trigger with flexible pattern
-    fallback_pattern = r"(sorry|i couldn’t find|no answer|not found).*?(support database|our database)"
-    is_fallback = bool(re.search(fallback_pattern, response.lower())) or fallback_trigger_phrase.lower() in response.lower()
-    if is_fallback:
-        waiting_for_fallback_info = True
-        original_question = question
+        session.record_history(updated_history)
+        return updated_history, is_fallback
 
-    return response, updated_history, is_fallback
+    # Step 5: Hand the deltas to the caller as they arrive
+    return ChatStream(tracing.traced_stream(result, tracing.current_trace(), llm_started), on_complete)
 
 def save_unanswered_question(entry: dict):
+    """
+    Queues the entry for the background log writer; the chat response does not wait for the disk write.
+    Raises QueryLogError when the entry cannot be accepted (see QueryLogWriter.write).
+    """
     entry["timestamp"] = datetime.utcnow().isoformat()
-    file_path = "Source Code/Assets/unanswered_queries.jsonl"
-    
-    # Ensure Assets folder exists
-    os.makedirs("Assets", exist_ok=True)
-    
     print("📝 Saving fallback query:", entry)
-    try:
-        with open(file_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-    except Exception as e:
-        print(f"❌ Error saving to {file_path}: {str(e)}")
-        raise
-
+    query_log.write(entry)
@@ -0,0 +1,289 @@
+import argparse
+import io
+import os
+import tempfile
+import time
+import numpy as np
+from vector_store import _normalize_rows
+
+# === ANN settings (override with environment variables) ===
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))          # inverted lists scanned per query
+IVF_TRAIN_SAMPLE = 100_000                              # max rows used to train k-means
+IVF_KMEANS_ITERATIONS = 20
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+ASSIGN_BATCH = 8192                                     # rows scored against centroids at a time
+
+
+def _top_k_rows(scores: np.ndarray, rows: np.ndarray, top_k: int) -> np.ndarray:
+    """Best-first rows for a 1D score array (argpartition, then sort only the k winners)."""
+    if len(rows) > top_k:
+        keep = np.argpartition(-scores, top_k - 1)[:top_k]
+        rows, scores = rows[keep], scores[keep]
+    return rows[np.argsort(-scores, kind="stable")]
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by inner product) of every row, computed in batches to bound memory."""
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BATCH):
+        batch = np.asarray(vectors[start:start + ASSIGN_BATCH], dtype=np.float32)
+        assignment[start:start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+    return assignment
+
+
+def spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = IVF_KMEANS_ITERATIONS,
+                     seed: int = 0) -> np.ndarray:
+    """
+    k-means on unit vectors with cosine similarity (centroids are re-normalized every step).
+
+    Returns:
+        np.ndarray: Shape (nlist, d) float32 unit centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample_rows = np.sort(rng.choice(n, size=min(n, IVF_TRAIN_SAMPLE), replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists with random sample rows so no centroid is wasted
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Pure-NumPy inverted-file index over unit vectors.
+
+    Rows are partitioned by their nearest k-means centroid. A query scores the centroids,
+    scans only the `nprobe` closest lists and ranks those rows exactly. Rows of list i are
+    list_rows[list_offsets[i]:list_offsets[i + 1]].
+    """
+
+    def __init__(self, vectors: np.ndarray, centroids: np.ndarray, list_offsets: np.ndarray,
+                 list_rows: np.ndarray, nprobe: int = IVF_NPROBE):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: int = None, seed: int = 0) -> "IVFIndex":
+        n = len(vectors)
+        nlist = nlist or max(1, min(n, int(4 * np.sqrt(n))))
+        centroids = spherical_kmeans(vectors, nlist, seed=seed)
+        assignment = _assign(vectors, centroids)
+        list_rows = np.argsort(assignment, kind="stable").astype(np.int32)
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+        return cls(vectors, centroids, list_offsets, list_rows)
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(buffer, centroids=self.centroids, list_offsets=self.list_offsets, list_rows=self.list_rows)
+        return buffer.getvalue()
+
+    @classmethod
+    def load(cls, path, vectors: np.ndarray, nprobe: int = IVF_NPROBE) -> "IVFIndex":
+        with np.load(path, allow_pickle=False) as npz:
+            return cls(vectors, npz["centroids"], npz["list_offsets"], npz["list_rows"], nprobe)
+
+    def top_k_indices(self, query_embeddings: np.ndarray, top_k: int = 3) -> np.ndarray:
+        """
+        Same contract as ChunkIndex.top_k_indices (queries are expected to be unit vectors):
+        every query gets min(top_k, n) rows. When a query's `nprobe` lists hold fewer rows
+        than that, its next-closest lists are probed as well, for that query only.
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        width = min(top_k, len(self.list_rows))
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        sizes = np.diff(self.list_offsets)
+
+        results = np.zeros((len(queries), max(width, 0)), dtype=np.int64)
+        for q, (query, lists) in enumerate(zip(queries, probes)):
+            if sizes[lists].sum() < width:
+                # Sparse probe: take the closest lists in order until they hold enough rows
+                ranked = np.argsort(-centroid_scores[q], kind="stable")
+                lists = ranked[:int(np.searchsorted(np.cumsum(sizes[ranked]), width)) + 1]
+            # Sorted rows keep memmap reads sequential
+            rows = np.sort(np.concatenate([self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists]))
+            scores = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+            results[q] = _top_k_rows(scores, rows, width)
+        return results
+
+
+class HNSWIndex:
+    """HNSW graph index via the optional `hnswlib` package (inner product on unit vectors)."""
+
+    def __init__(self, index, ef_search: int = HNSW_EF_SEARCH):
+        self.index = index
+        self.index.set_ef(ef_search)
+
+    @staticmethod
+    def available() -> bool:
+        try:
+            import hnswlib  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    @classmethod
+    def build(cls, vectors: np.ndarray) -> "HNSWIndex":
+        import hnswlib
+
+        index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        index.init_index(max_elements=len(vectors), M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION)
+        for start in range(0, len(vectors), ASSIGN_BATCH):
+            batch = np.asarray(vectors[start:start + ASSIGN_BATCH], dtype=np.float32)
+            index.add_items(batch, np.arange(start, start + len(batch)))
+        return cls(index)
+
+    def to_bytes(self) -> bytes:
+        # hnswlib only serializes to a path
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "hnsw.bin")
+            self.index.save_index(path)
+            with open(path, "rb") as f:
+                return f.read()
+
+    @classmethod
+    def load(cls, path, dim: int, ef_search: int = HNSW_EF_SEARCH) -> "HNSWIndex":
+        import hnswlib
+
+        index = hnswlib.Index(space="ip", dim=dim)
+        index.load_index(str(path))
+        return cls(index, ef_search)
+
+    def top_k_indices(self, query_embeddings: np.ndarray, top_k: int = 3) -> np.ndarray:
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        top_k = min(top_k, self.index.get_current_count())
+        self.index.set_ef(max(self.index.ef, top_k))
+        labels, _ = self.index.knn_query(queries, k=top_k)
+        return labels.astype(np.int64)
+
+
+# === Sidecar builders used by embed_chunks.py ===
+def build_ivf_bytes(records, vectors) -> bytes:
+    return IVFIndex.build(_normalize_rows(vectors)).to_bytes()
+
+
+def build_hnsw_bytes(records, vectors) -> bytes:
+    return HNSWIndex.build(_normalize_rows(vectors)).to_bytes()
+
+
+SIDECAR_BUILDERS = {"ivf": build_ivf_bytes, "hnsw": build_hnsw_bytes}
+
+
+def load_ann_index(backend: str, store, vectors: np.ndarray):
+    """
+    Loads the ANN sidecar for `backend` from a VectorStore; None for "exact".
+
+    A configured backend that cannot be loaded is an error rather than a silent fallback to
+    exact search: a missing sidecar raises FileNotFoundError and a missing hnswlib ImportError.
+    """
+    if backend == "exact":
+        return None
+    if backend not in SIDECAR_BUILDERS:
+        raise ValueError(f"Unknown retrieval backend '{backend}', expected exact, ivf or hnsw")
+    path = store.sidecar_path(backend)
+    if path is None:
+        raise FileNotFoundError(
+            f"RETRIEVAL_BACKEND={backend} but the index in {store.index_dir} has no '{backend}' sidecar. "
+            f"Run embed_chunks.py --ann {backend}, or set RETRIEVAL_BACKEND=exact."
+        )
+    if backend == "ivf":
+        return IVFIndex.load(path, vectors)
+    if not HNSWIndex.available():
+        raise ImportError("RETRIEVAL_BACKEND=hnsw needs hnswlib (pip install hnswlib), or set RETRIEVAL_BACKEND=exact.")
+    return HNSWIndex.load(path, store.dim)
+
+
+def evaluate_recall(ann_index, exact_index, queries: np.ndarray, top_k: int = 10) -> dict:
+    """
+    recall@k of an ANN index against exact search, plus mean per-query latency of both.
+    """
+    start = time.perf_counter()
+    truth = exact_index.top_k_indices(queries, top_k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    approx = np.concatenate([ann_index.top_k_indices(query, top_k) for query in queries])
+    ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    hits = sum(len(set(t) & set(a)) for t, a in zip(truth, approx))
+    return {
+        "recall_at_k": hits / float(truth.size),
+        "k": top_k,
+        "queries": len(queries),
+        "exact_ms_per_query": exact_ms,
+        "ann_ms_per_query": ann_ms,
+        "speedup": exact_ms / ann_ms if ann_ms else float("inf"),
+    }
+
+
+def synthetic_vectors(n: int, dim: int = 768, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Clustered random unit vectors, a rough stand-in for a large embedded catalog."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return _normalize_rows(vectors)
+
+
+def main():
+    from similarity import ChunkIndex
+    from vector_store import INDEX_DIR, load_index
+
+    parser = argparse.ArgumentParser(description="Evaluate ANN recall@k and speed against exact search")
+    parser.add_argument("--backend", choices=("ivf", "hnsw"), default="ivf")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="IVF lists to probe")
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128], help="HNSW ef_search values")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Evaluate on N synthetic vectors instead of the real index")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic)
+        ann_index = IVFIndex.build(vectors) if args.backend == "ivf" else HNSWIndex.build(vectors)
+        print(f"🧪 Built {args.backend} over {len(vectors)} synthetic vectors")
+    else:
+        store = load_index(INDEX_DIR)
+        vectors = store.float32_vectors()
+        ann_index = load_ann_index(args.backend, store, vectors)
+
+    # Held-out style queries: stored rows perturbed with noise, re-normalized
+    sample = np.asarray(vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)])
+    queries = _normalize_rows(sample + 0.05 * rng.normal(size=sample.shape).astype(np.float32))
+    exact_index = ChunkIndex(vectors, None, normalized=True)
+
+    settings = args.nprobe if args.backend == "ivf" else args.ef
+    label = "nprobe" if args.backend == "ivf" else "ef"
+    print(f"{label:>8} {'recall@' + str(args.k):>10} {'ann ms':>9} {'exact ms':>9} {'speedup':>8}")
+    for value in settings:
+        if args.backend == "ivf":
+            ann_index.nprobe = value
+        else:
+            ann_index.index.set_ef(value)
+        result = evaluate_recall(ann_index, exact_index, queries, args.k)
+        print(f"{value:>8} {result['recall_at_k']:>10.3f} {result['ann_ms_per_query']:>9.3f} "
+              f"{result['exact_ms_per_query']:>9.3f} {result['speedup']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,507 @@
+import startup
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+with startup.timed("import ProgramEngine"):
+    from ProgramEngine import get_chatbot_response
+import llm_router
+from query_log import query_log
+from sessions import ChatSession, session_store
+import tracing
+
+# === Server settings (override with environment variables or command-line flags) ===
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))                    # processes forked after the model loads
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "8"))    # chat requests processed at once per worker
+API_MAX_QUEUE = int(os.getenv("API_MAX_QUEUE", "64"))               # requests waiting for a slot per worker
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "10"))     # seconds a request may wait for a slot
+API_MAX_BODY = int(os.getenv("API_MAX_BODY", str(64 * 1024)))       # bytes
+API_STATELESS = os.getenv("API_STATELESS", "0") == "1"              # keep no sessions in the worker (implied by >1 worker)
+API_KEEPALIVE_TIMEOUT = 15.0      # idle seconds before a keep-alive connection is closed
+API_SHUTDOWN_GRACE = 30.0         # seconds in-flight requests get to finish on SIGTERM
+MAX_HEADERS = 100
+STATELESS_MESSAGE = ("This server keeps no sessions: send the 'history' and 'fallback' "
+                     "of the previous response with each message")
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout",
+           411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Overloaded(HTTPError):
+    """Raised when the worker's request queue is full or a request waited too long for a slot."""
+
+    def __init__(self, message: str):
+        super().__init__(503, message, {"Retry-After": "1"})
+
+
+def parse_chat_request(body: bytes, stateless: bool = False) -> dict:
+    """
+    Validates a chat request body: {"message", optional "session_id", "history", "fallback"}.
+
+    A stateless server rejects a session_id sent without its state: another worker may hold
+    that session, and answering from an empty one would silently drop the conversation
+    (including a pending fallback email capture).
+    """
+    try:
+        payload = json.loads(body or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise HTTPError(400, "Body must be JSON")
+    if not isinstance(payload, dict):
+        raise HTTPError(400, "Body must be a JSON object")
+    message = payload.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise HTTPError(400, "'message' must be a non-empty string")
+    if payload.get("session_id") is not None and not isinstance(payload["session_id"], str):
+        raise HTTPError(400, "'session_id' must be a string")
+    history = payload.get("history")
+    if history is not None and not (isinstance(history, list) and all(
+            isinstance(turn, dict) and turn.get("role") in ("user", "assistant") and isinstance(turn.get("content"), str)
+            for turn in history)):
+        raise HTTPError(400, "'history' must be a list of {role: user|assistant, content: str}")
+    if payload.get("fallback") is not None and not isinstance(payload["fallback"], dict):
+        raise HTTPError(400, "'fallback' must be an object")
+    if stateless and payload.get("session_id") is not None and "history" not in payload and "fallback" not in payload:
+        raise HTTPError(400, STATELESS_MESSAGE)
+    return payload
+
+
+def resolve_session(payload: dict, stateless: bool = False) -> tuple:
+    """
+    (session, history) for a request. Clients that send `history` / `fallback` own the
+    conversation state, which works with any number of workers; otherwise the state lives in
+    this worker's session store, keyed by session_id.
+
+    A stateless server (several workers, each with its own memory) never uses the session
+    store, so the state always comes from the request.
+    """
+    if stateless or "history" in payload or "fallback" in payload:
+        session = ChatSession(payload.get("session_id"))
+        fallback = payload.get("fallback") or {}
+        if fallback.get("waiting"):
+            session.start_fallback(str(fallback.get("question", "")))
+        return session, list(payload.get("history") or [])
+    session = session_store.get_or_create(payload.get("session_id"))
+    with session.lock:
+        return session, list(session.history)
+
+
+def chat_result(session: ChatSession, stream) -> dict:
+    with session.lock:
+        fallback = {"waiting": session.waiting_for_fallback_info, "question": session.original_question}
+    return {
+        "session_id": session.session_id,
+        "response": stream.text,
+        "is_fallback": stream.is_fallback,
+        "failed": stream.failed,
+        "history": stream.history,
+        "fallback": fallback,
+    }
+
+
+class ChatAPI:
+    """
+    One worker's asyncio HTTP front end for get_chatbot_response.
+
+    Chat turns run on a thread pool of `max_concurrency` threads (the pipeline is blocking).
+    At most `max_queue` further requests wait for a slot, each for up to `queue_timeout`
+    seconds; anything beyond that is rejected with 503 + Retry-After instead of queuing
+    without bound. A `stateless` worker takes the conversation state from each request
+    only (see resolve_session).
+    """
+
+    def __init__(self, max_concurrency: int = API_MAX_CONCURRENCY, max_queue: int = API_MAX_QUEUE,
+                 queue_timeout: float = API_QUEUE_TIMEOUT, max_body: int = API_MAX_BODY,
+                 stateless: bool = API_STATELESS):
+        self.stateless = stateless
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_body = max_body
+        self.executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix="chat")
+        self._slots = None                # asyncio.Semaphore, created on the worker's event loop
+        self._connections = set()
+        self.ready = False
+        self.draining = False
+        self.waiting = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+
+    # === HTTP plumbing ===
+    async def _read_request(self, reader: asyncio.StreamReader):
+        try:
+            line = await asyncio.wait_for(reader.readline(), API_KEEPALIVE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            header = await asyncio.wait_for(reader.readline(), API_KEEPALIVE_TIMEOUT)
+            if header in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HTTPError(400, "Too many headers")
+            name, _, value = header.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HTTPError(411, "Send a Content-Length body")
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > self.max_body:
+            raise HTTPError(413, f"Body larger than {self.max_body} bytes")
+        body = await reader.readexactly(length) if length else b""
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return method.upper(), target.split("?", 1)[0], headers, body, keep_alive
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, status: int, body, headers: dict = None,
+                    keep_alive: bool = True, content_type: str = "application/json"):
+        data = (json.dumps(body, ensure_ascii=False) if content_type == "application/json" else body).encode("utf-8")
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}",
+                 f"Content-Length: {len(data)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines.extend(f"{key}: {value}" for key, value in (headers or {}).items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+        await writer.drain()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            while not self.draining:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as e:
+                    await self._send(writer, e.status, {"error": str(e)}, e.headers, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body, keep_alive = request
+                keep_alive = await self.dispatch(method, path, body, writer, keep_alive and not self.draining)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            pass  # Client went away, stalled, or sent a header line longer than the read limit
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def dispatch(self, method: str, path: str, body: bytes, writer, keep_alive: bool) -> bool:
+        """Routes one request; returns whether the connection may be reused."""
+        routes = {
+            "/healthz": ("GET", self.health),
+            "/readyz": ("GET", self.readiness),
+            "/metrics": ("GET", self.metrics),
+            "/v1/chat": ("POST", self.chat),
+            "/v1/chat/stream": ("POST", self.chat_stream),
+        }
+        route = routes.get(path.rstrip("/") or "/")
+        try:
+            if route is None:
+                raise HTTPError(404, f"No route for {path}")
+            if method != route[0]:
+                raise HTTPError(405, f"Use {route[0]} for {path}", {"Allow": route[0]})
+            return await route[1](body, writer, keep_alive)
+        except HTTPError as e:
+            if e.status == 503:
+                self.rejected += 1
+            await self._send(writer, e.status, {"error": str(e)}, e.headers, keep_alive)
+            return keep_alive
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ API error on {method} {path}: {e}")
+            await self._send(writer, 500, {"error": "Internal server error"}, keep_alive=False)
+            return False
+
+    @asynccontextmanager
+    async def admit(self):
+        """Waits for a processing slot, or raises Overloaded (backpressure)."""
+        if self.draining:
+            raise Overloaded("Server is shutting down")
+        # The queue limit only applies to requests that would have to wait for a slot
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            raise Overloaded(f"Request queue is full ({self.max_queue} waiting)")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded(f"No free slot within {self.queue_timeout:.0f}s")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    # === Endpoints ===
+    async def health(self, body, writer, keep_alive) -> bool:
+        await self._send(writer, 200, {"status": "ok", "pid": os.getpid()}, keep_alive=keep_alive)
+        return keep_alive
+
+    async def readiness(self, body, writer, keep_alive) -> bool:
+        ready = self.ready and not self.draining
+        await self._send(writer, 200 if ready else 503, {
+            "ready": ready, "draining": self.draining, "in_flight": self.in_flight, "waiting": self.waiting,
+        }, keep_alive=keep_alive)
+        return keep_alive
+
+    async def metrics(self, body, writer, keep_alive) -> bool:
+        pid = os.getpid()
+        lines = [tracing.recorder.prometheus().rstrip("\n")]
+        router = llm_router.get_router()
+        if router is not None:
+            lines.append(router.render_prometheus().rstrip("\n"))
+        for name, kind, value in (("api_requests_total", "counter", self.requests),
+                                  ("api_rejected_total", "counter", self.rejected),
+                                  ("api_errors_total", "counter", self.errors),
+                                  ("api_in_flight", "gauge", self.in_flight),
+                                  ("api_queue_depth", "gauge", self.waiting),
+                                  ("api_sessions_active", "gauge", len(session_store))):
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f'{name}{{pid="{pid}"}} {value}')
+        await self._send(writer, 200, "\n".join(lines) + "\n", keep_alive=keep_alive,
+                         content_type="text/plain; version=0.0.4")
+        return keep_alive
+
+    def _run_chat(self, payload: dict) -> dict:
+        session, history = resolve_session(payload, self.stateless)
+        stream = get_chatbot_response(payload["message"], history, stream=True, session=session)
+        stream.consume()
+        return chat_result(session, stream)
+
+    async def chat(self, body, writer, keep_alive) -> bool:
+        payload = parse_chat_request(body, self.stateless)
+        async with self.admit():
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, self._run_chat, payload)
+        await self._send(writer, 200, result, keep_alive=keep_alive)
+        return keep_alive
+
+    def _run_stream(self, payload: dict, loop, events: asyncio.Queue, cancelled: threading.Event):
+        def emit(kind: str, data):
+            loop.call_soon_threadsafe(events.put_nowait, (kind, data))
+
+        try:
+            session, history = resolve_session(payload, self.stateless)
+            stream = get_chatbot_response(payload["message"], history, stream=True, session=session)
+            deltas = iter(stream)
+            for delta in deltas:
+                if cancelled.is_set():
+                    deltas.close()  # releases the LLM connection; the trace is marked cancelled
+                    return
+                emit("delta", delta)
+            emit("done", chat_result(session, stream))
+        except Exception as e:
+            print(f"❌ Streaming chat failed: {e}")
+            emit("error", "Internal server error")
+
+    async def chat_stream(self, body, writer, keep_alive) -> bool:
+        """Server-sent events: one `data: {"delta": ...}` per token, then `event: done` with the final state."""
+        payload = parse_chat_request(body, self.stateless)
+        async with self.admit():
+            loop = asyncio.get_running_loop()
+            events = asyncio.Queue()
+            cancelled = threading.Event()
+            worker = loop.run_in_executor(self.executor, self._run_stream, payload, loop, events, cancelled)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\n")
+            try:
+                while True:
+                    kind, data = await events.get()
+                    if kind == "delta":
+                        writer.write(f"data: {json.dumps({'delta': data}, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    else:
+                        writer.write(f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    await writer.drain()
+                    if kind != "delta":
+                        break
+            except (ConnectionError, asyncio.CancelledError):
+                cancelled.set()  # client went away: stop pulling tokens from the LLM
+                raise
+            finally:
+                # The slot is only released once the pipeline thread is done
+                await asyncio.shield(worker)
+        return False
+
+    # === Lifecycle ===
+    async def serve(self, sock: socket.socket, warm_up: bool = True):
+        loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        stopped = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stopped.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows: Ctrl+C raises KeyboardInterrupt instead
+
+        server = await asyncio.start_server(self.handle_connection, sock=sock, limit=self.max_body)
+        print(f"🌐 Worker {os.getpid()} serving on http://{sock.getsockname()[0]}:{sock.getsockname()[1]}")
+        if warm_up:
+            import warmup
+            await loop.run_in_executor(None, warmup.warm_up)
+        self.ready = True
+
+        try:
+            await stopped.wait()
+        finally:
+            # Stop accepting, fail readiness, let in-flight requests finish within the grace period
+            self.draining = True
+            server.close()
+            deadline = time.monotonic() + API_SHUTDOWN_GRACE
+            while (self.in_flight or self.waiting) and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            for writer in list(self._connections):
+                writer.close()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            print(f"🛑 Worker {os.getpid()} stopped.")
+
+
+# === Process model ===
+def preload():
+    """
+    Loads the index, tokenizer and embedding model in the parent before forking, so workers
+    share those pages copy-on-write instead of each loading its own copy. No forward pass
+    runs here: thread pools started by inference are not fork-safe, so each worker warms up
+    on its own. The ONNX backend builds its thread pools at load time and loads per worker.
+    """
+    from embed_query import EMBEDDING_BACKEND, get_model
+    from tokens import count_tokens
+    from similarity import get_retriever
+
+    with startup.timed("preload before fork"):
+        get_retriever()
+        count_tokens("warm up")
+        if EMBEDDING_BACKEND != "onnx":
+            get_model()
+
+
+def _limit_threads(workers: int):
+    """Splits the cores between worker processes (as embed_chunks.py does for its encoders)."""
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+def _flush_logs():
+    sys.stdout.flush()
+    query_log.close()
+    if tracing.recorder.writer is not None:
+        tracing.recorder.writer.close()
+
+
+def run_worker(sock: socket.socket, args, workers: int = 1):
+    _limit_threads(workers)
+    # Workers share no memory, so with more than one the state must travel with each request
+    api = ChatAPI(args.max_concurrency, args.max_queue, args.queue_timeout, args.max_body,
+                  stateless=args.stateless or workers > 1)
+    try:
+        asyncio.run(api.serve(sock, warm_up=not args.no_warmup))
+    except KeyboardInterrupt:
+        pass
+
+
+def _fork_worker(sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    # Child: default signal handling, serve, then exit without returning into the supervisor loop
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    code = 0
+    try:
+        run_worker(sock, args, args.workers)
+    except Exception as e:
+        print(f"❌ Worker {os.getpid()} crashed: {e}")
+        code = 1
+    finally:
+        _flush_logs()
+        os._exit(code)
+
+
+def supervise(sock: socket.socket, args):
+    """Forks the workers, restarts any that die unexpectedly and forwards SIGTERM / SIGINT."""
+    workers = {_fork_worker(sock, args) for _ in range(args.workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"🚀 Supervisor {os.getpid()} started {len(workers)} workers")
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"⚠️ Worker {pid} exited with status {status}; restarting it.")
+            workers.add(_fork_worker(sock, args))
+    print("🛑 All workers stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless HTTP chat API (JSON and server-sent events)")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="worker processes (fork-after-load)")
+    parser.add_argument("--max-concurrency", type=int, default=API_MAX_CONCURRENCY)
+    parser.add_argument("--max-queue", type=int, default=API_MAX_QUEUE)
+    parser.add_argument("--queue-timeout", type=float, default=API_QUEUE_TIMEOUT)
+    parser.add_argument("--max-body", type=int, default=API_MAX_BODY)
+    parser.add_argument("--backlog", type=int, default=1024)
+    parser.add_argument("--no-warmup", action="store_true", help="report ready before the first encode")
+    parser.add_argument("--stateless", action="store_true", default=API_STATELESS,
+                        help="keep no sessions; clients send history and fallback state (always on with --workers > 1)")
+    args = parser.parse_args()
+
+    sock = socket.create_server((args.host, args.port), backlog=args.backlog)
+    if args.workers > 1 and not hasattr(os, "fork"):
+        print("⚠️ Multiple workers need os.fork (not available on Windows); running a single worker.")
+        args.workers = 1
+    if args.workers == 1:
+        run_worker(sock, args)
+        return
+    print("ℹ️ Several workers: the API is stateless, clients send 'history' and 'fallback' with each message.")
+    preload()
+    supervise(sock, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+
+# === Benchmark defaults ===
+DEFAULT_SIZES = (1_000, 10_000, 100_000)   # synthetic corpus sizes in chunks (up to 1_000_000)
+DEFAULT_DIM = 768                           # e5-base-v2 embedding size
+DEFAULT_QUERIES = 200
+DEFAULT_TOP_K = 3
+RESULTS_DIR = Path("Source Code/Assets/benchmarks")
+
+CATEGORIES = ("Smartphones", "Laptops", "Desktops", "Tablets", "Monitors", "Headphones", "Accessories")
+BRANDS = ("Apple", "Samsung", "Dell", "HP", "Lenovo", "ASUS", "Sony", "Google", "Microsoft", "Acer")
+FEATURES = (
+    "{ram}GB RAM", "{storage}GB NVMe storage", "{size}\" OLED display ({hz}Hz)", "Wi-Fi 6E, Bluetooth 5.3",
+    "{battery} mAh battery with fast charging", "{mp}MP main camera", "USB-C, Thunderbolt 4", "Backlit keyboard",
+    "Octa-core processor", "Active noise cancellation", "IP68 water resistance", "{weight} kg aluminium chassis",
+)
+FAQ_SECTIONS = ("Orders", "Shipping", "Payments", "Returns", "Warranty", "Account")
+FAQ_TOPICS = ("track my order", "change my delivery address", "pay with a gift card", "return an opened item",
+              "claim warranty for a cracked screen", "reset my password", "get an invoice", "cancel a pre-order")
+POLICY_SECTIONS = ("Returns Policy", "Warranty Policy", "Shipping Policy", "Privacy Policy", "Price Match Policy")
+CHAT_QUESTIONS = (
+    "What is the price of the {brand} {category} model {n}?", "Do you have a {category} with {ram}GB RAM under ${price}?",
+    "How can I {topic}?", "What does the warranty cover for {brand} {category}?", "Can I {topic} after {n} days?",
+)
+
+
+# === Synthetic corpus ===
+def synthetic_chunks(n: int, seed: int = 0) -> list:
+    """
+    Chunks in the same shape preprocess_chunks.py writes to chunks.jsonl: about 80% products,
+    15% FAQs and 5% policies, with unique model numbers and realistic field values.
+    """
+    rng = np.random.default_rng(seed)
+    kinds = rng.choice(3, size=n, p=(0.80, 0.15, 0.05))
+    chunks = []
+    for i, kind in enumerate(kinds):
+        if kind == 0:
+            category, brand = CATEGORIES[i % len(CATEGORIES)], BRANDS[int(rng.integers(len(BRANDS)))]
+            model, price = f"QA-{i:07d}", int(rng.integers(49, 4000))
+            name = f"{brand} {category[:-1] if category.endswith('s') else category} {i}"
+            values = {"ram": 2 ** int(rng.integers(2, 7)), "storage": 2 ** int(rng.integers(6, 12)),
+                      "size": round(float(rng.uniform(5, 32)), 1), "hz": int(rng.choice((60, 90, 120, 144))),
+                      "battery": int(rng.integers(3000, 6000)), "mp": int(rng.choice((12, 48, 50, 200))),
+                      "weight": round(float(rng.uniform(0.2, 3.0)), 1)}
+            features = "\n".join(f"- {FEATURES[j].format(**values)}"
+                                 for j in rng.choice(len(FEATURES), size=6, replace=False))
+            chunks.append({
+                "type": "product", "category": category, "name": name, "brand": brand, "model": model,
+                "price_usd": price,
+                "content": f"Product: {name}\nBrand: {brand}\nCategory: {category}\nModel: {model}\n"
+                           f"Price: ${price}\nKey Features:\n{features}",
+            })
+        elif kind == 1:
+            section, topic = FAQ_SECTIONS[i % len(FAQ_SECTIONS)], FAQ_TOPICS[int(rng.integers(len(FAQ_TOPICS)))]
+            question = f"How can I {topic} (case {i})?"
+            answer = (f"You can {topic} from 'My Account' within {int(rng.integers(1, 30))} days. "
+                      f"Contact support through live chat if the option is not shown.")
+            chunks.append({"type": "faq", "section": section, "question": question, "answer": answer,
+                           "content": f"Q: {question}\nA: {answer}"})
+        else:
+            section = f"{POLICY_SECTIONS[i % len(POLICY_SECTIONS)]} {i}"
+            policy = " ".join(f"Clause {c + 1}: items must be returned within {int(rng.integers(7, 31))} days "
+                              f"in original condition with all accessories." for c in range(int(rng.integers(3, 8))))
+            chunks.append({"type": "policy", "section": section, "policy": policy, "content": f"{section}:\n{policy}"})
+    return chunks
+
+
+def synthetic_questions(n: int, seed: int = 1) -> list:
+    rng = np.random.default_rng(seed)
+    questions = []
+    for i in range(n):
+        template = CHAT_QUESTIONS[i % len(CHAT_QUESTIONS)]
+        questions.append(template.format(
+            brand=BRANDS[int(rng.integers(len(BRANDS)))], category=CATEGORIES[int(rng.integers(len(CATEGORIES)))],
+            n=i, ram=2 ** int(rng.integers(2, 7)), price=int(rng.integers(300, 3000)),
+            topic=FAQ_TOPICS[int(rng.integers(len(FAQ_TOPICS)))]))
+    return questions
+
+
+# === Helpers ===
+def latency_stats(seconds: list) -> dict:
+    """count / mean / p50 / p95 / p99 / max of a list of durations, in milliseconds."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000 if len(seconds) else np.zeros(1)
+    return {
+        "count": len(seconds),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def _timed_build(build):
+    """Runs build() and returns (result, seconds, peak traced allocation in MB)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = build()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def _time_queries(search, queries) -> dict:
+    durations = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        durations.append(time.perf_counter() - start)
+    return latency_stats(durations)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def run_metadata(args) -> dict:
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key != "func"},
+    }
+
+
+# === Retrieval: top-k search latency and memory ===
+def bench_search(size: int, dim: int = DEFAULT_DIM, queries: int = DEFAULT_QUERIES, top_k: int = DEFAULT_TOP_K,
+                 backends: tuple = ("exact",), seed: int = 0) -> dict:
+    """
+    Builds exact, BM25, hybrid, metadata-filtered and the requested ANN indexes over `size` synthetic chunks with
+    clustered random vectors, then times single-query top-k search on each.
+    """
+    from ann import HNSWIndex, IVFIndex, evaluate_recall, synthetic_vectors
+    from bm25 import BM25Index, reciprocal_rank_fusion
+    from metadata_index import MetadataIndex, parse_filters
+    from similarity import HYBRID_CANDIDATES, RRF_K, ChunkIndex
+    from vector_store import _normalize_rows
+
+    rng = np.random.default_rng(seed + 1)
+    chunks, corpus_seconds, _ = _timed_build(lambda: synthetic_chunks(size, seed))
+    vectors, vector_seconds, _ = _timed_build(lambda: synthetic_vectors(size, dim, seed=seed))
+    sample = vectors[rng.choice(size, size=min(queries, size), replace=False)]
+    query_vectors = _normalize_rows(sample + 0.05 * rng.normal(size=sample.shape).astype(np.float32))
+    query_texts = synthetic_questions(len(query_vectors), seed + 2)
+
+    result = {"size": size, "dim": dim, "top_k": top_k,
+              "corpus_seconds": corpus_seconds, "vector_seconds": vector_seconds,
+              "vector_matrix_mb": vectors.nbytes / 2 ** 20, "indexes": {}}
+
+    exact, seconds, peak = _timed_build(lambda: ChunkIndex(vectors, chunks, normalized=True))
+    result["indexes"]["exact"] = {"build_seconds": seconds, "build_peak_mb": peak,
+                                  "search": _time_queries(lambda q: exact.top_k_indices(q, top_k), query_vectors)}
+
+    lexical, seconds, peak = _timed_build(lambda: BM25Index.build(chunks))
+    result["indexes"]["bm25"] = {"build_seconds": seconds, "build_peak_mb": peak,
+                                 "index_mb": (lexical.doc_ids.nbytes + lexical.tfs.nbytes + lexical.indptr.nbytes) / 2 ** 20,
+                                 "search": _time_queries(lambda q: lexical.top_k(q, top_k), query_texts)}
+
+    candidates = max(top_k, HYBRID_CANDIDATES)
+
+    def hybrid(pair):
+        vector, text = pair
+        dense_rows = exact.top_k_indices(vector, candidates)[0]
+        return reciprocal_rank_fusion([dense_rows, lexical.top_k(text, candidates)], k=RRF_K)[:top_k]
+
+    result["indexes"]["hybrid"] = {"search": _time_queries(hybrid, list(zip(query_vectors, query_texts)))}
+
+    metadata, seconds, peak = _timed_build(lambda: MetadataIndex.build(chunks))
+    filtered = [(vector, filters, len(rows)) for vector, text in zip(query_vectors, query_texts)
+                if (filters := parse_filters(text, metadata)) and len(rows := metadata.select(filters))]
+    result["indexes"]["filtered"] = {
+        "build_seconds": seconds, "build_peak_mb": peak,
+        "index_mb": (metadata.rows.nbytes + metadata.price_rows.nbytes + metadata.prices.nbytes) / 2 ** 20,
+        "filtered_queries": len(filtered),
+        "mean_rows_scanned": float(np.mean([count for _, _, count in filtered])) if filtered else 0.0,
+        # Row selection from the partitions is part of the measured search
+        "search": _time_queries(lambda item: exact.top_k_in_rows(item[0], metadata.select(item[1]), top_k), filtered),
+    }
+
+    for backend in backends:
+        if backend == "ivf":
+            ann_index, seconds, peak = _timed_build(lambda: IVFIndex.build(vectors))
+        elif backend == "hnsw":
+            if not HNSWIndex.available():
+                result["indexes"]["hnsw"] = {"skipped": "hnswlib is not installed"}
+                continue
+            ann_index, seconds, peak = _timed_build(lambda: HNSWIndex.build(vectors))
+        else:
+            continue
+        recall = evaluate_recall(ann_index, exact, query_vectors, top_k=10)
+        result["indexes"][backend] = {"build_seconds": seconds, "build_peak_mb": peak,
+                                      "index_mb": len(ann_index.to_bytes()) / 2 ** 20,
+                                      "recall_at_10": recall["recall_at_k"],
+                                      "search": _time_queries(lambda q: ann_index.top_k_indices(q, top_k), query_vectors)}
+    return result
+
+
+# === Embedding throughput ===
+def bench_embedding(passages: int = 512, queries: int = 100, batch_size: int = 32, seed: int = 0) -> dict:
+    """
+    Passage encoding throughput (as in embed_chunks.py) and single-query latency (as in
+    embed_user_query, bypassing its cache) with the configured EMBEDDING_BACKEND.
+    """
+    from embed_chunks import passage_text
+    from embed_query import EMBEDDING_BACKEND, MODEL_NAME, get_model, normalize_query
+
+    start = time.perf_counter()
+    model = get_model()
+    load_seconds = time.perf_counter() - start
+    texts = [passage_text(chunk) for chunk in synthetic_chunks(passages, seed)]
+    model.encode(texts[:batch_size], batch_size=batch_size, convert_to_numpy=True)  # warm up
+
+    start = time.perf_counter()
+    model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    passage_seconds = time.perf_counter() - start
+
+    questions = [normalize_query(question) for question in synthetic_questions(queries, seed + 1)]
+    query_latency = _time_queries(lambda text: model.encode(text, convert_to_numpy=True), questions)
+    return {
+        "model": MODEL_NAME,
+        "backend": EMBEDDING_BACKEND,
+        "model_load_seconds": load_seconds,
+        "passages": passages,
+        "batch_size": batch_size,
+        "passages_per_sec": passages / passage_seconds,
+        "query": query_latency,
+        "queries_per_sec": 1000 / query_latency["mean_ms"] if query_latency["mean_ms"] else 0.0,
+    }
+
+
+# === End-to-end chat turns against the mock LLM ===
+def bench_chat(turns: int = 50, tokens_per_sec: float = 50, first_token_delay: float = 0.2, error_rate: float = 0,
+               error_status: int = 502, index_size: int = 0, seed: int = 0) -> dict:
+    """
+    Runs full get_chatbot_response turns (streamed, one fresh session each) against a local
+    mock LLM server. Uses the real index unless `index_size` asks for a synthetic one, whose
+    random vectors only make sense for latency, not answer quality.
+
+    Stage timings come from the request traces (tracing.py); wall-clock, time to first
+    token and error counts are measured here as well.
+    """
+    import llm_interface
+    import similarity
+    import tracing
+    from ProgramEngine import get_chatbot_response
+    from mock_llm_server import MockLLMConfig, start_mock_server
+    from sessions import ChatSession
+
+    config = MockLLMConfig(tokens_per_sec=tokens_per_sec, first_token_delay=first_token_delay,
+                           error_rate=error_rate, error_status=error_status)
+    server, url = start_mock_server(config=config)
+    llm_interface.OPENROUTER_API_URL = url
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if index_size:
+            from ann import synthetic_vectors
+            from embed_chunks import SIDECARS
+            from vector_store import write_index
+
+            write_index(Path(tmp), synthetic_chunks(index_size, seed), synthetic_vectors(index_size, seed=seed),
+                        sidecars=SIDECARS)
+            similarity._retriever = similarity.Retriever(Path(tmp))
+
+        try:
+            # Load the model and index outside the measured turns
+            get_chatbot_response("warm up", [], session=ChatSession("benchmark-warmup"))
+            skip = {trace["trace_id"] for trace in tracing.recorder.traces()}
+
+            totals, first_tokens, failures = [], [], 0
+            for i, question in enumerate(synthetic_questions(turns, seed + 3)):
+                start = time.perf_counter()
+                stream = get_chatbot_response(question, [], stream=True, session=ChatSession(f"benchmark-{i}"))
+                first = None
+                for _ in stream:
+                    if first is None:
+                        first = time.perf_counter() - start
+                totals.append(time.perf_counter() - start)
+                first_tokens.append(first if first is not None else totals[-1])
+                failures += stream.failed
+        finally:
+            server.shutdown()
+            if index_size:
+                similarity._retriever = None
+
+    traces = [trace for trace in tracing.recorder.traces() if trace["trace_id"] not in skip]
+    return {
+        "turns": turns,
+        "mock_llm": {"tokens_per_sec": tokens_per_sec, "first_token_delay": first_token_delay,
+                     "error_rate": error_rate, "error_status": error_status},
+        "index_size": index_size or len(similarity.get_vector_store()),
+        "failed_turns": failures,
+        "total": latency_stats(totals),
+        "time_to_first_token": latency_stats(first_tokens),
+        "stages": tracing.summarize(traces),
+    }
+
+
+def bench_routing(requests: int = 200, concurrency: int = 8, first_token_delay: float = 0.1, slow_rate: float = 0.05,
+                  slow_delay: float = 2.0, error_rate: float = 0, error_status: int = 502, seed: int = 0) -> dict:
+    """
+    Streams LLM requests through llm_router against two local mock servers: a primary with
+    injected tail delays (`slow_rate` of requests wait `slow_delay` more seconds) and errors,
+    and a healthy secondary. Runs the primary alone, primary + failover, and primary +
+    failover + hedging, each on fresh servers, and reports time to first token and routing
+    statistics for each.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from llm_router import Route, Router
+    from mock_llm_server import MockLLMConfig, start_mock_server
+
+    questions = synthetic_questions(requests, seed + 5)
+    results = {}
+    for name, use_secondary, hedging in (("single", False, False), ("failover", True, False), ("hedged", True, True)):
+        primary, primary_url = start_mock_server(config=MockLLMConfig(
+            tokens_per_sec=0, first_token_delay=first_token_delay, slow_rate=slow_rate, slow_delay=slow_delay,
+            error_rate=error_rate, error_status=error_status))
+        secondary, secondary_url = start_mock_server(config=MockLLMConfig(tokens_per_sec=0, first_token_delay=first_token_delay))
+        routes = [Route("primary", primary_url)] + ([Route("secondary", secondary_url)] if use_secondary else [])
+        router = Router(routes, hedging=hedging)
+
+        def turn(question: str):
+            start = time.perf_counter()
+            success, response = router.query([{"role": "user", "content": question}], retry_delay=0.05, stream=True)
+            first = None
+            if success:
+                for _ in response:
+                    if first is None:
+                        first = time.perf_counter() - start
+            return success, first if first is not None else time.perf_counter() - start
+
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(turn, questions))
+        finally:
+            primary.shutdown()
+            secondary.shutdown()
+        results[name] = {
+            "failed": sum(not success for success, _ in outcomes),
+            "time_to_first_token": latency_stats([seconds for _, seconds in outcomes]),
+            "routes": router.status(),
+        }
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "mock_llm": {"first_token_delay": first_token_delay, "slow_rate": slow_rate, "slow_delay": slow_delay,
+                     "error_rate": error_rate, "error_status": error_status},
+        "configs": results,
+    }
+
+
+# === Comparing runs ===
+def _flatten(data, prefix: str = "") -> dict:
+    flat = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(_flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(data, list):
+        for i, value in enumerate(data):
+            label = value.get("size", i) if isinstance(value, dict) else i
+            flat.update(_flatten(value, f"{prefix}[{label}]"))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        flat[prefix] = float(data)
+    return flat
+
+
+def compare(baseline: dict, candidate: dict, threshold: float = 0.10) -> list:
+    """
+    Numeric metrics present in both result files with their relative change. Latency-like
+    metrics (ms / seconds / mb) regress when they grow; throughput and recall when they shrink.
+    """
+    old, new = _flatten(baseline.get("results", {})), _flatten(candidate.get("results", {}))
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] == 0:
+            continue
+        change = (new[key] - old[key]) / abs(old[key])
+        higher_is_better = any(word in key for word in ("per_sec", "recall"))
+        regressed = change < -threshold if higher_is_better else change > threshold
+        improved = change > threshold if higher_is_better else change < -threshold
+        rows.append({"metric": key, "baseline": old[key], "candidate": new[key], "change": change,
+                     "verdict": "regressed" if regressed else "improved" if improved else ""})
+    return rows
+
+
+def write_results(results: dict, output: Path) -> Path:
+    output = Path(output)
+    if output.suffix != ".json":
+        output.mkdir(parents=True, exist_ok=True)
+        output = output / f"{results['meta']['timestamp'][:19].replace(':', '')}-{results['meta']['git_commit'] or 'run'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2, default=str), encoding="utf-8")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval, embedding and end-to-end chat latency benchmarks")
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR,
+                        help="result file (.json) or directory for a timestamped file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="top-k search latency and memory on synthetic corpora")
+    search.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    search.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    search.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    search.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    search.add_argument("--ann", choices=("ivf", "hnsw"), nargs="*", default=[])
+
+    embedding = commands.add_parser("embedding", help="passage throughput and query latency of the embedding model")
+    embedding.add_argument("--passages", type=int, default=512)
+    embedding.add_argument("--queries", type=int, default=100)
+    embedding.add_argument("--batch-size", type=int, default=32)
+
+    chat = commands.add_parser("chat", help="full get_chatbot_response turns against a local mock LLM")
+    chat.add_argument("--turns", type=int, default=50)
+    chat.add_argument("--tokens-per-sec", type=float, default=50)
+    chat.add_argument("--first-token-delay", type=float, default=0.2)
+    chat.add_argument("--error-rate", type=float, default=0)
+    chat.add_argument("--error-status", type=int, default=502)
+    chat.add_argument("--index-size", type=int, default=0, help="use a synthetic index of N chunks instead of the real one")
+
+    routing = commands.add_parser("routing", help="LLM hedging and failover (llm_router) against local mock servers")
+    routing.add_argument("--requests", type=int, default=200)
+    routing.add_argument("--concurrency", type=int, default=8)
+    routing.add_argument("--first-token-delay", type=float, default=0.1)
+    routing.add_argument("--slow-rate", type=float, default=0.05, help="share of primary requests delayed by --slow-delay")
+    routing.add_argument("--slow-delay", type=float, default=2.0)
+    routing.add_argument("--error-rate", type=float, default=0, help="primary error rate")
+    routing.add_argument("--error-status", type=int, default=502)
+
+    corpus = commands.add_parser("corpus", help="write a synthetic chunks.jsonl")
+    corpus.add_argument("size", type=int)
+    corpus.add_argument("path", type=Path)
+
+    diff = commands.add_parser("compare", help="compare two result files")
+    diff.add_argument("baseline", type=Path)
+    diff.add_argument("candidate", type=Path)
+    diff.add_argument("--threshold", type=float, default=0.10, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    if args.command == "corpus":
+        from preprocess_chunks import write_jsonl
+        print(f"✅ Wrote {write_jsonl(synthetic_chunks(args.size), args.path)} chunks to {args.path}")
+        return
+    if args.command == "compare":
+        rows = compare(json.loads(args.baseline.read_text(encoding="utf-8")),
+                       json.loads(args.candidate.read_text(encoding="utf-8")), args.threshold)
+        for row in rows:
+            print(f"{row['metric']:<60} {row['baseline']:>12.3f} → {row['candidate']:>12.3f} "
+                  f"{row['change']:>+8.1%} {row['verdict']}")
+        regressions = sum(row["verdict"] == "regressed" for row in rows)
+        print(f"{'❌' if regressions else '✅'} {regressions} regressions over {len(rows)} metrics")
+        raise SystemExit(1 if regressions else 0)
+
+    if args.command == "search":
+        results = [bench_search(size, args.dim, args.queries, args.top_k, tuple(["exact", *args.ann]))
+                   for size in args.sizes]
+    elif args.command == "embedding":
+        results = bench_embedding(args.passages, args.queries, args.batch_size)
+    elif args.command == "routing":
+        results = bench_routing(args.requests, args.concurrency, args.first_token_delay, args.slow_rate,
+                                args.slow_delay, args.error_rate, args.error_status)
+    else:
+        results = bench_chat(args.turns, args.tokens_per_sec, args.first_token_delay, args.error_rate,
+                             args.error_status, args.index_size)
+
+    output = write_results({"benchmark": args.command, "meta": run_metadata(args), "results": results}, args.output)
+    print(json.dumps(results, indent=2))
+    print(f"✅ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import io
+import json
+import re
+import numpy as np
+
+# === BM25 parameters ===
+K1 = 1.5
+B = 0.75
+
+# Product fields repeated into the indexed text so exact brand / model tokens weigh more than prose
+BOOSTED_FIELDS = ("name", "brand", "model")
+
+# Words people wrap around a bare model number ("model A3109", "sku #SM-F946B")
+SKU_FILLER_WORDS = {"model", "sku", "part", "number", "no", "item", "product"}
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-/.][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> list:
+    """
+    Lowercased alphanumeric tokens. Hyphenated / slashed codes such as "SM-F946B" are kept
+    whole, split into their parts and joined without separators, so "sm-f946b", "smf946b"
+    and "f946b" all match the same product.
+    """
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-/.]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+            tokens.append("".join(parts))
+    return tokens
+
+
+def sku_key(text: str) -> str:
+    """Separator- and case-insensitive form of a model number / SKU."""
+    return re.sub(r"[^a-z0-9]", "", text.lower())
+
+
+def indexed_text(record: dict) -> str:
+    extra = " ".join(str(record[field]) for field in BOOSTED_FIELDS if record.get(field))
+    return f"{record.get('content', '')} {extra}"
+
+
+class BM25Index:
+    """
+    Okapi BM25 over chunk records with compact CSR postings.
+
+    Postings for term t live in doc_ids[indptr[t]:indptr[t + 1]] (int32 rows) with matching
+    term frequencies in tfs (float32). Product model numbers are also kept in an exact-match
+    table so an obvious SKU query resolves without any scoring.
+    """
+
+    def __init__(self, vocab: list, indptr: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_lengths: np.ndarray, exact: dict, k1: float = K1, b: float = B):
+        self.vocab = {term: i for i, term in enumerate(vocab)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.exact = exact
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(doc_lengths)
+        avg_length = float(doc_lengths.mean()) if self.num_docs else 0.0
+        df = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((self.num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # Per-document length normalization is fixed, so precompute it once
+        self.length_norm = (k1 * (1 - b + b * doc_lengths / (avg_length or 1.0))).astype(np.float32)
+
+    @classmethod
+    def build(cls, records) -> "BM25Index":
+        """Builds the index from an iterable of chunk records (row order = index order)."""
+        term_ids = {}
+        postings = []  # per term: {row: tf}
+        doc_lengths = []
+        exact = {}
+        for row, record in enumerate(records):
+            tokens = tokenize(indexed_text(record))
+            doc_lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                term = term_ids.setdefault(token, len(term_ids))
+                if term == len(postings):
+                    postings.append({})
+                postings[term][row] = tf
+            if record.get("model"):
+                exact.setdefault(sku_key(str(record["model"])), []).append(row)
+
+        vocab = [None] * len(term_ids)
+        for term, i in term_ids.items():
+            vocab[i] = term
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        doc_ids = np.fromiter((row for p in postings for row in p), dtype=np.int32, count=int(indptr[-1]))
+        tfs = np.fromiter((tf for p in postings for tf in p.values()), dtype=np.float32, count=int(indptr[-1]))
+        return cls(vocab, indptr, doc_ids, tfs, np.asarray(doc_lengths, dtype=np.float32), exact)
+
+    def to_bytes(self) -> bytes:
+        """Serializes the index as an .npz blob (stored as an index sidecar)."""
+        vocab = [None] * len(self.vocab)
+        for term, i in self.vocab.items():
+            vocab[i] = term
+        buffer = io.BytesIO()
+        np.savez(buffer, indptr=self.indptr, doc_ids=self.doc_ids, tfs=self.tfs, doc_lengths=self.doc_lengths,
+                 vocab=np.frombuffer(json.dumps(vocab).encode("utf-8"), dtype=np.uint8),
+                 exact=np.frombuffer(json.dumps(self.exact).encode("utf-8"), dtype=np.uint8),
+                 params=np.array([self.k1, self.b], dtype=np.float64))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data) -> "BM25Index":
+        with np.load(io.BytesIO(bytes(data)), allow_pickle=False) as npz:
+            vocab = json.loads(npz["vocab"].tobytes().decode("utf-8"))
+            exact = json.loads(npz["exact"].tobytes().decode("utf-8"))
+            k1, b = npz["params"]
+            return cls(vocab, npz["indptr"], npz["doc_ids"], npz["tfs"], npz["doc_lengths"], exact, float(k1), float(b))
+
+    @classmethod
+    def load(cls, path) -> "BM25Index":
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+    def score(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query (zeros where no term matches)."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            start, end = self.indptr[term], self.indptr[term + 1]
+            rows = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            scores[rows] += self.idf[term] * tf * (self.k1 + 1) / (tf + self.length_norm[rows])
+        return scores
+
+    def top_k(self, query: str, top_k: int = 10) -> np.ndarray:
+        """Rows of the top-k matching documents, best first. Documents with score 0 are left out."""
+        scores = self.score(query)
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        return matched[np.argsort(-scores[matched], kind="stable")]
+
+    def exact_lookup(self, query: str) -> list:
+        """
+        Rows whose model number equals the query, when the query is just a model / SKU string
+        (optionally wrapped in words like "model" or "sku"). Returns [] otherwise.
+        """
+        words = [word for word in re.split(r"\s+", query.strip().strip("?!.,:;#\"'")) if word]
+        words = [word for word in words if word.lower().strip("#:") not in SKU_FILLER_WORDS]
+        candidate = sku_key("".join(words))
+        # Must look like a code (letters and digits, or a long digit string), not a plain word
+        if len(candidate) < 4 or not re.search(r"\d", candidate):
+            return []
+        return list(self.exact.get(candidate, []))
+
+
+def build_bytes(records, vectors=None) -> bytes:
+    """Index sidecar builder used by embed_chunks.py."""
+    return BM25Index.build(records).to_bytes()
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """
+    Merges several best-first lists of row ids with RRF: score(row) = sum(1 / (k + rank)).
+
+    Returns:
+        list: Row ids, best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, 1):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
@@ -1,42 +1,443 @@
+import argparse
+import hashlib
+import itertools
 import json
-import pickle
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
+import numpy as np
 from tqdm import tqdm
-from sentence_transformers import SentenceTransformer
+from preprocess_chunks import OUTPUT_PATH, read_chunks
+from vector_store import INDEX_DIR, IndexWriter, load_index, read_header
+import ann
+import bm25
+import metadata_index
 
 # === Paths ===
-CHUNKS_PATH = Path("Source Code/Assets/chunks.json")
-EMBEDDINGS_PATH = Path("Source Code/Assets/embedded_chunks.pkl")
-
-# === Load chunks ===
-with open(CHUNKS_PATH, "r", encoding="utf-8") as f:
-    chunks = json.load(f)
-
-# === Load the embedding model ===
-print("🔄 Loading model: intfloat/e5-base-v2 ...")
-model = SentenceTransformer("intfloat/e5-base-v2")
-print("✅ Model loaded.")
-
-# === Prepare texts for embedding ===
-texts_to_embed = [f"passage: {chunk['content']}" for chunk in chunks]
-
-# === Generate embeddings ===
-print(f"🔍 Generating embeddings for {len(texts_to_embed)} chunks...")
-embeddings = model.encode(texts_to_embed, show_progress_bar=True, convert_to_numpy=True)
-
-# === Attach embeddings to chunks (cleaner version) ===
-embedded_chunks = []
-for chunk, embedding in zip(chunks, embeddings):
-    embedded_chunks.append({
-        "type": chunk.get("type", ""),
-        "section": chunk.get("section", ""),
-        "content": chunk["content"],
-        "embedding": embedding
-    })
-
-# === Save to .pkl ===
-EMBEDDINGS_PATH.parent.mkdir(parents=True, exist_ok=True)
-with open(EMBEDDINGS_PATH, "wb") as f:
-    pickle.dump(embedded_chunks, f)
-
-print(f"✅ Embedded chunks saved to {EMBEDDINGS_PATH}")
+CHUNKS_PATH = OUTPUT_PATH  # chunks.jsonl (a legacy chunks.json is read if it is missing)
+EMBEDDINGS_PATH = INDEX_DIR
+
+# === Settings ===
+MODEL_NAME = "intfloat/e5-base-v2"
+VECTOR_DTYPE = "float32"  # "float16" halves the vector file at a small precision cost
+BUILD_BATCH_SIZE = int(os.getenv("EMBED_BUILD_BATCH_SIZE", "256"))  # chunks per work unit / checkpoint step
+BUILD_WORKERS = int(os.getenv("EMBED_BUILD_WORKERS", "1"))          # encoder processes; 1 encodes in-process
+
+# Staging area of a full build: each finished batch is appended to the new generation's
+# temporary files and recorded in checkpoint.json, so an interrupted build resumes where it stopped
+STAGING_DIR_NAME = "staging"
+CHECKPOINT_FILE = "checkpoint.json"
+
+# Auxiliary indexes rebuilt from the records on every write, stored next to the vectors
+SIDECARS = {"bm25": bm25.build_bytes, "metadata": metadata_index.build_bytes}
+
+
+def configured_ann(index_dir: Path = EMBEDDINGS_PATH) -> list:
+    """ANN backends built with the existing index (indexes without a "sidecars" list: from its files)."""
+    header = read_header(index_dir)
+    if header is None:
+        return []
+    return sorted(name for name in header.get("sidecars", header["files"]) if name in ann.SIDECAR_BUILDERS)
+
+
+def build_sidecars(index_dir: Path = EMBEDDINGS_PATH, add_ann=(), drop_ann=()) -> dict:
+    """
+    Sidecar builders for the next write of `index_dir`: BM25, metadata and every ANN backend
+    the current index was built with, so a later full or incremental build keeps them,
+    plus `add_ann` and minus `drop_ann`.
+    """
+    backends = (set(configured_ann(index_dir)) | set(add_ann)) - set(drop_ann)
+    return {**SIDECARS, **{backend: ann.SIDECAR_BUILDERS[backend] for backend in sorted(backends)}}
+
+
+def passage_text(chunk: dict) -> str:
+    """The exact text the model sees for a chunk (e5 expects the 'passage:' prefix)."""
+    return f"passage: {chunk['content']}"
+
+
+def passage_hash(chunk: dict) -> str:
+    return hashlib.sha256(passage_text(chunk).encode("utf-8")).hexdigest()
+
+
+def chunk_key(chunk: dict) -> str:
+    """
+    Stable identity of a chunk across rebuilds, used to tell an edited chunk
+    ("updated") apart from a brand new one ("added").
+    """
+    if chunk.get("id"):
+        return chunk["id"]
+    chunk_type = chunk.get("type", "")
+    if chunk_type == "faq" and chunk.get("question"):
+        return f"faq:{chunk['question']}"
+    if chunk_type == "product" and chunk.get("model"):
+        return f"product:{chunk.get('brand', '')}:{chunk['model']}"
+    if chunk_type == "policy" and chunk.get("section"):
+        return f"policy:{chunk['section']}"
+    return f"{chunk_type}:{passage_hash(chunk)}"
+
+
+def load_model():
+    from sentence_transformers import SentenceTransformer
+
+    print(f"🔄 Loading model: {MODEL_NAME} ...")
+    model = SentenceTransformer(MODEL_NAME)
+    print("✅ Model loaded.")
+    return model
+
+
+def encode_chunks(chunks: list, model=None) -> np.ndarray:
+    """Encodes chunks with the 'passage:' prefix. Loads the model on demand."""
+    if not chunks:
+        return np.zeros((0, 0), dtype=np.float32)
+    model = model or load_model()
+    texts_to_embed = [passage_text(chunk) for chunk in chunks]
+    print(f"🔍 Generating embeddings for {len(texts_to_embed)} chunks...")
+    return model.encode(texts_to_embed, show_progress_bar=True, convert_to_numpy=True)
+
+
+def _tag_chunks(chunks):
+    """Yields copies of the chunks with their stable key and passage hash attached, as stored in the index."""
+    for chunk in chunks:
+        yield {**chunk, "id": chunk_key(chunk), "hash": passage_hash(chunk)}
+
+
+def _batches(chunks, batch_size: int):
+    """Reads chunks lazily and yields them tagged, `batch_size` records at a time."""
+    records = _tag_chunks(chunks)
+    while batch := list(itertools.islice(records, batch_size)):
+        yield batch
+
+
+# === Streaming full build ===
+_worker_model = None
+
+
+def _init_worker(threads: int = 0):
+    """Loads the model once per encoder process; `threads` splits the cores between processes."""
+    global _worker_model
+    if threads:
+        import torch
+
+        torch.set_num_threads(threads)
+    _worker_model = load_model()
+
+
+def _encode_batch(batch_index: int, texts: list) -> tuple:
+    vectors = _worker_model.encode(texts, batch_size=32, convert_to_numpy=True)
+    return batch_index, np.asarray(vectors, dtype=np.float32)
+
+
+def _batch_id(records: list) -> str:
+    """Identifies one batch of build input, so a checkpoint is only resumed for the same chunks."""
+    digest = hashlib.sha256()
+    for record in records:
+        digest.update(record["hash"].encode("ascii"))
+    return digest.hexdigest()[:16]
+
+
+def _save_checkpoint(path: Path, checkpoint: dict):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _load_checkpoint(staging_dir: Path, dtype: str, batch_size: int) -> dict | None:
+    path = staging_dir / CHECKPOINT_FILE
+    if not path.exists() or not all(p.exists() for p in IndexWriter.staged_files(staging_dir).values()):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if (checkpoint.get("model"), checkpoint.get("dtype"), checkpoint.get("batch_size")) != (MODEL_NAME, dtype, batch_size):
+        return None
+    return checkpoint
+
+
+def build_full(chunks, index_dir: Path = EMBEDDINGS_PATH, dtype: str = VECTOR_DTYPE,
+               workers: int = BUILD_WORKERS, batch_size: int = BUILD_BATCH_SIZE, resume: bool = True,
+               sidecars: dict = None) -> dict:
+    """
+    Re-encodes every chunk and rewrites the index, streaming `chunks` (any iterable, e.g.
+    read_chunks()) in batches through `workers` encoder processes. Each encoded batch is
+    appended to the new generation's files under <index_dir>/staging, so only the batches
+    in flight are held in memory.
+
+    Each finished batch is flushed to disk before it is recorded in the checkpoint, so after
+    a crash or Ctrl+C the next run re-encodes nothing from the longest unchanged run of
+    leading batches. The staging area is removed once the index has been written. `sidecars`
+    defaults to build_sidecars(index_dir), keeping the ANN indexes of the current build.
+    """
+    sidecars = build_sidecars(index_dir) if sidecars is None else sidecars
+    staging_dir = Path(index_dir) / STAGING_DIR_NAME
+    checkpoint = _load_checkpoint(staging_dir, dtype, batch_size) if resume else None
+    done_ids = checkpoint["batches"] if checkpoint else []
+    batches = _batches(chunks, batch_size)
+
+    # Skip the leading batches an interrupted build already wrote, as long as they are unchanged
+    kept, rows, first_new = 0, 0, []
+    for batch in batches:
+        if kept < len(done_ids) and _batch_id(batch) == done_ids[kept]:
+            kept += 1
+            rows += len(batch)
+        else:
+            first_new = [batch]
+            break
+    if kept:
+        print(f"♻️ Resuming build: {kept} batches ({rows} chunks) already encoded")
+    else:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    checkpoint = {"model": MODEL_NAME, "dtype": dtype, "batch_size": batch_size,
+                  "dim": checkpoint["dim"] if kept else None, "batches": done_ids[:kept]}
+    writer = IndexWriter(index_dir, MODEL_NAME, dtype, work_dir=staging_dir, rows=rows, dim=checkpoint["dim"])
+    pending = itertools.chain(first_new, batches)
+
+    encoded_docs = 0
+    progress = tqdm(unit="doc")
+
+    def store(batch: list, encoded: np.ndarray):
+        nonlocal encoded_docs
+        writer.append(batch, encoded)
+        writer.sync()
+        checkpoint["dim"] = writer.dim
+        checkpoint["batches"].append(_batch_id(batch))
+        _save_checkpoint(staging_dir / CHECKPOINT_FILE, checkpoint)
+        encoded_docs += len(batch)
+        progress.update(len(batch))
+
+    def texts_for(batch: list) -> list:
+        return [passage_text(record) for record in batch]
+
+    print(f"🔍 Encoding chunks in batches of {batch_size} with {workers} worker(s)...")
+    started = time.perf_counter()
+    if workers <= 1:
+        for batch in pending:
+            if _worker_model is None:
+                _init_worker()
+            store(batch, _encode_batch(0, texts_for(batch))[1])
+    else:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        context = multiprocessing.get_context("spawn")  # torch is not fork-safe
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(threads,)) as pool:
+            # Keep a bounded number of batches in flight so memory stays flat on large catalogs;
+            # batches are appended in input order, so early finishers wait in `encoded`
+            numbered = enumerate(pending)
+            in_flight, submitted, encoded = set(), {}, {}
+
+            def submit_next():
+                item = next(numbered, None)
+                if item is not None:
+                    submitted[item[0]] = item[1]
+                    in_flight.add(pool.submit(_encode_batch, item[0], texts_for(item[1])))
+
+            for _ in range(2 * workers):
+                submit_next()
+            next_index = 0
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                in_flight.difference_update(finished)
+                for future in finished:
+                    batch_index, vectors = future.result()
+                    encoded[batch_index] = vectors
+                while next_index in encoded:
+                    store(submitted.pop(next_index), encoded.pop(next_index))
+                    next_index += 1
+                    submit_next()
+    progress.close()
+    elapsed = time.perf_counter() - started
+    if encoded_docs:
+        print(f"⚡ Encoded {encoded_docs} chunks in {elapsed:.1f}s ({encoded_docs / elapsed:.1f} docs/sec)")
+
+    header = writer.commit(sidecars)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    return header
+
+
+def _index_hashes(store) -> tuple:
+    """
+    Maps passage hash → first row and chunk key → passage hash for an existing index, plus
+    passage hash → key for rows stored without an id.
+    """
+    old_rows_by_hash = {}
+    old_hash_by_key = {}
+    legacy_key_by_hash = {}
+    for row, old in enumerate(tqdm(store, total=len(store), desc="Reading existing index")):
+        old_hash = old.get("hash") or passage_hash(old)
+        old_key = old.get("id") or chunk_key(old)
+        if not old.get("id"):
+            legacy_key_by_hash[old_hash] = old_key
+        old_rows_by_hash.setdefault(old_hash, row)
+        old_hash_by_key[old_key] = old_hash
+    return old_rows_by_hash, old_hash_by_key, legacy_key_by_hash
+
+
+def plan_incremental(chunks, store, on_batch=None, batch_size: int = BUILD_BATCH_SIZE) -> dict:
+    """
+    Diffs the new chunks against an existing index by passage hash, reading them in batches.
+
+    `on_batch(records, reuse, encode)` is called for each batch of tagged records with
+    {batch_row: old_row} for vectors that can be copied and the batch rows that need a forward pass.
+
+    Returns:
+        dict: {
+            "count": number of new chunks,
+            "reuse": {new_row: old_row} for vectors that can be copied,
+            "encode": new rows that need a forward pass,
+            "added" / "updated" / "removed" / "unchanged": lists of chunk keys
+        }
+    """
+    old_rows_by_hash, old_hash_by_key, legacy_key_by_hash = _index_hashes(store)
+
+    plan = {"count": 0, "reuse": {}, "encode": [],
+            "added": [], "updated": [], "removed": [], "unchanged": []}
+    new_keys = set()
+    for records in _batches(chunks, batch_size):
+        reuse, encode = {}, []
+        for i, record in enumerate(records):
+            row = plan["count"] + i
+            key, new_hash = record["id"], record["hash"]
+            if new_hash in old_rows_by_hash:
+                reuse[i] = plan["reuse"][row] = old_rows_by_hash[new_hash]
+            else:
+                encode.append(i)
+                plan["encode"].append(row)
+
+            # Indexes converted from the legacy pickle carry no id/hash (and too few fields to
+            # rebuild the key), so an old row borrows the key of the identical new chunk
+            if key not in old_hash_by_key and new_hash in legacy_key_by_hash:
+                old_hash_by_key[key] = old_hash_by_key.pop(legacy_key_by_hash.pop(new_hash))
+            if key not in old_hash_by_key:
+                plan["added"].append(key)
+            elif old_hash_by_key[key] != new_hash:
+                plan["updated"].append(key)
+            else:
+                plan["unchanged"].append(key)
+            new_keys.add(key)
+        if on_batch is not None:
+            on_batch(records, reuse, encode)
+        plan["count"] += len(records)
+
+    plan["removed"] = [key for key in old_hash_by_key if key not in new_keys]
+    return plan
+
+
+def build_incremental(chunks, index_dir: Path = EMBEDDINGS_PATH, dtype: str = VECTOR_DTYPE,
+                      dry_run: bool = False, sidecars: dict = None, batch_size: int = BUILD_BATCH_SIZE) -> dict:
+    """
+    Re-encodes only new or changed chunks, drops deleted ones and rewrites the index atomically,
+    appending the rows batch by batch. Falls back to a full build when no compatible index
+    exists. Sidecars (including the configured ANN indexes) are rebuilt as in build_full.
+
+    Returns:
+        dict: The incremental plan (see plan_incremental), plus "header" when the index was written.
+    """
+    sidecars = build_sidecars(index_dir) if sidecars is None else sidecars
+    try:
+        store = load_index(index_dir)
+    except FileNotFoundError:
+        store = None
+    if store is None or store.model_name != MODEL_NAME:
+        reason = "no existing index" if store is None else f"model changed ({store.model_name} → {MODEL_NAME})"
+        print(f"ℹ️ Incremental build not possible: {reason}. Running a full build.")
+        plan = {"count": 0, "reuse": {}, "encode": [], "added": [], "updated": [], "removed": [], "unchanged": []}
+
+        def counted(chunks):
+            for chunk in chunks:
+                plan["encode"].append(plan["count"])
+                plan["added"].append(chunk_key(chunk))
+                plan["count"] += 1
+                yield chunk
+
+        if dry_run:
+            for _ in counted(chunks):
+                pass
+        else:
+            plan["header"] = build_full(counted(chunks), index_dir, dtype, batch_size=batch_size, sidecars=sidecars)
+        return plan
+
+    writer = None if dry_run else IndexWriter(index_dir, MODEL_NAME, dtype, dim=store.dim)
+
+    def write_batch(records: list, reuse: dict, encode: list):
+        vectors = np.zeros((len(records), store.dim), dtype=np.float32)
+        for row, old_row in reuse.items():
+            vectors[row] = store.vectors[old_row]
+        if encode:
+            if _worker_model is None:
+                _init_worker()
+            vectors[encode] = _encode_batch(0, [passage_text(records[row]) for row in encode])[1]
+        writer.append(records, vectors)
+
+    try:
+        plan = plan_incremental(chunks, store, on_batch=None if dry_run else write_batch, batch_size=batch_size)
+        if not dry_run:
+            plan["header"] = writer.commit(sidecars)
+    except BaseException:
+        # Unlike a full build there is no checkpoint to resume from, so drop the partial files
+        if writer is not None:
+            writer.abort()
+        raise
+    return plan
+
+
+def print_report(plan: dict, limit: int = 10):
+    for label in ("added", "updated", "removed"):
+        keys = plan[label]
+        print(f"  {label:<8} {len(keys)}")
+        for key in keys[:limit]:
+            print(f"    - {key}")
+        if len(keys) > limit:
+            print(f"    ... and {len(keys) - limit} more")
+    print(f"  {'unchanged':<8} {len(plan['unchanged'])}")
+    print(f"  encoded  {len(plan['encode'])} / {plan['count']} chunks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed chunks.jsonl into the vector index")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-encode new or changed chunks (keyed on passage hash)")
+    parser.add_argument("--dry-run", action="store_true", help="With --incremental, report changes without writing")
+    parser.add_argument("--dtype", choices=("float32", "float16"), default=VECTOR_DTYPE)
+    parser.add_argument("--workers", type=int, default=None,
+                        help=f"Encoder processes for a full build (each loads its own model copy; default "
+                             f"{BUILD_WORKERS}). --incremental encodes in-process and rejects this flag")
+    parser.add_argument("--batch-size", type=int, default=BUILD_BATCH_SIZE,
+                        help="Chunks per work unit; a full build checkpoints after every batch, "
+                             "--incremental reads and encodes this many at a time")
+    parser.add_argument("--restart", action="store_true", help="Ignore an interrupted build's checkpoint")
+    parser.add_argument("--ann", choices=sorted(ann.SIDECAR_BUILDERS), action="append", default=[],
+                        help="Also build an approximate nearest-neighbor index (repeatable); "
+                             "it is then rebuilt on every later build")
+    parser.add_argument("--drop-ann", choices=sorted(ann.SIDECAR_BUILDERS), action="append", default=[],
+                        help="Stop building an ANN index the current index was built with")
+    args = parser.parse_args()
+    if args.incremental and args.workers is not None:
+        parser.error("--workers only applies to full builds; --incremental encodes the changed chunks in-process")
+
+    sidecars = build_sidecars(EMBEDDINGS_PATH, args.ann, args.drop_ann)
+    ann_backends = [name for name in sidecars if name in ann.SIDECAR_BUILDERS]
+    if ann_backends:
+        print(f"🧭 ANN indexes built with this index: {', '.join(ann_backends)}")
+
+    # === Stream chunks ===
+    chunks = read_chunks(CHUNKS_PATH)
+
+    if args.incremental:
+        plan = build_incremental(chunks, EMBEDDINGS_PATH, args.dtype, dry_run=args.dry_run, sidecars=sidecars,
+                                 batch_size=args.batch_size)
+        print("📊 Incremental build report:" + (" (dry run, nothing written)" if args.dry_run else ""))
+        print_report(plan)
+        header = plan.get("header")
+    else:
+        header = build_full(chunks, EMBEDDINGS_PATH, args.dtype, workers=args.workers or BUILD_WORKERS,
+                            batch_size=args.batch_size, resume=not args.restart, sidecars=sidecars)
+
+    if header:
+        print(f"✅ Embedded {header['count']} chunks saved to {EMBEDDINGS_PATH} (hash {header['content_hash'][:12]})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,116 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
+import os
+import re
+import threading
+from pathlib import Path
+from caching import TTLCache, DiskCache
+from embedding_service import EMBEDDING_BATCHING, get_embedding_service
+import startup
+import tracing
+
+MODEL_NAME = "intfloat/e5-base-v2"
+
+# "torch" (SentenceTransformer) or "onnx" (int8 onnxruntime export, see onnx_embedder.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+
+# === Query embedding cache settings (override with environment variables) ===
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))      # 0 disables the in-memory tier
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "86400"))     # seconds; 0 means no expiry
+# Set QUERY_CACHE_PATH to a file (e.g. "Source Code/Assets/query_cache.sqlite") to keep cache warmth across restarts
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "")
+
+# The model (torch + weights) is loaded on first use, not at import, so the UI can render first
+_model = None
+_model_lock = threading.Lock()
+
+query_cache = TTLCache(max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+disk_cache = DiskCache(Path(QUERY_CACHE_PATH), ttl=QUERY_CACHE_TTL, namespace=f"{MODEL_NAME}:{EMBEDDING_BACKEND}") if QUERY_CACHE_PATH else None
+
+
+def get_model():
+    """
+    Loads the embedding model once and reuses it (for performance). Both backends expose
+    the same `encode` interface and produce normalized e5-base-v2 vectors.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                if EMBEDDING_BACKEND == "onnx":
+                    with startup.timed(f"load {MODEL_NAME} (onnx)"):
+                        from onnx_embedder import OnnxEmbedder
+                        _model = OnnxEmbedder()
+                else:
+                    with startup.timed("import sentence-transformers"):
+                        from sentence_transformers import SentenceTransformer
+                    with startup.timed(f"load {MODEL_NAME}"):
+                        _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+
+def normalize_query(question: str) -> str:
+    """
+    Builds the cache key / model input for a question.
+    e5-base-v2 uses an uncased tokenizer, so lowercasing and collapsing whitespace
+    does not change the embedding but lets trivially different inputs share a cache entry.
+    """
+    normalized = re.sub(r"\s+", " ", question).strip().lower()
+    return f"query: {normalized}"
+
+
+def _freeze(embedding: np.ndarray) -> np.ndarray:
+    # Cached vectors are shared between callers, so make accidental in-place edits fail loudly
+    embedding.flags.writeable = False
+    return embedding
 
-# Load the model once and reuse (for performance)
-model = SentenceTransformer("intfloat/e5-base-v2")
 
 def embed_user_query(question: str) -> np.ndarray:
     """
     Embeds the user query using intfloat/e5-base-v2 model.
-    Adds 'query:' prefix as required by the model.
+    Adds 'query:' prefix as required by the model. Results are served from an
+    LRU + TTL cache (and the optional on-disk tier) when the same query was seen before.
 
     Args:
         question (str): The user input question.
 
     Returns:
-        np.ndarray: The embedded vector of the question.
+        np.ndarray: The embedded vector of the question (read-only).
     """
-    formatted = f"query: {question}"
-    embedding = model.encode(formatted, convert_to_numpy=True)
+    formatted = normalize_query(question)
+
+    embedding = query_cache.get(formatted)
+    if embedding is not None:
+        tracing.annotate(query_cache="memory")
+        return embedding
+
+    if disk_cache is not None:
+        stored = disk_cache.get(formatted)
+        if stored is not None:
+            embedding = _freeze(np.frombuffer(stored, dtype=np.float32).copy())
+            query_cache.set(formatted, embedding)
+            tracing.annotate(query_cache="disk")
+            return embedding
+
+    tracing.annotate(query_cache="miss")
+    if EMBEDDING_BATCHING:
+        # Concurrent sessions share one batched forward pass instead of queuing on the model
+        embedding = _freeze(get_embedding_service().embed(formatted).copy())
+    else:
+        embedding = _freeze(get_model().encode(formatted, convert_to_numpy=True).astype(np.float32))
+    query_cache.set(formatted, embedding)
+    if disk_cache is not None:
+        disk_cache.set(formatted, embedding.tobytes())
     return embedding
 
 
+def query_cache_stats() -> dict:
+    """Hit/miss counters for the in-memory tier and, if enabled, the on-disk tier."""
+    stats = {"memory": query_cache.stats()}
+    if disk_cache is not None:
+        stats["disk"] = disk_cache.stats()
+    return stats
+
+
 # from embed_query import embed_user_query
 
-# query_embedding = embed_user_query("What payment methods do you support?")
\ No newline at end of file
+# query_embedding = embed_user_query("What payment methods do you support?")
@@ -0,0 +1,201 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+
+# === Micro-batching settings (override with environment variables) ===
+EMBEDDING_BATCHING = os.getenv("EMBEDDING_BATCHING", "0") == "1"
+BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+BATCH_QUEUE_DEPTH = int(os.getenv("EMBEDDING_BATCH_QUEUE_DEPTH", "1024"))
+LATENCY_WINDOW = 2048  # recent requests kept for latency percentiles
+
+
+class EmbeddingQueueFull(RuntimeError):
+    """Raised when the embedding queue is at capacity (backpressure instead of unbounded waiting)."""
+
+
+class EmbeddingServiceStopped(RuntimeError):
+    """Raised for texts submitted to, or still queued in, a stopped batcher."""
+
+
+class MicroBatcher:
+    """
+    Collects texts submitted from many threads within a few milliseconds, encodes them as one
+    padded batch on a single worker thread, and hands each caller its own vector.
+
+    Args:
+        encode_fn: Callable taking a list of texts and returning an (n, d) array.
+        max_batch_size (int): Upper bound on texts per forward pass.
+        max_wait_ms (float): How long the first text of a batch may wait for company.
+        max_queue (int): Pending texts allowed before submit() raises EmbeddingQueueFull.
+    """
+
+    def __init__(self, encode_fn, max_batch_size: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_MAX_WAIT_MS,
+                 max_queue: int = BATCH_QUEUE_DEPTH):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._started_at = None
+        self.requests = 0
+        self.rejected = 0
+        self.batches = 0
+        self.encode_seconds = 0.0
+
+    def start(self) -> "MicroBatcher":
+        if self._thread is None:
+            self._stop.clear()
+            self._started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        """Stops the worker after its current batch; texts still queued fail with EmbeddingServiceStopped."""
+        with self._lock:
+            self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        while True:
+            try:
+                _, future, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(EmbeddingServiceStopped("Embedding service stopped before encoding this text"))
+
+    def submit(self, text: str) -> Future:
+        """Queues one text; the returned Future resolves to its embedding."""
+        future = Future()
+        # Checked under the lock stop() sets the flag with, so nothing is queued after its drain
+        with self._lock:
+            if self._stop.is_set():
+                raise EmbeddingServiceStopped("Embedding service is stopped")
+            try:
+                self._queue.put_nowait((text, future, time.perf_counter()))
+            except queue.Full:
+                self.rejected += 1
+                raise EmbeddingQueueFull(f"Embedding queue is full ({self._queue.maxsize} pending)")
+        return future
+
+    def embed(self, text: str, timeout: float = 30.0) -> np.ndarray:
+        """Blocking helper: submit and wait for the vector."""
+        return self.submit(text).result(timeout)
+
+    def _collect(self) -> list:
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            texts = [text for text, _, _ in batch]
+            start = time.perf_counter()
+            try:
+                vectors = np.asarray(self.encode_fn(texts), dtype=np.float32)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+            for (_, future, submitted), vector in zip(batch, vectors):
+                future.set_result(vector)
+            with self._lock:
+                self.batches += 1
+                self.requests += len(batch)
+                self.encode_seconds += finished - start
+                self._latencies.extend(finished - submitted for _, _, submitted in batch)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000 if self._latencies else np.zeros(1)
+            uptime = time.perf_counter() - self._started_at if self._started_at else 0.0
+            return {
+                "requests": self.requests,
+                "rejected": self.rejected,
+                "batches": self.batches,
+                "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "queue_depth": self._queue.qsize(),
+                "throughput_per_sec": self.requests / uptime if uptime else 0.0,
+                "encode_ms_per_batch": 1000 * self.encode_seconds / self.batches if self.batches else 0.0,
+                "latency_ms_p50": float(np.percentile(latencies, 50)),
+                "latency_ms_p95": float(np.percentile(latencies, 95)),
+                "latency_ms_p99": float(np.percentile(latencies, 99)),
+            }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def _encode_batch(texts: list) -> np.ndarray:
+    from embed_query import get_model
+    return get_model().encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+
+def get_embedding_service() -> MicroBatcher:
+    """Process-wide batcher shared by every session; the worker thread starts on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = MicroBatcher(_encode_batch).start()
+    return _service
+
+
+def main():
+    import argparse
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from embed_query import get_model, normalize_query
+
+    parser = argparse.ArgumentParser(description="Compare per-request and micro-batched query embedding under concurrency")
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    queries = [normalize_query(f"do you have a laptop with {i} GB of RAM under ${500 + i}?") for i in range(args.requests)]
+    model = get_model()
+    model.encode(queries[0], convert_to_numpy=True)  # warm up
+
+    lock = threading.Lock()
+
+    def single(text):
+        # The model object is shared, so unbatched callers take turns on it
+        with lock:
+            return model.encode(text, convert_to_numpy=True)
+
+    results = {}
+    for name, fn in (("unbatched", single), ("micro-batched", get_embedding_service().embed)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(fn, queries))
+        elapsed = time.perf_counter() - start
+        results[name] = {"seconds": round(elapsed, 3), "queries_per_sec": round(len(queries) / elapsed, 1)}
+    results["batcher"] = get_embedding_service().stats()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+import llm_interface
+from llm_interface import extract_fallback_info_locally, extract_fallback_info_with_history
+
+EVAL_PATH = Path("Source Code/Assets/fallback_eval.jsonl")
+QUESTION_MATCH_THRESHOLD = 0.6  # word overlap (Jaccard) for LLM-rewritten questions
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"\w+", (text or "").lower()))
+
+
+def question_matches(predicted: str, expected: str) -> bool:
+    predicted_words, expected_words = _words(predicted), _words(expected)
+    if not predicted_words or not expected_words:
+        return predicted_words == expected_words
+    return len(predicted_words & expected_words) / len(predicted_words | expected_words) >= QUESTION_MATCH_THRESHOLD
+
+
+def is_correct(result: dict, expected: dict) -> bool:
+    return ((result.get("email") or "").lower() == expected["email"].lower()
+            and question_matches(result.get("question", ""), expected["question"]))
+
+
+def evaluate(cases: list, min_confidence: float = llm_interface.FALLBACK_MIN_CONFIDENCE, use_llm: bool = False) -> dict:
+    """
+    Scores the local extractor on labeled fallback transcripts.
+
+    Cases at or above `min_confidence` are answered locally (an LLM call avoided); the rest
+    are counted as deferred. With `use_llm`, deferred cases go through the full
+    extract_fallback_info_with_history path so end-to-end accuracy is measured as well.
+    """
+    report = {"cases": len(cases), "local": 0, "local_correct": 0, "deferred": 0,
+              "local_only_correct": 0, "failures": []}
+    if use_llm:
+        report["deferred_correct"] = 0
+    for case in cases:
+        result, confidence = extract_fallback_info_locally(case["history"], case["original_question"])
+        correct = is_correct(result, case["expected"])
+        report["local_only_correct"] += correct
+        if confidence >= min_confidence:
+            report["local"] += 1
+            report["local_correct"] += correct
+            if not correct:
+                report["failures"].append({"id": case["id"], "path": "local", "got": result})
+            continue
+        report["deferred"] += 1
+        if use_llm:
+            result = extract_fallback_info_with_history(case["history"], case["original_question"])
+            if is_correct(result, case["expected"]):
+                report["deferred_correct"] += 1
+            else:
+                report["failures"].append({"id": case["id"], "path": "llm", "got": result})
+
+    total = max(report["cases"], 1)
+    report["llm_calls_avoided"] = f"{report['local']}/{report['cases']} ({report['local'] / total:.0%})"
+    report["local_accuracy"] = report["local_correct"] / report["local"] if report["local"] else None
+    # What accuracy would be if the LLM were never called at all
+    report["local_only_accuracy"] = report["local_only_correct"] / total
+    if use_llm:
+        report["end_to_end_accuracy"] = (report["local_correct"] + report["deferred_correct"]) / total
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the rule-based fallback email/question extractor")
+    parser.add_argument("--cases", type=Path, default=EVAL_PATH)
+    parser.add_argument("--min-confidence", type=float, default=llm_interface.FALLBACK_MIN_CONFIDENCE)
+    parser.add_argument("--llm", action="store_true", help="Also run deferred cases through the LLM (needs an API key or mock server)")
+    args = parser.parse_args()
+
+    with open(args.cases, "r", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    llm_interface.FALLBACK_MIN_CONFIDENCE = args.min_confidence
+    report = evaluate(cases, args.min_confidence, use_llm=args.llm)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if report["local_accuracy"] is not None and report["local_accuracy"] < 1.0:
+        print("❌ The local extractor answered some cases wrongly with high confidence")
+        sys.exit(1)
+    print(f"✅ Local extractor avoided {report['llm_calls_avoided']} LLM calls without mistakes")
+
+
+if __name__ == "__main__":
+    main()
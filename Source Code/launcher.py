@@ -1,15 +1,25 @@
 import subprocess
 import os
+import sys
+import time
 
-def run_streamlit_app():
+def run_streamlit_app(warmup: bool = True):
     main_script = "main.py"  # Your Streamlit app filename
 
+    # Ask the app to load the model and index in a background thread as soon as it boots
+    env = dict(os.environ)
+    if warmup:
+        env["QA_WARMUP"] = "1"
+
+    started = time.perf_counter()
     try:
-        subprocess.run(["streamlit", "run", main_script], check=True)
+        subprocess.run(["streamlit", "run", main_script], check=True, env=env)
     except KeyboardInterrupt:
         print("\n🛑 Streamlit app stopped by user.")
     except subprocess.CalledProcessError as e:
         print(f"❌ Streamlit exited with error: {e}")
+    finally:
+        print(f"⏱️ Streamlit ran for {time.perf_counter() - started:.1f}s")
 
 if __name__ == "__main__":
-    run_streamlit_app()
+    run_streamlit_app(warmup="--no-warmup" not in sys.argv)
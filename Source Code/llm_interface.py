@@ -4,103 +4,388 @@ import json
 from dotenv import load_dotenv
 import re
 import time
-from typing import Generator, Tuple  # Add for type hinting
+import random
+import asyncio
+import threading
+import weakref
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from typing import AsyncGenerator, Generator, Tuple  # Add for type hinting
 import streamlit as st
+import tracing
 
 # Define the fallback trigger phrase
 FALLBACK_TRIGGER_PHRASE = "Sorry, I couldn’t find an answer to our support database."
 
+
+def _get_setting(name: str, default=None):
+    """Reads a setting from Streamlit secrets, falling back to environment variables (e.g. for local mock servers)."""
+    try:
+        return st.secrets[name]
+    except Exception:
+        return os.getenv(name, default)
+
+
 # Load API key and model from .env
-OPENROUTER_API_KEY = st.secrets["OPENROUTER_API_KEY"]
-OPENROUTER_MODEL = st.secrets["OPENROUTER_MODEL"]
+OPENROUTER_API_KEY = _get_setting("OPENROUTER_API_KEY")
+OPENROUTER_MODEL = _get_setting("OPENROUTER_MODEL")
+OPENROUTER_API_URL = _get_setting("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# === HTTP client settings ===
+REQUEST_TIMEOUT = 30          # seconds
+HTTP_POOL_SIZE = 16           # keep-alive connections per host
+MAX_BACKOFF = 8.0             # cap for a single retry wait, in seconds
+MAX_CONCURRENT_REQUESTS = int(_get_setting("LLM_MAX_CONCURRENCY", 8))  # async in-flight limit per event loop
+
+# Persistent pooled session: TCP + TLS setup to the provider is paid once, not on every turn
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+session.mount("http://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+
+RATE_LIMIT_MESSAGE = (
+    "⚠️ We're currently facing high demand. Please wait a moment and try again.\n"
+    "This is a temporary rate limit from the OpenRouter model provider."
+)
+SERVER_ERROR_MESSAGE = "❌ Server error occurred. Please try again later."
+API_ERROR_MESSAGE = "❌ Sorry, we couldn't process your request right now. Please try again later."
+TECHNICAL_ERROR_MESSAGE = "❌ A technical error occurred. Please try again later."
+
+
+def _build_request(messages: list, stream: bool, model: str = None, api_key: str = None) -> Tuple[dict, dict]:
+    headers = {
+        "Authorization": f"Bearer {api_key or OPENROUTER_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "model": model or OPENROUTER_MODEL,
+        "messages": messages,
+        "temperature": 0.4,
+        "stream": stream
+    }
+    return headers, data
+
+
+def _parse_retry_after(value) -> float | None:
+    """Parses a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt: int, retry_delay: float, retry_after=None) -> float:
+    """
+    Seconds to wait before the next attempt: the server's Retry-After if given,
+    otherwise exponential backoff with full jitter. Always capped at MAX_BACKOFF.
+    """
+    server_delay = _parse_retry_after(retry_after)
+    if server_delay is not None:
+        return min(server_delay, MAX_BACKOFF)
+    return random.uniform(0, min(MAX_BACKOFF, retry_delay * (2 ** attempt)))
+
+
+def _parse_stream_line(decoded: str):
+    """
+    Parses one SSE line. Returns the content delta (possibly ""), or None when the stream is done.
+    """
+    if not decoded.startswith("data: "):
+        return ""
+    chunk = decoded[6:]
+    if chunk == "[DONE]":
+        return None
+    try:
+        chunk_data = json.loads(chunk)
+        return chunk_data["choices"][0]["delta"].get("content", "") or ""
+    except json.JSONDecodeError:
+        print(f"❌ Failed to parse stream chunk: {chunk}")
+        return ""
 
-def query_llm(messages: list, max_retries: int = 3, retry_delay: int = 5, stream: bool = False) -> Tuple[bool, str | Generator[str, None, None]]:
+
+def query_llm(messages: list, max_retries: int = 3, retry_delay: float = 1.0, stream: bool = False) -> Tuple[bool, str | Generator[str, None, None]]:
     """
     Sends chat messages to the OpenRouter LLM with retry and optional streaming.
+    Requests go through a pooled keep-alive session; retries back off exponentially with jitter
+    and honor Retry-After on 429. When LLM_ROUTES lists several models, the request is routed
+    by llm_router (hedging, failover and circuit breakers) instead.
 
     Args:
         messages (list): Chat messages for the LLM.
         max_retries (int): Number of retry attempts for transient errors.
-        retry_delay (int): Seconds to wait between retries.
+        retry_delay (float): Base backoff in seconds (doubled per attempt, jittered, capped at MAX_BACKOFF).
         stream (bool): If True, return a generator for streaming response.
 
     Returns:
         - success (bool): True if success, False if rate-limited or failed.
         - response (str or Generator): Full response (non-streaming) or generator (streaming).
     """
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": OPENROUTER_MODEL,
-        "messages": messages,
-        "temperature": 0.4,
-        "stream": stream
-    }
+    import llm_router
+
+    router = llm_router.get_router()
+    if router is not None:
+        return router.query(messages, max_retries, retry_delay, stream)
+
+    headers, data = _build_request(messages, stream)
 
     for attempt in range(max_retries):
         try:
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
+            response = session.post(
+                OPENROUTER_API_URL,
                 json=data,
                 headers=headers,
-                timeout=30,
+                timeout=REQUEST_TIMEOUT,
                 stream=stream
             )
 
             if response.status_code == 200:
                 if stream:
                     def stream_response():
-                        for line in response.iter_lines():
-                            if line:
-                                decoded = line.decode("utf-8")
-                                if decoded.startswith("data: "):
-                                    chunk = decoded[6:]
-                                    if chunk == "[DONE]":
+                        try:
+                            for line in response.iter_lines():
+                                if line:
+                                    delta = _parse_stream_line(line.decode("utf-8"))
+                                    if delta is None:
                                         break
-                                    try:
-                                        chunk_data = json.loads(chunk)
-                                        delta = chunk_data["choices"][0]["delta"].get("content", "")
-                                        if delta:
-                                            yield delta
-                                    except json.JSONDecodeError:
-                                        print(f"❌ Failed to parse stream chunk: {chunk}")
+                                    if delta:
+                                        yield delta
+                        finally:
+                            # Hand the connection back to the pool even if the consumer stops early
+                            response.close()
                     return True, stream_response()
                 else:
                     message = response.json()["choices"][0]["message"]["content"].strip()
                     return True, message
             elif response.status_code == 429:
                 print(f"⚠️ Rate limit hit (attempt {attempt + 1}/{max_retries})")
+                retry_after = response.headers.get("Retry-After")
+                response.close()
                 if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
+                    tracing.incr("llm_retries")
+                    time.sleep(_backoff_delay(attempt, retry_delay, retry_after))
                     continue
-                return False, (
-                    "⚠️ We're currently facing high demand. Please wait a moment and try again.\n"
-                    "This is a temporary rate limit from the OpenRouter model provider."
-                )
+                return False, RATE_LIMIT_MESSAGE
             elif response.status_code == 502:
                 print(f"❌ 502 Bad Gateway error (attempt {attempt + 1}/{max_retries}):", response.text)
                 if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
+                    tracing.incr("llm_retries")
+                    time.sleep(_backoff_delay(attempt, retry_delay))
                     continue
-                return False, "❌ Server error occurred. Please try again later."
+                return False, SERVER_ERROR_MESSAGE
             else:
                 print(f"❌ OpenRouter API error (attempt {attempt + 1}/{max_retries}):", response.status_code, response.text)
-                return False, "❌ Sorry, we couldn't process your request right now. Please try again later."
+                return False, API_ERROR_MESSAGE
         except (requests.ConnectionError, requests.Timeout) as e:
             print(f"❌ Connection/Timeout error (attempt {attempt + 1}/{max_retries}):", str(e))
             if attempt < max_retries - 1:
-                time.sleep(retry_delay)
+                tracing.incr("llm_retries")
+                time.sleep(_backoff_delay(attempt, retry_delay))
                 continue
-            return False, "❌ A technical error occurred. Please try again later."
+            return False, TECHNICAL_ERROR_MESSAGE
         except Exception as e:
             print(f"❌ Unexpected error (attempt {attempt + 1}/{max_retries}):", str(e))
-            return False, "❌ A technical error occurred. Please try again later."
+            return False, TECHNICAL_ERROR_MESSAGE
+
+
+# === Async client ===
+# httpx.AsyncClient and asyncio.Semaphore are bound to an event loop, so keep one pair per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _get_async_client():
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+        )
+        _async_clients[loop] = (client, asyncio.Semaphore(MAX_CONCURRENT_REQUESTS))
+    return _async_clients[loop]
+
+
+async def aclose_async_client():
+    """
+    Closes the pooled AsyncClient of the running event loop and drops its keep-alive
+    connections. Await it before the loop shuts down (e.g. at the end of the coroutine given
+    to asyncio.run); a later aquery_llm on the same loop opens a new client.
+    """
+    entry = _async_clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[0].aclose()
+
+
+async def aquery_llm(messages: list, max_retries: int = 3, retry_delay: float = 1.0, stream: bool = False) -> Tuple[bool, str | AsyncGenerator[str, None]]:
+    """
+    Async version of query_llm built on a pooled httpx.AsyncClient.
+
+    At most MAX_CONCURRENT_REQUESTS calls are in flight per event loop; extra callers wait
+    for a slot. For streaming, the slot is held until the returned async generator is
+    exhausted or closed, so always consume it (or call `aclose()`). Await aclose_async_client()
+    before the event loop ends so the pooled connections are closed.
+
+    Returns:
+        - success (bool): True if success, False if rate-limited or failed.
+        - response (str or AsyncGenerator): Full response (non-streaming) or async generator of deltas.
+    """
+    import httpx
+
+    client, semaphore = _get_async_client()
+    headers, data = _build_request(messages, stream)
+
+    for attempt in range(max_retries):
+        await semaphore.acquire()
+        release = True
+        try:
+            request = client.build_request("POST", OPENROUTER_API_URL, json=data, headers=headers)
+            response = await client.send(request, stream=stream)
+
+            if response.status_code == 200:
+                if stream:
+                    async def stream_response():
+                        try:
+                            async for line in response.aiter_lines():
+                                if line:
+                                    delta = _parse_stream_line(line)
+                                    if delta is None:
+                                        break
+                                    if delta:
+                                        yield delta
+                        finally:
+                            await response.aclose()
+                            semaphore.release()
+                    release = False
+                    return True, stream_response()
+                message = response.json()["choices"][0]["message"]["content"].strip()
+                return True, message
+
+            if stream:
+                await response.aread()
+                await response.aclose()
+            if response.status_code == 429:
+                print(f"⚠️ Rate limit hit (attempt {attempt + 1}/{max_retries})")
+                if attempt < max_retries - 1:
+                    delay = _backoff_delay(attempt, retry_delay, response.headers.get("Retry-After"))
+                else:
+                    return False, RATE_LIMIT_MESSAGE
+            elif response.status_code == 502:
+                print(f"❌ 502 Bad Gateway error (attempt {attempt + 1}/{max_retries}):", response.text)
+                if attempt < max_retries - 1:
+                    delay = _backoff_delay(attempt, retry_delay)
+                else:
+                    return False, SERVER_ERROR_MESSAGE
+            else:
+                print(f"❌ OpenRouter API error (attempt {attempt + 1}/{max_retries}):", response.status_code, response.text)
+                return False, API_ERROR_MESSAGE
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            print(f"❌ Connection/Timeout error (attempt {attempt + 1}/{max_retries}):", str(e))
+            if attempt < max_retries - 1:
+                delay = _backoff_delay(attempt, retry_delay)
+            else:
+                return False, TECHNICAL_ERROR_MESSAGE
+        except Exception as e:
+            print(f"❌ Unexpected error (attempt {attempt + 1}/{max_retries}):", str(e))
+            return False, TECHNICAL_ERROR_MESSAGE
+        finally:
+            if release:
+                semaphore.release()
+
+        # Wait outside the semaphore so backing-off callers don't block others
+        tracing.incr("llm_retries")
+        await asyncio.sleep(delay)
+
+    return False, TECHNICAL_ERROR_MESSAGE
+
+
+# === Local fallback extraction (runs before the LLM) ===
+FALLBACK_MIN_CONFIDENCE = float(_get_setting("FALLBACK_MIN_CONFIDENCE", 0.8))  # below this the LLM is asked
+
+# Emails anywhere in a message; the look-behind stops matches starting mid-token (e.g. after "..")
+EMAIL_PATTERN = re.compile(
+    r"(?<![\w.+-])[A-Za-z0-9](?:[A-Za-z0-9._%+-]*[A-Za-z0-9_%+-])?@(?:[A-Za-z0-9](?:[A-Za-z0-9-]*[A-Za-z0-9])?\.)+[A-Za-z]{2,}"
+)
+# "name at gmail dot com", "name(at)gmail.com" ... are left to the LLM
+OBFUSCATED_EMAIL_PATTERN = re.compile(r"\w\s*(?:\(at\)|\[at\]|\sat\s)\s*\w+\s*(?:\(dot\)|\[dot\]|\sdot\s|\.)\s*\w", re.IGNORECASE)
+# Phrases around an email that carry no question
+EMAIL_FILLER_PATTERN = re.compile(
+    r"\b(?:(?:my|the)\s+)?e-?mail(?:\s+address)?(?:\s+is)?\b|\bhere(?:'s|\s+is|\s+it\s+is)\b|"
+    r"\b(?:you\s+can\s+)?(?:reach|contact|email|mail)\s+me(?:\s+(?:at|on|via))?\b|"
+    r"\b(?:thanks?(?:\s+you)?|please|ok(?:ay)?|sure|yes|sorry|it'?s|at)\b",
+    re.IGNORECASE,
+)
+INTERROGATIVE_PATTERN = re.compile(
+    r"^(?:what|how|does|do|did|can|could|is|are|will|would|which|when|where|why|should)\b", re.IGNORECASE
+)
+
+# Counts of extractions served locally vs. sent to the LLM (request threads update them concurrently)
+fallback_extraction_stats = {"local": 0, "llm": 0}
+_fallback_stats_lock = threading.Lock()
+
+
+def _count_extraction(kind: str):
+    with _fallback_stats_lock:
+        fallback_extraction_stats[kind] += 1
+
+
+def _find_emails(text: str) -> list:
+    emails = []
+    for match in EMAIL_PATTERN.finditer(text):
+        email = match.group(0)
+        if ".." not in email and email.lower() not in (e.lower() for e in emails):
+            emails.append(email)
+    return emails
+
+
+def extract_fallback_info_locally(chat_history: list, original_question: str = "") -> Tuple[dict, float]:
+    """
+    Rule-based extraction of the contact email and the question for a fallback entry.
+
+    The email is taken from the newest recent user turn containing one; the question is
+    `original_question` (the question that triggered the fallback). The confidence drops
+    when the result may be wrong: several different emails, an obfuscated or malformed
+    address, no original question, or a reply that also asks something new.
+
+    Returns:
+        Tuple[dict, float]: ({"email": "...", "question": "..."}, confidence in [0, 1]).
+    """
+    recent_history = chat_history[-4:] if len(chat_history) >= 4 else chat_history
+    user_turns = [msg["content"] for msg in reversed(recent_history) if msg["role"] == "user"]
+    confidence = 1.0
+
+    email, email_turn = "", ""
+    for turn in user_turns:
+        emails = _find_emails(turn)
+        if emails:
+            email, email_turn = emails[0], turn
+            if len(emails) > 1:
+                confidence = min(confidence, 0.4)  # which one did they mean?
+            break
+    if not email and user_turns and ("@" in user_turns[0] or OBFUSCATED_EMAIL_PATTERN.search(user_turns[0])):
+        confidence = min(confidence, 0.3)  # an address is there but not in a form we can trust
+
+    question = (original_question or "").strip()
+    if not question:
+        confidence = min(confidence, 0.3)
+
+    latest = user_turns[0] if user_turns else ""
+    remainder = EMAIL_PATTERN.sub(" ", latest) if latest == email_turn else latest
+    remainder = re.sub(r"[\s,.;:!\-]+", " ", EMAIL_FILLER_PATTERN.sub(" ", remainder)).strip()
+    if "?" in remainder or (INTERROGATIVE_PATTERN.match(remainder) and len(remainder.split()) >= 3):
+        confidence = min(confidence, 0.5)  # the reply may clarify or change the question
+
+    return {"email": email, "question": question}, confidence
+
 
 def extract_fallback_info_with_history(chat_history: list, original_question: str = "") -> dict:
     """
-    Extracts email and question from chat history using LLM, with regex fallback for email.
+    Extracts email and question from chat history. The local rules answer when they are
+    confident (FALLBACK_MIN_CONFIDENCE); otherwise the LLM is asked, with the local result
+    as the fallback if the LLM call or its JSON fails.
 
     Args:
         chat_history (list): Full conversation (role: user/assistant, content: message)
@@ -109,6 +394,12 @@ def extract_fallback_info_with_history(chat_history: list, original_question: st
     Returns:
         dict: {"email": "...", "question": "..."} or {} if extraction fails.
     """
+    local_result, confidence = extract_fallback_info_locally(chat_history, original_question)
+    if confidence >= FALLBACK_MIN_CONFIDENCE:
+        _count_extraction("local")
+        return local_result
+    _count_extraction("llm")
+
     recent_history = chat_history[-4:] if len(chat_history) >= 4 else chat_history
     formatted_history = "\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in recent_history)
 
@@ -140,16 +431,13 @@ def extract_fallback_info_with_history(chat_history: list, original_question: st
             parsed = json.loads(cleaned_result)
             email = parsed.get("email", "").strip()
             question = parsed.get("question", "").strip()
-            if email and re.match(r"^[\w\.-]+@[\w\.-]+\.\w+$", email):
+            if email and _find_emails(email) == [email]:
                 return {"email": email, "question": question or original_question}
-        except json.JSONDecodeError as e:
+        except (json.JSONDecodeError, AttributeError) as e:
             print(f"❌ Failed to parse LLM JSON output: {result} (Error: {str(e)})")
 
-    # Fallback: Extract email using regex from the last user message
-    last_user_message = next((msg["content"] for msg in reversed(recent_history) if msg["role"] == "user"), "")
-    email_pattern = r"^[\w\.-]+@[\w\.-]+\.\w+$"
-    email_match = re.search(email_pattern, last_user_message)
-    email = email_match.group(0) if email_match else ""
+    # Fallback: the locally extracted email (found anywhere in the recent user turns)
+    email = local_result["email"]
 
     # Use original_question if available, otherwise fall back to history
     question = original_question
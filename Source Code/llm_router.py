@@ -0,0 +1,398 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+from typing import Generator, Tuple
+import numpy as np
+import requests
+import llm_interface
+import tracing
+from llm_interface import _get_setting
+
+# Ordered models to route between; empty keeps query_llm on the single OPENROUTER_MODEL.
+# Either "model-a, model-b@http://host:port/v1/chat/completions" (a model without "@url" uses
+# OPENROUTER_API_URL) or a JSON list of {"model", "url", "api_key", "name"} objects.
+LLM_ROUTES = _get_setting("LLM_ROUTES", "")
+
+# === Hedging ===
+LLM_HEDGING = str(_get_setting("LLM_HEDGING", "1")) == "1"
+HEDGE_PERCENTILE = float(_get_setting("LLM_HEDGE_PERCENTILE", 0.9))   # of a model's time to first token
+HEDGE_MIN_SAMPLES = int(_get_setting("LLM_HEDGE_MIN_SAMPLES", 20))    # fewer samples use HEDGE_DEFAULT_DELAY
+HEDGE_DEFAULT_DELAY = float(_get_setting("LLM_HEDGE_DEFAULT_DELAY", 2.0))
+HEDGE_MIN_DELAY = 0.2         # seconds; a learned delay is clamped to [HEDGE_MIN_DELAY, HEDGE_MAX_DELAY]
+HEDGE_MAX_DELAY = 10.0
+HEDGE_MAX_IN_FLIGHT = 2       # concurrent attempts per request (primary + one hedge)
+
+# === Health and circuit breaker ===
+ROUTE_WINDOW = 200            # latest requests per model kept for latency and error rates
+BREAKER_ERROR_RATE = float(_get_setting("LLM_BREAKER_ERROR_RATE", 0.5))
+BREAKER_MIN_REQUESTS = 10     # requests in the window before the error rate can trip the breaker
+BREAKER_CONSECUTIVE_FAILURES = int(_get_setting("LLM_BREAKER_CONSECUTIVE_FAILURES", 5))
+BREAKER_COOLDOWN = float(_get_setting("LLM_BREAKER_COOLDOWN", 30.0))  # seconds open before a probe request
+
+
+class Route:
+    """One model behind one OpenAI-compatible endpoint (url / api_key default to the OpenRouter settings)."""
+
+    def __init__(self, model: str, url: str = None, api_key: str = None, name: str = None):
+        self.model = model
+        self.url = url
+        self.api_key = api_key
+        self.name = name or model
+
+    @property
+    def endpoint(self) -> str:
+        # Read at request time, so tests and benchmarks can repoint OPENROUTER_API_URL
+        return self.url or llm_interface.OPENROUTER_API_URL
+
+
+def parse_routes(value) -> list:
+    """Routes from the LLM_ROUTES setting (see above); names are made unique in order."""
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("["):
+            value = json.loads(value)
+        else:
+            value = [item.strip() for item in value.split(",") if item.strip()]
+
+    routes, names = [], set()
+    for item in value:
+        if isinstance(item, str):
+            model, _, url = item.partition("@")
+            route = Route(model.strip(), url.strip() or None)
+        else:
+            route = Route(item["model"], item.get("url"), item.get("api_key"), item.get("name"))
+        if route.name in names:
+            route.name = f"{route.name}#{len(routes) + 1}"
+        names.add(route.name)
+        routes.append(route)
+    return routes
+
+
+class RouteHealth:
+    """
+    Rolling time-to-first-token samples and outcomes of one route, and its circuit breaker.
+
+    The breaker opens after BREAKER_CONSECUTIVE_FAILURES failures in a row, or when the error
+    rate over the window reaches BREAKER_ERROR_RATE. After BREAKER_COOLDOWN seconds it lets a
+    single probe request through (half-open): success closes it, failure reopens it.
+    """
+
+    def __init__(self, window: int = ROUTE_WINDOW):
+        self._lock = threading.Lock()
+        self.latencies = {True: deque(maxlen=window), False: deque(maxlen=window)}  # keyed by `stream`
+        self.outcomes = deque(maxlen=window)  # True = success
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probing = False
+        self.counters = {"requests": 0, "errors": 0, "wins": 0, "hedges": 0, "cancelled": 0, "trips": 0}
+
+    def hedge_delay(self, stream: bool) -> float:
+        """Seconds to wait for this route's first token before hedging: HEDGE_PERCENTILE of its history."""
+        with self._lock:
+            samples = list(self.latencies[stream])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, float(np.percentile(samples, HEDGE_PERCENTILE * 100))))
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now; claims the probe slot when half-open."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_start(self, hedge: bool = False):
+        with self._lock:
+            self.counters["requests"] += 1
+            self.counters["hedges"] += hedge
+
+    def record_success(self, seconds: float, stream: bool):
+        with self._lock:
+            # Only the probe closes an open breaker, not a request sent before it opened
+            if self.state == "half_open":
+                print("✅ Circuit breaker closed")
+                self.state = "closed"
+                self.probing = False
+                self.outcomes.clear()  # errors from before the outage must not re-trip it
+            self.latencies[stream].append(seconds)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+            self.counters["wins"] += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            self.counters["errors"] += 1
+            if self.state == "half_open" or (self.state == "closed" and (
+                    self.consecutive_failures >= BREAKER_CONSECUTIVE_FAILURES or
+                    (len(self.outcomes) >= BREAKER_MIN_REQUESTS and
+                     self.outcomes.count(False) / len(self.outcomes) >= BREAKER_ERROR_RATE))):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+                self.counters["trips"] += 1
+
+    def record_cancelled(self):
+        """A losing attempt says nothing about the route's health; a cancelled probe frees the slot."""
+        with self._lock:
+            self.counters["cancelled"] += 1
+            if self.state == "half_open":
+                self.probing = False
+
+    def snapshot(self, stream: bool = True) -> dict:
+        with self._lock:
+            samples = list(self.latencies[stream])
+            snapshot = {"state": self.state, "consecutive_failures": self.consecutive_failures, **self.counters}
+        snapshot["error_rate"] = self.error_rate()
+        snapshot["hedge_delay"] = self.hedge_delay(stream)
+        snapshot["first_token_p50"] = float(np.percentile(samples, 50)) if samples else 0.0
+        snapshot["first_token_p95"] = float(np.percentile(samples, 95)) if samples else 0.0
+        return snapshot
+
+
+class _Failure:
+    def __init__(self, status, retry_after=None, detail: str = ""):
+        self.status = status  # HTTP status, "connection", "error" or "open"
+        self.retry_after = retry_after
+        self.detail = detail
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == "connection" or (isinstance(self.status, int) and (self.status == 429 or self.status >= 500))
+
+    @property
+    def client_error(self) -> bool:
+        """
+        A 4xx caused by the request itself (bad payload, prompt too long): every route would
+        reject it, so it neither counts against the breaker nor fails over. 401/403 are a
+        route's own credentials and 429 its own quota, so those stay route failures.
+        """
+        return isinstance(self.status, int) and 400 <= self.status < 500 and self.status not in (401, 403, 429)
+
+    @property
+    def message(self) -> str:
+        if self.status == 429:
+            return llm_interface.RATE_LIMIT_MESSAGE
+        if self.status == "open" or (isinstance(self.status, int) and self.status >= 500):
+            return llm_interface.SERVER_ERROR_MESSAGE
+        if isinstance(self.status, int):
+            return llm_interface.API_ERROR_MESSAGE
+        return llm_interface.TECHNICAL_ERROR_MESSAGE
+
+
+class _Attempt(threading.Thread):
+    """
+    One request to one route, run until its first token (streaming) or full reply, then
+    handed to the Router through `results`. A streaming winner is read on by the caller.
+    """
+
+    def __init__(self, route: Route, messages: list, stream: bool, results: queue.Queue):
+        super().__init__(daemon=True)
+        self.route = route
+        self.messages = messages
+        self.stream = stream
+        self.results = results
+        self.cancelled = threading.Event()
+        self.response = None
+        self.started = time.perf_counter()
+        self.latency = None
+        self.value = None  # full reply, or (first delta, remaining lines, done) when streaming
+
+    def run(self):
+        try:
+            outcome = self._request()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            outcome = _Failure("connection", detail=str(e))
+        except Exception as e:
+            outcome = _Failure("error", detail=str(e))
+        if self.cancelled.is_set():
+            self.close()
+            return
+        self.results.put((self, outcome))
+
+    def _request(self):
+        headers, data = llm_interface._build_request(self.messages, self.stream, self.route.model, self.route.api_key)
+        response = llm_interface.session.post(self.route.endpoint, json=data, headers=headers,
+                                              timeout=llm_interface.REQUEST_TIMEOUT, stream=self.stream)
+        self.response = response
+        if self.cancelled.is_set():
+            return None
+        if response.status_code != 200:
+            failure = _Failure(response.status_code, response.headers.get("Retry-After"), response.text[:200])
+            response.close()
+            return failure
+
+        if not self.stream:
+            self.value = response.json()["choices"][0]["message"]["content"].strip()
+        else:
+            lines = response.iter_lines()
+            first, done = "", True
+            for line in lines:
+                if line:
+                    delta = llm_interface._parse_stream_line(line.decode("utf-8"))
+                    if delta is None:
+                        break
+                    if delta:
+                        first, done = delta, False
+                        break
+            self.value = (first, lines, done)
+        self.latency = time.perf_counter() - self.started
+        return self.value
+
+    def cancel(self):
+        """Stops a losing attempt: its connection is dropped rather than returned to the pool."""
+        self.cancelled.set()
+        self.close()
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+
+    def stream_response(self) -> Generator[str, None, None]:
+        first, lines, done = self.value
+        try:
+            if first:
+                yield first
+            if not done:
+                for line in lines:
+                    if line:
+                        delta = llm_interface._parse_stream_line(line.decode("utf-8"))
+                        if delta is None:
+                            break
+                        if delta:
+                            yield delta
+        finally:
+            self.close()
+
+
+class Router:
+    """
+    Sends each request to an ordered list of routes. The first route whose breaker allows it
+    gets the request; if it has not produced a first token within its learned hedge delay,
+    the same request is also sent to the next route and whichever answers first wins (the
+    other is cancelled). A failed route fails over to the next one at once. Retries with
+    backoff only happen when every route failed with a transient error.
+    """
+
+    def __init__(self, routes: list, hedging: bool = LLM_HEDGING):
+        if not routes:
+            raise ValueError("Router needs at least one route")
+        self.routes = routes
+        self.hedging = hedging
+        self.health = {route.name: RouteHealth() for route in routes}
+
+    def _race(self, messages: list, stream: bool) -> Tuple[_Attempt | None, list]:
+        """One pass over the routes. Returns (winning attempt or None, failures seen)."""
+        results = queue.Queue()
+        pending = list(self.routes)
+        running, failures = [], []
+
+        def launch(hedge: bool = False) -> bool:
+            while pending:
+                route = pending.pop(0)
+                health = self.health[route.name]
+                if health.allow():
+                    health.record_start(hedge)
+                    attempt = _Attempt(route, messages, stream, results)
+                    attempt.start()
+                    running.append(attempt)
+                    return True
+            return False
+
+        if not launch():
+            return None, [_Failure("open", detail="every route's circuit breaker is open")]
+
+        while running:
+            timeout = None
+            if self.hedging and pending and len(running) < HEDGE_MAX_IN_FLIGHT:
+                newest = running[-1]
+                deadline = newest.started + self.health[newest.route.name].hedge_delay(stream)
+                timeout = max(0.0, deadline - time.perf_counter())
+            try:
+                attempt, outcome = results.get(timeout=timeout)
+            except queue.Empty:
+                if launch(hedge=True):
+                    tracing.incr("llm_hedges")
+                continue
+
+            running.remove(attempt)
+            if isinstance(outcome, _Failure):
+                print(f"❌ LLM route {attempt.route.name} failed ({outcome.status}): {outcome.detail}")
+                failures.append(outcome)
+                if outcome.client_error:
+                    for other in running:
+                        other.cancel()
+                        self.health[other.route.name].record_cancelled()
+                    return None, failures
+                self.health[attempt.route.name].record_failure()
+                if not running and launch():
+                    tracing.incr("llm_failovers")
+                continue
+
+            self.health[attempt.route.name].record_success(attempt.latency, stream)
+            for loser in running:
+                loser.cancel()
+                self.health[loser.route.name].record_cancelled()
+            tracing.annotate(llm_route=attempt.route.name)
+            return attempt, failures
+        return None, failures
+
+    def query(self, messages: list, max_retries: int = 3, retry_delay: float = 1.0,
+              stream: bool = False) -> Tuple[bool, str | Generator[str, None, None]]:
+        """Same contract as llm_interface.query_llm."""
+        failures = []
+        for attempt in range(max_retries):
+            winner, failures = self._race(messages, stream)
+            if winner is not None:
+                return True, (winner.stream_response() if stream else winner.value)
+            if attempt == max_retries - 1 or not any(failure.retryable for failure in failures):
+                break
+            retry_after = next((failure.retry_after for failure in failures if failure.retry_after), None)
+            tracing.incr("llm_retries")
+            time.sleep(llm_interface._backoff_delay(attempt, retry_delay, retry_after))
+        return False, failures[-1].message if failures else llm_interface.TECHNICAL_ERROR_MESSAGE
+
+    def status(self, stream: bool = True) -> dict:
+        return {route.name: self.health[route.name].snapshot(stream) for route in self.routes}
+
+    def render_prometheus(self) -> str:
+        """Per-route counters, breaker state and learned hedge delay in Prometheus text format."""
+        status = self.status()
+        lines = []
+        for key, kind in (("requests", "counter"), ("errors", "counter"), ("wins", "counter"), ("hedges", "counter"),
+                          ("cancelled", "counter"), ("trips", "counter"), ("error_rate", "gauge"),
+                          ("hedge_delay", "gauge"), ("first_token_p95", "gauge"), ("open", "gauge")):
+            name = f"llm_route_{key}_total" if kind == "counter" else f"llm_route_{key}"
+            lines.append(f"# TYPE {name} {kind}")
+            for route, stats in status.items():
+                value = int(stats["state"] != "closed") if key == "open" else stats[key]
+                lines.append(f'{name}{{route="{route}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> Router | None:
+    """The Router built from LLM_ROUTES, shared process-wide; None when no routes are configured."""
+    global _router
+    if _router is None and LLM_ROUTES:
+        with _router_lock:
+            if _router is None:
+                _router = Router(parse_routes(LLM_ROUTES))
+    return _router
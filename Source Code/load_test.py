@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from benchmark import RESULTS_DIR, latency_stats, run_metadata, synthetic_questions, write_results
+from mock_llm_server import MockLLMConfig, start_mock_server
+
+API_SERVER_SCRIPT = Path(__file__).resolve().parent / "api_server.py"
+READY_TIMEOUT = 300.0  # seconds to wait for a spawned server to load the model and index
+
+
+async def _one_request(client, url: str, question: str, stream: bool) -> dict:
+    """Sends one chat turn; returns status, total latency and (streaming) time to first delta."""
+    start = time.perf_counter()
+    first = None
+    try:
+        if not stream:
+            response = await client.post(f"{url}/v1/chat", json={"message": question, "history": []})
+            status = response.status_code
+        else:
+            async with client.stream("POST", f"{url}/v1/chat/stream", json={"message": question, "history": []}) as response:
+                status = response.status_code
+                async for line in response.aiter_lines():
+                    if first is None and line.startswith("data: "):
+                        first = time.perf_counter() - start
+                    if line.startswith("event: error"):
+                        status = 500
+    except Exception as e:
+        return {"status": type(e).__name__, "seconds": time.perf_counter() - start, "first": None}
+    return {"status": status, "seconds": time.perf_counter() - start, "first": first}
+
+
+async def run_load(url: str, requests: int, concurrency: int, stream: bool, rate: float = 0) -> dict:
+    """
+    Drives `requests` chat turns with at most `concurrency` in flight (optionally paced to
+    `rate` requests/sec) and summarizes latency and status codes.
+    """
+    import httpx
+
+    questions = synthetic_questions(requests)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def worker(i: int, question: str):
+            if rate:
+                await asyncio.sleep(max(0.0, i / rate - (time.perf_counter() - started)))
+            async with semaphore:
+                return await _one_request(client, url, question, stream)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(worker(i, question) for i, question in enumerate(questions)))
+        elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+    ok = [result for result in results if result["status"] == 200]
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "stream": stream,
+        "seconds": elapsed,
+        "requests_per_sec": requests / elapsed if elapsed else 0.0,
+        "ok_per_sec": len(ok) / elapsed if elapsed else 0.0,
+        "statuses": statuses,
+        "latency": latency_stats([result["seconds"] for result in ok]),
+        "time_to_first_token": latency_stats([result["first"] for result in ok if result["first"] is not None]),
+    }
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = READY_TIMEOUT):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API server exited with status {process.returncode}")
+        try:
+            if httpx.get(f"{url}/readyz", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"API server at {url} was not ready within {timeout:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the chat API (api_server.py) against a mock LLM")
+    parser.add_argument("--url", default=None, help="existing server, e.g. http://127.0.0.1:8080 (default: spawn one)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=0, help="requests/sec to pace arrivals (0 = as fast as possible)")
+    parser.add_argument("--stream", action="store_true", help="use the SSE endpoint")
+    parser.add_argument("--workers", type=int, default=2, help="workers of the spawned server")
+    parser.add_argument("--port", type=int, default=8090, help="port of the spawned server")
+    parser.add_argument("--server-args", default="", help="extra flags for the spawned api_server.py")
+    parser.add_argument("--tokens-per-sec", type=float, default=50, help="mock LLM streaming rate")
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=502)
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    mock_server, process, url = None, None, args.url
+    if url is None:
+        # The spawned server's LLM calls go to an in-process mock with the requested behaviour
+        config = MockLLMConfig(tokens_per_sec=args.tokens_per_sec, first_token_delay=args.first_token_delay,
+                               error_rate=args.error_rate, error_status=args.error_status)
+        mock_server, mock_url = start_mock_server(config=config)
+        env = dict(os.environ, OPENROUTER_API_URL=mock_url)
+        command = [sys.executable, str(API_SERVER_SCRIPT), "--port", str(args.port), "--workers", str(args.workers),
+                   *args.server_args.split()]
+        process = subprocess.Popen(command, env=env)
+        url = f"http://127.0.0.1:{args.port}"
+        print(f"⏳ Waiting for {url} ({args.workers} workers, mock LLM at {mock_url}) ...")
+
+    try:
+        if process is not None:
+            _wait_ready(url, process)
+        results = asyncio.run(run_load(url.rstrip("/"), args.requests, args.concurrency, args.stream, args.rate))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=60)
+        if mock_server is not None:
+            mock_server.shutdown()
+
+    output = write_results({"benchmark": "load_test", "meta": run_metadata(args), "results": results}, args.output)
+    print(json.dumps(results, indent=2))
+    print(f"✅ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,26 @@
+import startup
 import streamlit as st
-from ProgramEngine import get_chatbot_response
+with startup.timed("import ProgramEngine"):
+    from ProgramEngine import get_chatbot_response
+from sessions import session_store
+import warmup
 import base64
 import json
 from datetime import datetime
 from typing import Generator  # Add for type hinting
 
+@st.cache_resource(show_spinner=False)
+def boot():
+    """
+    Runs once per server process (not per rerun or session). The model and index themselves are
+    lazy singletons; with warm-up enabled they start loading in the background right away.
+    """
+    if warmup.warmup_enabled():
+        return warmup.start_background_warmup()
+    print(startup.report())
+    return None
+
+@st.cache_data(show_spinner=False)
 def get_base64_image(image_path):
     with open(image_path, "rb") as f:
         data = f.read()
@@ -17,6 +33,8 @@ st.set_page_config(
     page_icon="Source Code/Assets/icon.ico"
 )
 
+boot()
+
 # Logo
 logo_base64 = get_base64_image("Source Code/Assets/logo.png")
 st.markdown(
@@ -33,6 +51,8 @@ st.caption("Ask anything about products, policies, or help — Quantum Arc is he
 # Session state setup
 if "history" not in st.session_state:
     st.session_state.history = []
+if "session_id" not in st.session_state:
+    st.session_state.session_id = session_store.get_or_create().session_id
 
 # Show chat history
 for turn in st.session_state.history:
@@ -47,20 +67,21 @@ if user_input:
         st.markdown(user_input)
 
     try:
+        # The spinner only covers embedding, retrieval and the wait for the LLM to start answering
         with st.spinner("💬 Thinking..."):
-            response, updated_history, is_fallback = get_chatbot_response(user_input, st.session_state.history)
+            # Fallback/email-capture state is per browser session, never shared between users
+            chat_session = session_store.get_or_create(st.session_state.session_id)
+            response_stream = get_chatbot_response(user_input, st.session_state.history, stream=True,
+                                                   session=chat_session)
 
         # If the response is an error or warning, show it separately
-        if isinstance(response, str) and ("⚠️" in response or "❌" in response):
-            st.warning(response)
+        if not response_stream.live and ("⚠️" in response_stream.text or "❌" in response_stream.text):
+            st.warning(response_stream.text)
         else:
             with st.chat_message("assistant", avatar="🤖"):
-                if isinstance(response, str):
-                    st.markdown(response)
-                else:
-                    # Stream the response
-                    st.write_stream(response)
-            st.session_state.history = updated_history
+                # Render tokens as they arrive; history and fallback state are finalized when the stream ends
+                st.write_stream(response_stream)
+            st.session_state.history = response_stream.history
 
     except Exception as e:
         st.error(f"❌ Error: {e}")
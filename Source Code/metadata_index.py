@@ -0,0 +1,319 @@
+import io
+import json
+import re
+import numpy as np
+
+# Structured chunk fields partitioned into row-id lists (values are matched case-insensitively)
+PARTITION_FIELDS = ("type", "section", "category", "brand")
+PRICE_FIELD = "price_usd"
+
+# Words customers use for a catalog category, beyond the category name and its singular
+CATEGORY_ALIASES = {
+    "smartphones": ("phone", "phones", "mobile", "mobiles", "cellphone", "cellphones", "iphone", "iphones"),
+    "laptops": ("notebook", "notebooks", "ultrabook", "ultrabooks", "macbook", "macbooks"),
+    "desktops": ("pc", "pcs", "desktop computer", "desktop computers", "workstation", "workstations"),
+    "graphics cards": ("gpu", "gpus", "graphics card", "video card", "video cards"),
+    "processors": ("cpu", "cpus", "processor", "chip", "chips"),
+}
+
+# A number with optional "$", "k" and "usd"/"dollars"; spec values such as "16GB" or "120Hz" are not prices.
+# Groups per amount: currency sign, number, thousands, currency word.
+_AMOUNT = (r"(\$)?\s*(\d[\d,]*(?:\.\d+)?)(?![\d.]|,\d)\s*(k\b)?\s*(usd\b|dollars?\b|bucks\b)?"
+           r"(?!\s*(?:gb|tb|mb|mp|hz|mah|w\b|inch|in\b|\"|%|ram|cores?|fps|mm|hours?|days?|months?|years?))")
+_PRICE_BETWEEN = re.compile(rf"\bbetween\s+{_AMOUNT}\s*(?:and|-|to)\s*{_AMOUNT}", re.IGNORECASE)
+_PRICE_RANGE = re.compile(r"\$\s*(\d[\d,]*(?:\.\d+)?)\s*(k\b)?\s*(?:-|to)\s*\$?\s*(\d[\d,]*(?:\.\d+)?)\s*(k\b)?", re.IGNORECASE)
+_PRICE_MAX = re.compile(rf"\b(?:under|below|less\s+than|cheaper\s+than|up\s+to|at\s+most|max(?:imum)?|no\s+more\s+than)\s+{_AMOUNT}",
+                        re.IGNORECASE)
+_PRICE_MIN = re.compile(rf"\b(?:over|above|more\s+than|at\s+least|starting\s+(?:at|from)|min(?:imum)?)\s+{_AMOUNT}",
+                        re.IGNORECASE)
+PRICE_NOUN_WINDOW = 3  # words before "under" / "over" searched for a product noun when the amount has no currency
+
+# Questions about policies and support: a category or price in them narrows products, never excludes FAQs/policies
+_SUPPORT_TERMS = re.compile(
+    r"\b(?:warrant(?:y|ies)|guarantee|returns?|returning|refunds?|restocking|exchanges?|ship(?:ping|ped|s)?|deliver(?:y|ed)?|"
+    r"fees?|polic(?:y|ies)|price\s+match(?:ing)?|cancel(?:led|lation)?|orders?|payments?|pay|paid|installments?|"
+    r"support|repairs?|damaged|broken|defective|account|track(?:ing)?)\b", re.IGNORECASE)
+# Phrases that make a question a product search
+_PRODUCT_CUES = re.compile(
+    r"\b(?:show|recommend|suggest|list|compare|looking\s+for|search(?:ing)?\s+for|find|buy|purchase|"
+    r"do\s+you\s+(?:have|sell|carry|stock)|in\s+stock|available|options?|best|cheapest|cheap|budget|"
+    r"specs?|specifications)\b", re.IGNORECASE)
+GENERIC_PRODUCT_NOUNS = ("product", "products", "item", "items", "model", "models", "device", "devices")
+
+
+def _amount(groups) -> tuple:
+    """(value, has currency marker) from one amount's regex groups."""
+    currency, number, thousands, currency_word = groups
+    value = float(number.replace(",", ""))
+    return (value * 1000 if thousands else value), bool(currency or currency_word)
+
+
+def _intersect_sorted(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Intersection of two sorted unique row arrays via binary search of the smaller in the larger."""
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a):
+        return a
+    positions = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[positions] == a]
+
+
+class MetadataIndex:
+    """
+    Row-id partitions over the structured chunk fields, so retrieval can restrict scoring to
+    the rows that match a filter before computing any similarity.
+
+    For every field in PARTITION_FIELDS and every (lowercased) value, the sorted int32 rows
+    holding it are rows[indptr[j]:indptr[j + 1]], j being the value's slot in `keys`.
+    Prices are kept as a column sorted ascending (`prices`) with the matching rows in
+    `price_rows`, so a price range is two binary searches.
+    """
+
+    def __init__(self, keys: list, indptr: np.ndarray, rows: np.ndarray, price_rows: np.ndarray,
+                 prices: np.ndarray, num_rows: int):
+        self.keys = keys                      # [[field, lowercased value], ...]
+        self.slots = {(field, value): j for j, (field, value) in enumerate(keys)}
+        self.indptr = indptr
+        self.rows = rows
+        self.price_rows = price_rows
+        self.prices = prices
+        self.num_rows = num_rows
+
+    @classmethod
+    def build(cls, records) -> "MetadataIndex":
+        """Builds the partitions from an iterable of chunk records (row order = index order)."""
+        partitions = {}
+        price_rows, prices = [], []
+        num_rows = 0
+        for row, record in enumerate(records):
+            num_rows += 1
+            for field in PARTITION_FIELDS:
+                value = record.get(field)
+                if isinstance(value, str) and value:
+                    partitions.setdefault((field, value.strip().lower()), []).append(row)
+            price = record.get(PRICE_FIELD)
+            if isinstance(price, (int, float)) and not isinstance(price, bool):
+                price_rows.append(row)
+                prices.append(price)
+
+        keys = sorted(partitions)
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(partitions[key]) for key in keys])
+        rows = np.fromiter((row for key in keys for row in partitions[key]), dtype=np.int32, count=int(indptr[-1]))
+        prices = np.asarray(prices, dtype=np.float64)
+        order = np.argsort(prices, kind="stable")
+        return cls([list(key) for key in keys], indptr, rows, np.asarray(price_rows, dtype=np.int32)[order],
+                   prices[order], num_rows)
+
+    def to_bytes(self) -> bytes:
+        """Serializes the partitions as an .npz blob (stored as an index sidecar)."""
+        meta = {"keys": self.keys, "num_rows": self.num_rows}
+        buffer = io.BytesIO()
+        np.savez(buffer, indptr=self.indptr, rows=self.rows, price_rows=self.price_rows, prices=self.prices,
+                 meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data) -> "MetadataIndex":
+        with np.load(io.BytesIO(bytes(data)), allow_pickle=False) as npz:
+            meta = json.loads(npz["meta"].tobytes().decode("utf-8"))
+            return cls(meta["keys"], npz["indptr"], npz["rows"], npz["price_rows"], npz["prices"],
+                       meta["num_rows"])
+
+    @classmethod
+    def load(cls, path) -> "MetadataIndex":
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+    def values(self, field: str) -> list:
+        """Distinct lowercased values of a field."""
+        return [value for key_field, value in self.keys if key_field == field]
+
+    def field_rows(self, field: str, value: str) -> np.ndarray:
+        j = self.slots.get((field, value.strip().lower()))
+        if j is None:
+            return np.zeros(0, dtype=np.int32)
+        return self.rows[self.indptr[j]:self.indptr[j + 1]]
+
+    def price_range(self, low: float = None, high: float = None) -> np.ndarray:
+        """Sorted rows with low <= price <= high (either bound may be None)."""
+        start = 0 if low is None else np.searchsorted(self.prices, low, side="left")
+        end = len(self.prices) if high is None else np.searchsorted(self.prices, high, side="right")
+        return np.sort(self.price_rows[start:end])
+
+    def select(self, filters: dict) -> np.ndarray | None:
+        """
+        Sorted rows matching every filter: values of one field are OR-ed, fields are AND-ed.
+        Returns None when `filters` is empty (no restriction). With "strict": False the
+        rows of every other type are added back, or only those of the given "section"
+        values when there are some (see parse_filters); a type filter ignores "section" otherwise.
+
+        Args:
+            filters (dict): {field: [values]} for PARTITION_FIELDS plus optional
+                "price_min" / "price_max" bounds and "strict".
+        """
+        selected = []
+        sections = filters.get("section") if filters.get("type") else None
+        for field in PARTITION_FIELDS:
+            values = filters.get(field)
+            if values and not (field == "section" and sections):
+                parts = [self.field_rows(field, value) for value in values]
+                selected.append(parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts)))
+        if filters.get("price_min") is not None or filters.get("price_max") is not None:
+            selected.append(self.price_range(filters.get("price_min"), filters.get("price_max")))
+        if not selected:
+            return None
+        # Smallest partition first keeps every intersection a binary search over few rows
+        selected.sort(key=len)
+        rows = selected[0]
+        for other in selected[1:]:
+            rows = _intersect_sorted(rows, other)
+        if filters.get("strict", True) or not filters.get("type"):
+            return rows
+        if sections:
+            others = np.concatenate([self.field_rows("section", value) for value in sections])
+        else:
+            others = self.other_rows("type", filters.get("type") or ())
+        return np.union1d(rows, others).astype(np.int32)
+
+    def other_rows(self, field: str, values) -> np.ndarray:
+        """Sorted rows whose `field` is none of `values` (including rows without the field)."""
+        parts = [self.field_rows(field, value) for value in values]
+        matching = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+        return np.setdiff1d(np.arange(self.num_rows, dtype=np.int32), matching)
+
+
+def build_bytes(records, vectors=None) -> bytes:
+    """Index sidecar builder used by embed_chunks.py."""
+    return MetadataIndex.build(records).to_bytes()
+
+
+def parse_price(question: str, nouns=()) -> tuple:
+    """
+    (price_min, price_max) from phrases like "under $1500", "over 2k dollars" or "$500-$900";
+    None where absent. An amount without a currency marker only counts right after one of
+    `nouns` ("laptops under 1500"), so "orders over 100" or "2 stores" are not prices.
+    """
+    text = question.lower()
+
+    def near_noun(start: int) -> bool:
+        window = " ".join(text[:start].split()[-PRICE_NOUN_WINDOW:])
+        return any(_mentions(window, noun) for noun in nouns)
+
+    match = _PRICE_RANGE.search(question)
+    if match:
+        low, high = _amount(("$",) + match.groups()[:2] + (None,))[0], _amount(("$",) + match.groups()[2:] + (None,))[0]
+        return min(low, high), max(low, high)
+    match = _PRICE_BETWEEN.search(question)
+    if match:
+        (low, low_marked), (high, high_marked) = _amount(match.groups()[:4]), _amount(match.groups()[4:])
+        if low_marked or high_marked or near_noun(match.start()):
+            return min(low, high), max(low, high)
+
+    bounds = []
+    for pattern in (_PRICE_MIN, _PRICE_MAX):
+        value = None
+        for match in pattern.finditer(question):
+            amount, marked = _amount(match.groups())
+            if marked or near_noun(match.start()):
+                value = amount
+                break
+        bounds.append(value)
+    return tuple(bounds)
+
+
+def _mentions(text: str, phrase: str) -> bool:
+    return re.search(rf"(?<![a-z0-9]){re.escape(phrase)}(?![a-z0-9])", text) is not None
+
+
+def _section_phrases(section: str) -> tuple:
+    """Ways a question names a section: as written, with "and" for "&", and with singular words."""
+    words = section.replace("&", "and").split()
+    singular = [word[:-1] if word.endswith("s") and len(word) > 3 else word for word in words]
+    return section, " ".join(words), " ".join(singular)
+
+
+def parse_sections(question: str, index: MetadataIndex) -> list:
+    """
+    FAQ / policy sections the question names in full ("your return policy", "payment
+    methods"). One-word section names such as "Orders" or "Account" are everyday words in
+    support questions rather than references to a section, and categories that are also
+    section names are left to the category filter, so neither is inferred.
+    """
+    text = question.lower()
+    categories = set(index.values("category"))
+    return [section for section in index.values("section")
+            if len(section.split()) > 1 and section not in categories
+            and any(_mentions(text, phrase) for phrase in _section_phrases(section))]
+
+
+def parse_filters(question: str, index: MetadataIndex) -> dict:
+    """
+    Infers retrieval filters from a question using the values present in the index.
+
+    A catalog category (by name, singular or alias) or a price bound narrows the product
+    rows; a brand is only applied alongside one of those ("Apple laptops", but not "Do Apple
+    products have a warranty?"). Categories that are also FAQ section names (e.g.
+    "Accessories") are not inferred, so their FAQs stay reachable.
+
+    Only a clear product search ("show me laptops under $1500", "which phones do you have?")
+    is restricted to product rows ("strict"). Otherwise the FAQ and policy rows stay in the
+    candidate set next to the narrowed products, so "What is the warranty on phones?" still
+    finds the warranty policy; prices are not read from such support questions at all.
+
+    A question that names a section (see parse_sections) is narrowed to that section's rows,
+    next to the narrowed products if there are any ("Does the return policy cover laptops?").
+
+    Returns:
+        dict: Filters for MetadataIndex.select (empty when nothing was inferred).
+    """
+    text = question.lower()
+    support_question = _SUPPORT_TERMS.search(text) is not None
+    sections = set(index.values("section"))
+    categories, nouns = [], list(GENERIC_PRODUCT_NOUNS)
+    for category in index.values("category"):
+        if category in sections:
+            continue
+        singular = category[:-1] if category.endswith("s") else category
+        phrases = (category, singular, *CATEGORY_ALIASES.get(category, ()))
+        nouns.extend(phrases)
+        if any(_mentions(text, phrase) for phrase in phrases):
+            categories.append(category)
+    sections = parse_sections(question, index)
+    price_min, price_max = (None, None) if support_question or sections else parse_price(question, nouns)
+    has_price = price_min is not None or price_max is not None
+    if not categories and not has_price:
+        return {"section": sections} if sections else {}
+
+    strict = not support_question and not sections and (has_price or _PRODUCT_CUES.search(text) is not None)
+    filters = {"type": ["product"], "strict": strict}
+    if sections:
+        filters["section"] = sections
+    if categories:
+        filters["category"] = categories
+    brands = [brand for brand in index.values("brand") if _mentions(text, brand)]
+    if brands:
+        filters["brand"] = brands
+    if price_min is not None:
+        filters["price_min"] = price_min
+    if price_max is not None:
+        filters["price_max"] = price_max
+    return filters
+
+
+# Filters dropped one at a time, in this order, when nothing matches all of them
+RELAX_ORDER = ("price", "brand", "category")
+
+
+def relaxed_filters(filters: dict):
+    """Yields `filters`, then progressively looser versions of it (never the empty filter)."""
+    current = dict(filters)
+    yield current
+    for name in RELAX_ORDER:
+        keys = ("price_min", "price_max") if name == "price" else (name,)
+        if not any(key in current for key in keys):
+            continue
+        current = {key: value for key, value in current.items() if key not in keys}
+        if set(current) <= {"type", "strict"}:
+            return
+        yield current
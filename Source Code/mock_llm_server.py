@@ -0,0 +1,187 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# === Defaults ===
+DEFAULT_REPLY = "You can track your order by logging into your Quantum Arc account and navigating to 'My Orders'."
+
+
+class MockLLMConfig:
+    """
+    Behaviour of the mock OpenAI-compatible server.
+
+    Args:
+        reply (str): Text returned for every completion.
+        tokens_per_sec (float): Streaming rate; 0 sends every token immediately.
+        first_token_delay (float): Seconds before the first token / non-streaming reply.
+        error_rate (float): Probability that a request fails with `error_status`.
+        error_status (int): Status code used for injected errors (e.g. 429 or 502).
+        retry_after (float | None): Retry-After header value sent with injected 429s.
+        fail_first (int): Deterministically fail this many requests before applying error_rate.
+        slow_rate (float): Probability that a request waits `slow_delay` extra seconds before its
+            first token (a tail-latency spike).
+        slow_delay (float): Extra delay for slow requests, in seconds.
+    """
+
+    def __init__(self, reply: str = DEFAULT_REPLY, tokens_per_sec: float = 0, first_token_delay: float = 0,
+                 error_rate: float = 0, error_status: int = 502, retry_after: float | None = None,
+                 fail_first: int = 0, slow_rate: float = 0, slow_delay: float = 0):
+        self.reply = reply
+        self.tokens_per_sec = tokens_per_sec
+        self.first_token_delay = first_token_delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.fail_first = fail_first
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return True
+        return random.random() < self.error_rate
+
+    def first_token_wait(self) -> float:
+        if self.slow_rate and random.random() < self.slow_rate:
+            return self.first_token_delay + self.slow_delay
+        return self.first_token_delay
+
+
+def _tokens(text: str) -> list:
+    # Split into word-ish pieces that keep their trailing whitespace, like real deltas
+    pieces, current = [], ""
+    for char in text:
+        current += char
+        if char == " ":
+            pieces.append(current)
+            current = ""
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection pooling can be observed
+    config: MockLLMConfig = None
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark and test output clean
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/health", "/v1/models"):
+            self._send_json(200, {"status": "ok", "requests": self.config.requests})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        config = self.config
+        if config.should_fail():
+            headers = {}
+            if config.error_status == 429 and config.retry_after is not None:
+                headers["Retry-After"] = str(config.retry_after)
+            self._send_json(config.error_status, {"error": {"message": "injected error", "code": config.error_status}}, headers)
+            return
+
+        wait = config.first_token_wait()
+        if wait:
+            time.sleep(wait)
+
+        model = payload.get("model", "mock")
+        if not payload.get("stream"):
+            self._send_json(200, {
+                "id": "mock-completion",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": config.reply}, "finish_reason": "stop"}],
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        interval = 1.0 / config.tokens_per_sec if config.tokens_per_sec else 0
+        try:
+            for token in _tokens(config.reply):
+                chunk = {"id": "mock-completion", "object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if interval:
+                    time.sleep(interval)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client cancelled the stream
+        self.close_connection = True
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, config: MockLLMConfig = None):
+    """
+    Starts the mock server on a background thread.
+
+    Returns:
+        tuple: (server, url) where url is the chat completions endpoint. Call server.shutdown() to stop.
+    """
+    handler = type("BoundMockLLMHandler", (MockLLMHandler,), {"config": config or MockLLMConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+    return server, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of an OpenAI-compatible chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--tokens-per-sec", type=float, default=50)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=502)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--slow-rate", type=float, default=0, help="share of requests delayed by --slow-delay")
+    parser.add_argument("--slow-delay", type=float, default=0)
+    args = parser.parse_args()
+
+    config = MockLLMConfig(args.reply, args.tokens_per_sec, args.first_token_delay,
+                           args.error_rate, args.error_status, args.retry_after,
+                           slow_rate=args.slow_rate, slow_delay=args.slow_delay)
+    handler = type("BoundMockLLMHandler", (MockLLMHandler,), {"config": config})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"🧪 Mock LLM listening on http://{args.host}:{args.port}/v1/chat/completions")
+    print(f"   Point the app at it with OPENROUTER_API_URL=http://{args.host}:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Mock LLM stopped.")
+
+
+if __name__ == "__main__":
+    main()
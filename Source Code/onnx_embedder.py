@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+import numpy as np
+
+# === Paths / settings ===
+MODEL_NAME = "intfloat/e5-base-v2"
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", "Source Code/Assets/onnx/e5-base-v2"))
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # intra-op threads; 0 lets onnxruntime pick (all cores)
+MAX_SEQ_LENGTH = 512
+
+# Validation gates: the quantized model must keep retrieval quality
+MIN_MEAN_COSINE = 0.99
+MIN_TOP_K_OVERLAP = 0.9
+
+
+def export_onnx(model_name: str = MODEL_NAME, out_dir: Path = ONNX_MODEL_DIR, quantize: bool = True) -> Path:
+    """
+    Exports the Hugging Face encoder behind the SentenceTransformer to ONNX (dynamic batch and
+    sequence axes) and, optionally, applies dynamic int8 weight quantization.
+
+    Returns:
+        Path: The model file to serve (int8 if quantized).
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(out_dir)
+
+    sample = tokenizer(["query: warm up"], return_tensors="pt")
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    fp32_path = out_dir / ONNX_FP32_FILE
+    print(f"🔄 Exporting {model_name} to {fp32_path} ...")
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(sample[name] for name in input_names), str(fp32_path),
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=17)
+    if not quantize:
+        return fp32_path
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = out_dir / ONNX_INT8_FILE
+    print(f"🔄 Quantizing weights to int8: {int8_path} ...")
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    print(f"✅ ONNX model ready ({fp32_path.stat().st_size / 1e6:.0f} MB fp32 → {int8_path.stat().st_size / 1e6:.0f} MB int8)")
+    return int8_path
+
+
+class OnnxEmbedder:
+    """
+    CPU embedding backend on onnxruntime with the same `encode` interface as SentenceTransformer,
+    reproducing e5-base-v2's pipeline: transformer → mean pooling over the attention mask → L2 normalize.
+
+    Args:
+        model_dir (Path): Directory written by export_onnx (tokenizer files + .onnx model).
+        quantized (bool): Use the int8 model (default) or the fp32 export.
+        threads (int): intra-op thread count; 0 lets onnxruntime decide.
+    """
+
+    def __init__(self, model_dir: Path = ONNX_MODEL_DIR, quantized: bool = True, threads: int = ONNX_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_dir = Path(model_dir)
+        model_path = model_dir / (ONNX_INT8_FILE if quantized else ONNX_FP32_FILE)
+        if not model_path.exists():
+            raise FileNotFoundError(f"{model_path} not found. Run: python \"Source Code/onnx_embedder.py\" export")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model_path = model_path
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            batch = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                   max_length=MAX_SEQ_LENGTH, return_tensors="np")
+            feeds = {name: batch[name].astype(np.int64) for name in batch if name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            mask = batch["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(pooled.astype(np.float32))
+        embeddings = np.concatenate(outputs) if outputs else np.zeros((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def _top_k(queries: np.ndarray, passages: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ passages.T), axis=1)[:, :k]
+
+
+def validate(model_dir: Path = ONNX_MODEL_DIR, quantized: bool = True, top_k: int = 3, threads: int = ONNX_THREADS) -> dict:
+    """
+    Compares the ONNX backend with the SentenceTransformer on the chunks: per-passage cosine
+    agreement, top-k retrieval overlap for the FAQ questions used as queries, and encode speed.
+    """
+    from sentence_transformers import SentenceTransformer
+    from preprocess_chunks import read_chunks
+
+    chunks = list(read_chunks())
+    passages = [f"passage: {chunk['content']}" for chunk in chunks]
+    questions = [chunk["question"] for chunk in chunks if chunk.get("question")]
+    questions += [f"tell me about the {chunk['name']}" for chunk in chunks if chunk.get("name")]
+    queries = [f"query: {question.lower()}" for question in questions]
+
+    reference = SentenceTransformer(MODEL_NAME)
+    candidate = OnnxEmbedder(model_dir, quantized=quantized, threads=threads)
+
+    def timed_encode(model, texts):
+        start = time.perf_counter()
+        vectors = np.asarray(model.encode(texts, convert_to_numpy=True), dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True), time.perf_counter() - start
+
+    ref_passages, ref_passage_time = timed_encode(reference, passages)
+    onnx_passages, onnx_passage_time = timed_encode(candidate, passages)
+    ref_queries, _ = timed_encode(reference, queries)
+    onnx_queries, _ = timed_encode(candidate, queries)
+
+    # Single-query latency is what a chat turn pays
+    single = queries[: min(20, len(queries))]
+    start = time.perf_counter()
+    for query in single:
+        reference.encode(query, convert_to_numpy=True)
+    ref_single_ms = (time.perf_counter() - start) * 1000 / len(single)
+    start = time.perf_counter()
+    for query in single:
+        candidate.encode(query, convert_to_numpy=True)
+    onnx_single_ms = (time.perf_counter() - start) * 1000 / len(single)
+
+    passage_cosine = np.sum(ref_passages * onnx_passages, axis=1)
+    query_cosine = np.sum(ref_queries * onnx_queries, axis=1)
+    ref_top = _top_k(ref_queries, ref_passages, top_k)
+    onnx_top = _top_k(onnx_queries, onnx_passages, top_k)
+    overlap = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(ref_top, onnx_top)])
+    top1_agreement = float(np.mean(ref_top[:, 0] == onnx_top[:, 0]))
+
+    return {
+        "model": str(candidate.model_path),
+        "passages": len(passages),
+        "queries": len(queries),
+        "passage_cosine_mean": float(passage_cosine.mean()),
+        "passage_cosine_min": float(passage_cosine.min()),
+        "query_cosine_mean": float(query_cosine.mean()),
+        f"top{top_k}_overlap": float(overlap),
+        "top1_agreement": top1_agreement,
+        "torch_passages_per_sec": len(passages) / ref_passage_time,
+        "onnx_passages_per_sec": len(passages) / onnx_passage_time,
+        "torch_single_query_ms": ref_single_ms,
+        "onnx_single_query_ms": onnx_single_ms,
+        "passed": bool(passage_cosine.mean() >= MIN_MEAN_COSINE and overlap >= MIN_TOP_K_OVERLAP),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX / int8 embedding backend tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export = subparsers.add_parser("export", help="Export e5-base-v2 to ONNX and quantize it to int8")
+    export.add_argument("--out", type=Path, default=ONNX_MODEL_DIR)
+    export.add_argument("--no-quantize", action="store_true")
+
+    check = subparsers.add_parser("validate", help="Compare ONNX vectors and retrieval with SentenceTransformer")
+    check.add_argument("--model-dir", type=Path, default=ONNX_MODEL_DIR)
+    check.add_argument("--fp32", action="store_true", help="Validate the fp32 export instead of int8")
+    check.add_argument("--k", type=int, default=3)
+    check.add_argument("--threads", type=int, default=ONNX_THREADS)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_onnx(MODEL_NAME, args.out, quantize=not args.no_quantize)
+    else:
+        result = validate(args.model_dir, quantized=not args.fp32, top_k=args.k, threads=args.threads)
+        print(json.dumps(result, indent=2))
+        if not result["passed"]:
+            print(f"❌ Below quality gate (mean cosine ≥ {MIN_MEAN_COSINE}, top-k overlap ≥ {MIN_TOP_K_OVERLAP})")
+            sys.exit(1)
+        print("✅ ONNX backend keeps retrieval quality")
+
+
+if __name__ == "__main__":
+    main()
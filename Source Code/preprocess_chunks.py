@@ -1,70 +1,335 @@
+import argparse
 import json
+import os
+import re
 from pathlib import Path
+from tokens import count_tokens
 
 # === File Paths ===
 FAQS_PATH = Path("Source Code/Assets/faqs.json")
 PRODUCTS_PATH = Path("Source Code/Assets/products.json")
 POLICIES_PATH = Path("Source Code/Assets/policies.json")
-OUTPUT_PATH = Path("Source Code/Assets/chunks.json")
+OUTPUT_PATH = Path("Source Code/Assets/chunks.jsonl")
+LEGACY_OUTPUT_PATH = Path("Source Code/Assets/chunks.json")  # read as a fallback by read_chunks()
 
-# === Step 1: Load JSON files ===
-def load_json(filepath):
+# === Chunking settings (override with environment variables) ===
+# e5-base-v2 reads at most 512 tokens, including the "passage: " prefix
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "400"))
+CHUNK_TOKEN_OVERLAP = int(os.getenv("CHUNK_TOKEN_OVERLAP", "50"))
+READ_BUFFER_SIZE = 1 << 20
+MAX_REPORTED_ERRORS = 10  # per source
+
+
+class SourceFormatError(ValueError):
+    """Raised when a source file is malformed or a record fails validation in strict mode."""
+
+
+# === Step 1: Read sources incrementally ===
+def _iter_json_lines(filepath: Path):
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise SourceFormatError(f"{filepath}:{line_number}: {e}") from e
+
+
+def _iter_json_container(filepath: Path):
+    decoder = json.JSONDecoder()
     with open(filepath, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-faqs = load_json(FAQS_PATH)
-products = load_json(PRODUCTS_PATH)
-policies = load_json(POLICIES_PATH)
-
-# === Step 2: Process into chunks ===
-chunks = []
-
-# --- Process FAQs ---
-for item in faqs:
-    chunk = {
-        "type": "faq",
-        "section": item.get("category", "General"),
-        "question": item["question"],
-        "answer": item["answer"],
-        "content": f"Q: {item['question']}\nA: {item['answer']}"
-    }
-    chunks.append(chunk)
-
-# --- Process Products ---
-for item in products:
-    features = "\n- " + "\n- ".join(item["key_features"])
-    chunk = {
-        "type": "product",
-        "category": item["category"],
-        "name": item["name"],
-        "brand": item["brand"],
-        "model": item["model"],
-        "price_usd": item["price_usd"],
-        "content": (
+        buffer = ""
+        position = 0
+        eof = False
+
+        def fill() -> bool:
+            # Drop the consumed prefix and append the next block; False once the file is exhausted
+            nonlocal buffer, position, eof
+            if eof:
+                return False
+            block = f.read(READ_BUFFER_SIZE)
+            eof = not block
+            buffer = buffer[position:] + block
+            position = 0
+            return not eof
+
+        def next_char() -> str:
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer):
+                    return buffer[position]
+                if not fill():
+                    return ""
+
+        def expect(chars: str) -> str:
+            nonlocal position
+            char = next_char()
+            if not char or char not in chars:
+                raise SourceFormatError(f"{filepath}: expected one of {chars!r}, got {char or 'end of file'!r}")
+            position += 1
+            return char
+
+        def decode():
+            nonlocal position
+            next_char()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as e:
+                    if fill():
+                        continue  # record straddles the block boundary
+                    raise SourceFormatError(f"{filepath}: {e}") from e
+                if end == len(buffer) and fill():
+                    continue  # a number may continue in the next block
+                position = end
+                return value
+
+        opening = expect("[{")
+        closing = "]" if opening == "[" else "}"
+        if next_char() == closing:
+            return
+        while True:
+            if opening == "[":
+                yield decode()
+            else:
+                key = decode()
+                expect(":")
+                yield key, decode()
+            if expect("," + closing) == closing:
+                return
+
+
+def iter_json_records(filepath: Path):
+    """
+    Streams the records of a source file without loading it whole.
+
+    `.jsonl` files yield one value per line; other files must hold a top-level JSON array
+    (yields each element) or object (yields (key, value) pairs). Only the current record
+    and a read buffer are held in memory.
+    """
+    filepath = Path(filepath)
+    if filepath.suffix == ".jsonl":
+        yield from _iter_json_lines(filepath)
+    else:
+        yield from _iter_json_container(filepath)
+
+
+# === Step 2: Split long text by a token budget ===
+def _split_units(text: str, budget: int) -> list:
+    """Lines, with any line over the budget broken into sentences and then words."""
+    units = []
+    for line in text.split("\n"):
+        if count_tokens(line) <= budget:
+            units.append(line)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", line):
+            if count_tokens(sentence) <= budget:
+                units.append(sentence)
+                continue
+            words = sentence.split()
+            step = max(1, len(words) * budget // (2 * count_tokens(sentence)))
+            units.extend(" ".join(words[i:i + step]) for i in range(0, len(words), step))
+    return units
+
+
+def split_by_tokens(text: str, budget: int = CHUNK_TOKEN_BUDGET, overlap: int = CHUNK_TOKEN_OVERLAP) -> list:
+    """
+    Splits text into parts of at most `budget` tokens on line / sentence boundaries.
+    Each part after the first repeats up to `overlap` tokens from the end of the previous one,
+    so an answer spanning a boundary is still retrievable from either side.
+    """
+    if count_tokens(text) <= budget:
+        return [text]
+    parts = []
+    current, current_tokens = [], 0
+    for unit in _split_units(text, budget):
+        unit_tokens = count_tokens(unit)
+        if current and current_tokens + unit_tokens > budget:
+            parts.append("\n".join(current).strip("\n"))
+            carried, carried_tokens = [], 0
+            for previous in reversed(current):
+                previous_tokens = count_tokens(previous)
+                if carried_tokens + previous_tokens > overlap or carried_tokens + previous_tokens + unit_tokens > budget:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous_tokens
+            current, current_tokens = carried, carried_tokens
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        parts.append("\n".join(current).strip("\n"))
+    return [part for part in parts if part]
+
+
+# === Step 3: Source adapters ===
+class SourceAdapter:
+    """
+    Turns one source file into chunks. To plug in a new data type, subclass it, set
+    `chunk_type` and `required` ({field: type or tuple of types}) and implement to_chunks().
+    """
+
+    chunk_type = ""
+    required = {}
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.records_read = 0
+        self.chunks_written = 0
+        self.invalid = 0
+
+    def records(self):
+        for record in iter_json_records(self.path):
+            # Keyed sources (a top-level object) only use the value
+            yield record[1] if isinstance(record, tuple) else record
+
+    def validate(self, item) -> list:
+        if not isinstance(item, dict):
+            return [f"expected an object, got {type(item).__name__}"]
+        errors = []
+        for field, expected in self.required.items():
+            value = item.get(field)
+            if value is None or value == "":
+                errors.append(f"missing '{field}'")
+            elif not isinstance(value, expected) or isinstance(value, bool):
+                errors.append(f"'{field}' has type {type(value).__name__}")
+        return errors
+
+    def to_chunks(self, item: dict):
+        raise NotImplementedError
+
+    def chunks(self, strict: bool = False):
+        for index, item in enumerate(self.records()):
+            self.records_read += 1
+            errors = self.validate(item)
+            if errors:
+                message = f"{self.path} record {index}: {', '.join(errors)}"
+                if strict:
+                    raise SourceFormatError(message)
+                self.invalid += 1
+                if self.invalid <= MAX_REPORTED_ERRORS:
+                    print(f"⚠️ Skipping {message}")
+                continue
+            for chunk in self.to_chunks(item):
+                self.chunks_written += 1
+                yield chunk
+
+
+def _part_label(label: str, n: int, parts: int) -> str:
+    return label if parts == 1 else f"{label} (part {n}/{parts})"
+
+
+def _numbered(chunks: list, key: str) -> list:
+    """Gives the sub-chunks of one record stable ids ("<key>#<n>") and part numbers."""
+    if len(chunks) == 1:
+        return chunks
+    return [{**chunk, "id": f"{key}#{n}", "part": n, "parts": len(chunks)} for n, chunk in enumerate(chunks, 1)]
+
+
+class FaqAdapter(SourceAdapter):
+    chunk_type = "faq"
+    required = {"question": str, "answer": str}
+
+    def to_chunks(self, item: dict):
+        yield {
+            "type": "faq",
+            "section": item.get("category", "General"),
+            "question": item["question"],
+            "answer": item["answer"],
+            "content": f"Q: {item['question']}\nA: {item['answer']}"
+        }
+
+
+class ProductAdapter(SourceAdapter):
+    chunk_type = "product"
+    required = {"name": str, "category": str, "brand": str, "model": str,
+                "price_usd": (int, float), "key_features": list}
+
+    def to_chunks(self, item: dict):
+        header = (
             f"Product: {item['name']}\n"
             f"Brand: {item['brand']}\n"
             f"Category: {item['category']}\n"
             f"Model: {item['model']}\n"
             f"Price: ${item['price_usd']}\n"
-            f"Key Features:{features}"
         )
-    }
-    chunks.append(chunk)
-
-# --- Process Policies ---
-for key, section in policies.items():
-    chunk = {
-        "type": "policy",
-        "section": section["title"],
-        "policy": section["policy"],
-        "content": f"{section['title']}:\n{section['policy']}"
-    }
-    chunks.append(chunk)
-
-# === Step 3: Save to chunks.json ===
-OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-    json.dump(chunks, f, indent=2, ensure_ascii=False)
-
-print(f"✅ Successfully created {len(chunks)} chunks and saved to {OUTPUT_PATH}")
+        features = "\n".join(f"- {feature}" for feature in item["key_features"])
+        budget = max(CHUNK_TOKEN_BUDGET - count_tokens(header) - 10, CHUNK_TOKEN_OVERLAP + 1)
+        parts = split_by_tokens(features, budget)
+        base = {
+            "type": "product",
+            "category": item["category"],
+            "name": item["name"],
+            "brand": item["brand"],
+            "model": item["model"],
+            "price_usd": item["price_usd"],
+        }
+        chunks = [{**base, "content": f"{header}{_part_label('Key Features', n, len(parts))}:\n{part}"}
+                  for n, part in enumerate(parts, 1)]
+        # Same key embed_chunks.chunk_key derives for an unsplit product
+        yield from _numbered(chunks, f"product:{item['brand']}:{item['model']}")
+
+
+class PolicyAdapter(SourceAdapter):
+    chunk_type = "policy"
+    required = {"title": str, "policy": str}
+
+    def to_chunks(self, item: dict):
+        budget = max(CHUNK_TOKEN_BUDGET - count_tokens(item["title"]) - 10, CHUNK_TOKEN_OVERLAP + 1)
+        parts = split_by_tokens(item["policy"], budget)
+        chunks = [{"type": "policy", "section": item["title"], "policy": part,
+                   "content": f"{_part_label(item['title'], n, len(parts))}:\n{part}"}
+                  for n, part in enumerate(parts, 1)]
+        yield from _numbered(chunks, f"policy:{item['title']}")
+
+
+def default_adapters() -> list:
+    return [FaqAdapter(FAQS_PATH), ProductAdapter(PRODUCTS_PATH), PolicyAdapter(POLICIES_PATH)]
+
+
+# === Step 4: Write chunks.jsonl ===
+def iter_chunks(adapters: list, strict: bool = False):
+    for adapter in adapters:
+        yield from adapter.chunks(strict=strict)
+
+
+def write_jsonl(chunks, output_path: Path = OUTPUT_PATH) -> int:
+    """Writes chunks one per line to a temporary file and swaps it in, so readers never see a partial file."""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    count = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def read_chunks(path: Path = OUTPUT_PATH):
+    """Streams the chunks written by this script, falling back to a legacy chunks.json."""
+    path = Path(path)
+    if not path.exists() and path == OUTPUT_PATH and LEGACY_OUTPUT_PATH.exists():
+        path = LEGACY_OUTPUT_PATH
+    yield from iter_json_records(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn the FAQ, product and policy sources into chunks.jsonl")
+    parser.add_argument("--output", type=Path, default=OUTPUT_PATH)
+    parser.add_argument("--strict", action="store_true", help="Stop at the first invalid record instead of skipping it")
+    args = parser.parse_args()
+
+    adapters = default_adapters()
+    count = write_jsonl(iter_chunks(adapters, strict=args.strict), args.output)
+    for adapter in adapters:
+        skipped = f", {adapter.invalid} invalid skipped" if adapter.invalid else ""
+        print(f"  {adapter.chunk_type:<8} {adapter.records_read} records → {adapter.chunks_written} chunks{skipped}")
+    print(f"✅ Successfully created {count} chunks and saved to {args.output}")
+
 
+if __name__ == "__main__":
+    main()
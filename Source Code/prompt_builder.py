@@ -1,3 +1,141 @@
+import os
+import re
+import threading
+import tracing
+from tokens import count_tokens
+
+# === Prompt budgets in tokens (override with environment variables) ===
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))   # recent turns kept verbatim
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "300"))    # rolling summary of older turns
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))   # retrieved support context block
+MESSAGE_OVERHEAD_TOKENS = 4      # role + separators per chat message
+SUMMARY_WORDS_PER_TURN = 25      # each older turn is cut to its first sentence, at most this many words
+
+def count_message_tokens(message: dict) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    """Cuts text to roughly `budget` tokens on a word boundary, keeping its line breaks."""
+    if count_tokens(text) <= budget:
+        return text
+    word_ends = [match.end() for match in re.finditer(r"\S+", text)]
+    low, high = 0, len(word_ends)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:word_ends[mid - 1]]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return (text[:word_ends[low - 1]] if low else "") + " …"
+
+
+class PromptSizeHistogram:
+    """
+    Cumulative histogram of prompt sizes in tokens, Prometheus-style buckets.
+    """
+
+    BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, float("inf"))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * len(self.BUCKETS)
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, tokens: int):
+        with self._lock:
+            for i, bound in enumerate(self.BUCKETS):
+                if tokens <= bound:
+                    self.counts[i] += 1
+                    break
+            self.total += 1
+            self.sum += tokens
+            self.max = max(self.max, tokens)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": {("+Inf" if bound == float("inf") else str(bound)): count
+                            for bound, count in zip(self.BUCKETS, self.counts)},
+                "count": self.total,
+                "sum": self.sum,
+                "mean": self.sum / self.total if self.total else 0.0,
+                "max": self.max,
+            }
+
+    def render(self) -> str:
+        """Text bar chart for logs / CLI."""
+        snapshot = self.snapshot()
+        lines = [f"Prompt size (tokens): n={snapshot['count']} mean={snapshot['mean']:.0f} max={snapshot['max']}"]
+        peak = max(snapshot["buckets"].values()) or 1
+        for label, count in snapshot["buckets"].items():
+            lines.append(f"  ≤{label:>6} | {'█' * round(30 * count / peak):<30} {count}")
+        return "\n".join(lines)
+
+
+prompt_size_histogram = PromptSizeHistogram()
+
+
+def summarize_turns(messages: list, budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Extractive rolling summary of turns that fell out of the history window: the first
+    sentence of each turn, newest turns kept first when the budget runs out.
+    """
+    lines = []
+    used = 0
+    for message in reversed(messages):
+        first_sentence = re.split(r"(?<=[.!?])\s+", message["content"].strip(), maxsplit=1)[0]
+        words = first_sentence.split()
+        if len(words) > SUMMARY_WORDS_PER_TURN:
+            first_sentence = " ".join(words[:SUMMARY_WORDS_PER_TURN]) + " …"
+        line = f"- {message['role'].capitalize()}: {first_sentence}"
+        cost = count_tokens(line)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(reversed(lines))
+
+
+def window_history(history: list, budget: int = HISTORY_TOKEN_BUDGET) -> tuple:
+    """
+    Splits history into (older, recent): `recent` is the longest suffix that fits the budget.
+    """
+    used = 0
+    cut = len(history)
+    for i in range(len(history) - 1, -1, -1):
+        cost = count_message_tokens(history[i])
+        if used + cost > budget:
+            break
+        used += cost
+        cut = i
+    return history[:cut], history[cut:]
+
+
+def build_context(top_chunks: list, budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Formats retrieved chunks in rank order until the token budget is used; the first chunk
+    is always included (truncated if needed).
+    """
+    context_parts = []
+    used = 0
+    for i, chunk in enumerate(top_chunks, 1):
+        section = chunk.get("section", chunk.get("category", ""))
+        chunk_type = chunk.get("type", "")
+        label = f"{chunk_type.capitalize()} - {section}" if section else chunk_type.capitalize()
+        part = f"---\n[{label}]\n{chunk['content']}"
+        cost = count_tokens(part)
+        if used + cost > budget:
+            if not context_parts:
+                context_parts.append(_truncate_to_tokens(part, budget))
+            break
+        context_parts.append(part)
+        used += cost
+    return "\n".join(context_parts)
+
+
 def build_prompt(question: str, top_chunks: list, history: list = None) -> list:
     """
     Builds a list of messages (chat format) for the LLM to enable conversation memory.
@@ -8,18 +146,12 @@ def build_prompt(question: str, top_chunks: list, history: list = None) -> list:
         history (list): Previous chat history as list of dicts with 'role' and 'content'.
 
     Returns:
-        list: Chat messages formatted for LLM (OpenRouter-style).
+        list: Chat messages formatted for LLM (OpenRouter-style). History and context are
+        trimmed to their token budgets so prompt size stays bounded as the conversation grows.
     """
 
-    # Combine chunks into a single structured context string
-    context_parts = []
-    for i, chunk in enumerate(top_chunks, 1):
-        section = chunk.get("section", chunk.get("category", ""))
-        chunk_type = chunk.get("type", "")
-        label = f"{chunk_type.capitalize()} - {section}" if section else chunk_type.capitalize()
-        context_parts.append(f"---\n[{label}]\n{chunk['content']}")
-    
-    context = "\n".join(context_parts)
+    # Combine chunks into a single structured context string, capped at CONTEXT_TOKEN_BUDGET
+    context = build_context(top_chunks)
 
     # Prompt with behavior instructions
     messages = [
@@ -45,11 +177,21 @@ def build_prompt(question: str, top_chunks: list, history: list = None) -> list:
         }
     ]
 
-    # Include prior chat history if available
+    # Include prior chat history if available: recent turns verbatim within HISTORY_TOKEN_BUDGET,
+    # older turns compressed into a rolling summary
     if history:
-        messages.extend(history)
+        older, recent = window_history(history)
+        if older:
+            summary = summarize_turns(older)
+            if summary:
+                messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        messages.extend(recent)
 
     # Add the current user question
     messages.append({"role": "user", "content": question})
 
+    prompt_tokens = sum(count_message_tokens(message) for message in messages)
+    prompt_size_histogram.observe(prompt_tokens)
+    tracing.annotate(prompt_tokens=prompt_tokens)
+
     return messages
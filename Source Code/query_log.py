@@ -0,0 +1,249 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Resolved from this file, so the log lands in Source Code/Assets whatever the working directory
+QUERY_LOG_PATH = Path(os.getenv("QUERY_LOG_PATH", Path(__file__).resolve().parent / "Assets" / "unanswered_queries.jsonl"))
+
+# === Writer settings (override with environment variables) ===
+QUERY_LOG_QUEUE_SIZE = int(os.getenv("QUERY_LOG_QUEUE_SIZE", "10000"))
+QUERY_LOG_BATCH_SIZE = int(os.getenv("QUERY_LOG_BATCH_SIZE", "100"))              # entries per group commit
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", "0.5"))    # seconds a batch may wait
+QUERY_LOG_FSYNC = os.getenv("QUERY_LOG_FSYNC", "1") == "1"                        # fsync after every commit
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # 0 disables rotation
+QUERY_LOG_BACKUPS = int(os.getenv("QUERY_LOG_BACKUPS", "5"))                      # rotated files kept (.1 … .N)
+QUERY_LOG_RETRY_DELAY = float(os.getenv("QUERY_LOG_RETRY_DELAY", "0.5"))          # first wait before retrying a failed batch
+QUERY_LOG_MAX_RETRY_DELAY = 30.0                                                  # retry waits double up to this
+
+_STOP = object()
+
+
+class QueryLogError(Exception):
+    """An entry could not be written to the log."""
+
+
+@contextmanager
+def _file_lock(lock_path: Path):
+    """Exclusive advisory lock on `lock_path`, shared by every process writing the same log."""
+    with open(lock_path, "a+b") as lock_file:
+        if os.name == "nt":
+            import msvcrt
+
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK gives up after ~10 s; keep waiting
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class QueryLogWriter:
+    """
+    Appends JSON entries to a JSONL log from a background thread.
+
+    write() only enqueues, so the chat response never waits on disk. The worker group-commits
+    up to `batch_size` entries (or whatever arrived within `flush_interval`) in a single
+    write + optional fsync, under a lock file so several app processes can share the log,
+    and rotates the file once it exceeds `max_bytes`. Pending entries are flushed at exit.
+
+    If the queue is full the entry is written synchronously instead of being dropped:
+    these are customer contact requests, so an overloaded writer costs latency, not data.
+    A batch that fails to commit is kept and retried with doubling waits; while the log is
+    failing, write() also commits synchronously, so callers learn about the failure
+    (QueryLogError) instead of being told the entry was saved.
+    """
+
+    def __init__(self, path: Path = QUERY_LOG_PATH, max_queue: int = QUERY_LOG_QUEUE_SIZE,
+                 batch_size: int = QUERY_LOG_BATCH_SIZE, flush_interval: float = QUERY_LOG_FLUSH_INTERVAL,
+                 fsync: bool = QUERY_LOG_FSYNC, max_bytes: int = QUERY_LOG_MAX_BYTES, backups: int = QUERY_LOG_BACKUPS,
+                 retry_delay: float = QUERY_LOG_RETRY_DELAY):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+        self.rotations = 0
+        self.sync_writes = 0
+        self.errors = 0
+        self.failing = False    # the last commit failed; cleared by the next successful one
+        self.pending = 0        # entries of failed batches waiting for a retry
+        self._unsaved = 0       # queued entries not yet committed (including pending ones)
+        self._saved = threading.Condition()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+                    self._thread.start()
+
+    def write(self, entry: dict):
+        """
+        Queues one entry and returns immediately. The entry is committed synchronously instead
+        when the queue is full, the writer is closed or the log is failing; a failed synchronous
+        commit raises QueryLogError, so the entry is never silently lost.
+        """
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        if self._closed or self.failing:
+            self._commit([line])
+            return
+        if self._thread is not None and not self._thread.is_alive():
+            print(f"⚠️ Writer thread for {self.path} stopped; restarting it.")
+            self._thread = None
+        self._ensure_started()
+        with self._saved:
+            self._unsaved += 1
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self._mark_saved(1)
+            self.sync_writes += 1
+            self._commit([line])
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Blocks until every entry queued so far is on disk, including failed batches waiting
+        for a retry. Returns False if `timeout` seconds passed with entries still unsaved.
+        """
+        with self._saved:
+            return self._saved.wait_for(lambda: self._unsaved == 0, timeout)
+
+    def _mark_saved(self, count: int):
+        with self._saved:
+            self._unsaved -= count
+            self._saved.notify_all()
+
+    def close(self, timeout: float = 5.0):
+        """Drains the queue and stops the worker (registered with atexit for the global writer)."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _rotate_locked(self, incoming: int):
+        if not self.max_bytes or not self.path.exists():
+            return
+        if self.path.stat().st_size + incoming <= self.max_bytes:
+            return
+        for n in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{n}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{n + 1}"))
+        if self.backups:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+        self.rotations += 1
+
+    def _commit(self, lines: list):
+        """Appends the lines in one write; raises QueryLogError (after counting it) on failure."""
+        data = "".join(lines).encode("utf-8")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # The size check, rotation and append happen under one lock, so processes never interleave
+            with _file_lock(self.lock_path):
+                self._rotate_locked(len(data))
+                with open(self.path, "ab") as f:
+                    f.write(data)
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+        except Exception as e:
+            self.errors += 1
+            self.failing = True
+            print(f"❌ Error saving {len(lines)} entries to {self.path}: {str(e)}")
+            raise QueryLogError(f"Could not write to {self.path}: {e}") from e
+        self.written += len(lines)
+        self.batches += 1
+        self.failing = False
+
+    def _take(self, timeout: float = None):
+        try:
+            if timeout is None:
+                return self._queue.get()
+            return self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _run(self):
+        pending = []  # lines of a failed batch, committed again before anything newer
+        delay = self.retry_delay
+        stopping = False
+        while not stopping:
+            first = self._take(delay if pending else None)
+            items = [] if first is None else [first]
+            deadline = time.monotonic() + self.flush_interval
+            while items and items[-1] is not _STOP and len(items) < self.batch_size:
+                item = self._take(deadline - time.monotonic())
+                if item is None:
+                    break
+                items.append(item)
+            stopping = bool(items) and items[-1] is _STOP
+            if stopping:
+                # Drain whatever was queued right before shutdown
+                while (item := self._take(0)) is not None:
+                    items.append(item)
+            batch = pending + [item for item in items if item is not _STOP]
+            if batch:
+                try:
+                    self._commit(batch)
+                    self._mark_saved(len(batch))
+                    pending, delay = [], self.retry_delay
+                except QueryLogError:
+                    pending, delay = batch, min(delay * 2, QUERY_LOG_MAX_RETRY_DELAY)
+                    if not stopping:
+                        print(f"🔁 Retrying {len(pending)} entries in {delay:.1f}s")
+            self.pending = len(pending)
+
+        if pending:
+            # Last resort at shutdown: the entries go to the console so they can be recovered by hand
+            print(f"❌ {len(pending)} entries could not be written to {self.path}:")
+            for line in pending:
+                print(line, end="")
+
+    def stats(self) -> dict:
+        return {
+            "written": self.written,
+            "batches": self.batches,
+            "queue_depth": self._queue.qsize(),
+            "sync_writes": self.sync_writes,
+            "rotations": self.rotations,
+            "errors": self.errors,
+            "failing": self.failing,
+            "pending": self.pending,
+        }
+
+
+# Shared writer for the unanswered-query log
+query_log = QueryLogWriter()
+atexit.register(query_log.close)
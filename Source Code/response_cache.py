@@ -0,0 +1,172 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import numpy as np
+
+# === Response cache settings (override with environment variables) ===
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))             # 0 disables the cache
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))  # min cosine similarity
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "21600"))           # seconds; 0 means no expiry
+
+# A follow-up whose answer depends on earlier turns: a word pointing back into the conversation
+# ("its battery", "the other one", "that laptop") or an opening that continues it ("and in black?")
+CONVERSATION_REFERENCE = re.compile(
+    r"\b(it|its|it's|this|that|these|those|they|them|their|one|ones|same|other|another|"
+    r"above|previous|earlier|former|latter|also|too|else|instead|more)\b"
+    r"|^\W*(and|or|but|so|what about|how about)\b",
+    re.IGNORECASE,
+)
+STANDALONE_MIN_WORDS = 4  # shorter questions ("in black?", "price?") lean on the conversation
+
+
+def chunk_ids(chunks: list) -> tuple:
+    """Stable identifiers of retrieved chunks, in rank order."""
+    return tuple(
+        chunk.get("id") or chunk.get("hash") or hashlib.sha256(chunk["content"].encode("utf-8")).hexdigest()
+        for chunk in chunks
+    )
+
+
+class SemanticResponseCache:
+    """
+    Caches LLM answers for first-turn and self-contained questions, keyed on the query embedding.
+
+    A lookup hits when a stored query is at least `threshold` cosine-similar to the
+    new one AND retrieval returned the same chunk IDs, so a paraphrase only reuses an
+    answer that was generated from identical support context. Entries are bound to the
+    index content hash and the whole cache is dropped when the knowledge base is re-embedded.
+
+    Args:
+        max_size (int): Maximum number of cached answers (least recently used is evicted).
+        threshold (float): Minimum cosine similarity between query embeddings for a hit.
+        ttl (float): Seconds an answer stays valid. 0 disables expiry.
+    """
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, threshold: float = RESPONSE_CACHE_THRESHOLD,
+                 ttl: float = RESPONSE_CACHE_TTL):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vectors = None                 # (max_size, d) normalized query embeddings
+        self._entries = [None] * max(max_size, 0)  # (chunk_ids, response, stored_at) per slot
+        self._last_used = np.zeros(max(max_size, 0), dtype=np.float64)
+        self._index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.near_misses = 0  # similar query but different retrieved chunks
+        self.inserts = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def is_cacheable_context(history: list, question: str = "") -> bool:
+        """
+        Whether the answer depends only on the question and the retrieved chunks: there is no
+        prior conversation, or the question stands on its own (at least STANDALONE_MIN_WORDS
+        words and nothing referring back to earlier turns). Without the question text, a
+        conversation is never cached.
+        """
+        if not history:
+            return True
+        return len(question.split()) >= STANDALONE_MIN_WORDS and not CONVERSATION_REFERENCE.search(question)
+
+    def _check_version(self, index_version: str):
+        if index_version != self._index_version:
+            if self._index_version is not None and any(self._entries):
+                self.invalidations += 1
+            self._entries = [None] * len(self._entries)
+            self._vectors = None
+            self._index_version = index_version
+
+    def _live_mask(self, now: float) -> np.ndarray:
+        return np.array([
+            entry is not None and not (self.ttl and now - entry[2] > self.ttl)
+            for entry in self._entries
+        ], dtype=bool)
+
+    def lookup(self, query_embedding: np.ndarray, chunks: list, history: list, index_version: str = "",
+               question: str = ""):
+        """
+        Returns a cached answer for this query and retrieved context, or None.
+        """
+        if self.max_size <= 0 or not self.is_cacheable_context(history, question):
+            return None
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        ids = chunk_ids(chunks)
+
+        with self._lock:
+            self._check_version(index_version)
+            if self._vectors is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            scores = self._vectors @ query
+            scores[~self._live_mask(now)] = -np.inf
+
+            # Walk candidates from most similar down until the threshold; the first one with the same chunks wins
+            for slot in np.argsort(-scores):
+                if scores[slot] < self.threshold:
+                    break
+                cached_ids, response, _ = self._entries[slot]
+                if cached_ids == ids:
+                    self._last_used[slot] = now
+                    self.hits += 1
+                    return response
+                self.near_misses += 1
+            self.misses += 1
+            return None
+
+    def store(self, query_embedding: np.ndarray, chunks: list, history: list, response: str,
+              index_version: str = "", question: str = ""):
+        """
+        Caches an answer. Callers must not pass fallback or error responses.
+        """
+        if self.max_size <= 0 or not self.is_cacheable_context(history, question) or not response:
+            return
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        with self._lock:
+            self._check_version(index_version)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, query.shape[0]), dtype=np.float32)
+            now = time.time()
+            live = self._live_mask(now)
+            if live.all():
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            else:
+                slot = int(np.flatnonzero(~live)[0])
+            self._vectors[slot] = query
+            self._entries[slot] = (chunk_ids(chunks), response, now)
+            self._last_used[slot] = now
+            self.inserts += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries = [None] * len(self._entries)
+            self._vectors = None
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": sum(entry is not None for entry in self._entries),
+            "max_size": self.max_size,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "near_misses": self.near_misses,
+            "inserts": self.inserts,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# Shared by every session in the process
+response_cache = SemanticResponseCache()
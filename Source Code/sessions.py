@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable
+
+# === Session limits (override with environment variables) ===
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))                 # least recently active is evicted first
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))       # seconds without a message before expiry
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "40"))   # per-session history kept in memory
+
+
+class ChatSession:
+    """
+    Conversation state of one user.
+
+    Holds what used to be module globals in ProgramEngine (fallback email-capture mode and
+    the question that triggered it) plus the latest history. `lock` serializes state
+    transitions when the same session sends overlapping requests. `clock` supplies the
+    activity timestamps (the owning SessionStore passes its own).
+    """
+
+    def __init__(self, session_id: str = None, clock: Callable[[], float] = time.time):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.history = []
+        self.waiting_for_fallback_info = False
+        self.original_question = ""
+        self.lock = threading.RLock()
+        self._clock = clock
+        self.created_at = clock()
+        self.last_active = self.created_at
+
+    def touch(self):
+        self.last_active = self._clock()
+
+    def start_fallback(self, question: str):
+        with self.lock:
+            self.waiting_for_fallback_info = True
+            self.original_question = question
+
+    def clear_fallback(self):
+        with self.lock:
+            self.waiting_for_fallback_info = False
+            self.original_question = ""
+
+    def record_history(self, history: list):
+        """Keeps only the most recent MAX_HISTORY_MESSAGES messages so idle sessions stay small."""
+        with self.lock:
+            self.history = list(history[-MAX_HISTORY_MESSAGES:]) if MAX_HISTORY_MESSAGES else list(history)
+
+
+class SessionStore:
+    """
+    Thread-safe, bounded registry of ChatSession objects with idle expiry, so one process
+    can serve many concurrent chats without sessions leaking into each other.
+
+    Args:
+        max_sessions (int): Upper bound on live sessions; the least recently active is evicted.
+        idle_ttl (float): Sessions idle for longer than this many seconds are dropped.
+        clock (callable): Returns the current time in seconds; time.time unless injected.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_ttl: float = SESSION_IDLE_TTL,
+                 clock: Callable[[], float] = time.time):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _expire_locked(self, now: float):
+        # Sessions are ordered by last activity, so stop at the first one still fresh
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_active <= self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def get_or_create(self, session_id: str = None) -> ChatSession:
+        """Returns the live session for `session_id` (touching it) or starts a new one."""
+        now = self.clock()
+        with self._lock:
+            self._expire_locked(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = ChatSession(session_id, clock=self.clock)
+                self._sessions[session.session_id] = session
+                self.created += 1
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted += 1
+            session.touch()
+            self._sessions.move_to_end(session.session_id)
+            return session
+
+    def get(self, session_id: str) -> ChatSession | None:
+        with self._lock:
+            self._expire_locked(self.clock())
+            return self._sessions.get(session_id)
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def expire_idle(self) -> int:
+        """Drops idle sessions now; returns how many were removed."""
+        with self._lock:
+            before = self.expired
+            self._expire_locked(self.clock())
+            return self.expired - before
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+# Shared by every Streamlit session / API request in the process
+session_store = SessionStore()
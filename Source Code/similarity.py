@@ -1,34 +1,244 @@
-import pickle
+import os
+import threading
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from pathlib import Path
+import startup
+import tracing
+from ann import _top_k_rows, load_ann_index
+from bm25 import BM25Index, reciprocal_rank_fusion
+from metadata_index import MetadataIndex, parse_filters, relaxed_filters
+from vector_store import INDEX_DIR, load_index, _normalize_rows
 
-# === Load embedded chunks from disk ===
-EMBEDDED_CHUNKS_PATH = Path("Source Code/Assets/embedded_chunks.pkl")
-with open(EMBEDDED_CHUNKS_PATH, "rb") as f:
-    embedded_chunks = pickle.load(f)
+# === Hybrid retrieval settings ===
+HYBRID_CANDIDATES = 20  # dense and BM25 candidates each contribute this many ranks to the fusion
+RRF_K = 60
 
-def get_top_chunks(query_embedding: np.ndarray, top_k: int = 3) -> list:
+# "exact" (brute force), "ivf" or "hnsw"; ANN backends need their sidecar (embed_chunks.py --ann ...)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "exact")
+
+# Infer type / category / brand / price filters from the question and score only matching rows
+METADATA_FILTERS = os.getenv("METADATA_FILTERS", "1") == "1"
+FILTER_SCAN_BLOCK = 65536  # filtered rows gathered from the matrix at a time
+
+class ChunkIndex:
+    """
+    Retrieval index over embedded chunks.
+
+    The chunk vectors are held as a contiguous, pre-L2-normalized float32
+    matrix, so cosine similarity becomes a single dot product per query and
+    top-k selection uses argpartition instead of a full sort.
+
+    Args:
+        vectors (np.ndarray): Shape (n, d) chunk embeddings.
+        chunks: Sequence of chunk dicts row-aligned with vectors (list or VectorStore).
+        normalized (bool): True if the rows are already float32 unit vectors, in which
+            case the array (e.g. a read-only memmap) is used as-is without a copy.
+    """
+
+    def __init__(self, vectors: np.ndarray, chunks, normalized: bool = False):
+        self.chunks = chunks
+        if normalized and vectors.dtype == np.float32:
+            self.matrix = vectors
+        else:
+            self.matrix = _normalize_rows(vectors)
+
+    @classmethod
+    def from_chunks(cls, chunks: list) -> "ChunkIndex":
+        """Builds an index from a list of chunk dicts that each carry an "embedding" key."""
+        vectors = np.stack([chunk["embedding"] for chunk in chunks]) if chunks else np.zeros((0, 0), dtype=np.float32)
+        return cls(vectors, chunks)
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def score(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity between query vectors and every chunk.
+
+        Args:
+            query_embeddings (np.ndarray): Shape (d,) for one query or (q, d) for a batch.
+
+        Returns:
+            np.ndarray: Shape (q, n) similarity matrix ((q, 0) for an empty index).
+        """
+        queries = _normalize_rows(np.atleast_2d(query_embeddings))
+        if not len(self.matrix):
+            # An empty index has no dimension to check the queries against, just no results
+            return np.zeros((len(queries), 0), dtype=np.float32)
+        return queries @ self.matrix.T
+
+    def top_k_indices(self, query_embeddings: np.ndarray, top_k: int = 3) -> np.ndarray:
+        """
+        Row indices of the top-k chunks for each query, best first.
+
+        Returns:
+            np.ndarray: Shape (q, min(top_k, n)) array of chunk indices.
+        """
+        scores = self.score(query_embeddings)
+        k = min(top_k, scores.shape[1])
+        if k <= 0:
+            return np.zeros((scores.shape[0], 0), dtype=np.int64)
+
+        # argpartition gives the unordered top-k in O(n); only those k get sorted
+        if k < scores.shape[1]:
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1, kind="stable")
+        return np.take_along_axis(candidates, order, axis=1)
+
+    def top_k_in_rows(self, query_embedding: np.ndarray, rows: np.ndarray, top_k: int = 3) -> np.ndarray:
+        """
+        Top-k among `rows` only, best first: a pre-filtered scan that never scores the other rows.
+        Rows are gathered in blocks so a large filter does not copy the whole matrix at once.
+        """
+        query = _normalize_rows(np.atleast_2d(query_embedding))[0]
+        best = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, len(rows), FILTER_SCAN_BLOCK):
+            block = rows[start:start + FILTER_SCAN_BLOCK]
+            scores = np.asarray(self.matrix[block], dtype=np.float32) @ query
+            candidates = np.concatenate([best, block])
+            candidate_scores = np.concatenate([best_scores, scores])
+            keep = _top_k_rows(candidate_scores, np.arange(len(candidates)), top_k)
+            best, best_scores = candidates[keep], candidate_scores[keep]
+        return best
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 3) -> list:
+        """Returns the top-k chunk dicts for a single query vector."""
+        return self.search_batch(query_embedding, top_k)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 3) -> list:
+        """Returns one list of top-k chunk dicts per query vector, scored in one matrix multiply."""
+        return [[self.chunks[i] for i in row] for row in self.top_k_indices(query_embeddings, top_k)]
+
+
+class Retriever:
+    """
+    Everything retrieval needs, loaded together from one index generation:
+    the memory-mapped store, the exact ChunkIndex, the configured dense backend, BM25 and the
+    metadata partitions used for pre-filtering.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, backend: str = RETRIEVAL_BACKEND):
+        with startup.timed("open vector index"):
+            self.vector_store = load_index(index_dir)
+            # float32 stores are scored straight from the shared memmap
+            self.chunk_index = ChunkIndex(self.vector_store.float32_vectors(), self.vector_store,
+                                          normalized=self.vector_store.header.get("normalized", False))
+
+        # Dense search backend: the configured ANN index (which must have been built) or exact search
+        with startup.timed(f"load {backend} dense index"):
+            self.dense_index = load_ann_index(backend, self.vector_store, self.chunk_index.matrix) or self.chunk_index
+
+        # Lexical index over the same rows; indexes written before BM25 existed get one built in memory
+        with startup.timed("load BM25 index"):
+            bm25_path = self.vector_store.sidecar_path("bm25")
+            self.bm25_index = BM25Index.load(bm25_path) if bm25_path else BM25Index.build(self.vector_store)
+
+        with startup.timed("load metadata index"):
+            metadata_path = self.vector_store.sidecar_path("metadata")
+            self.metadata_index = (MetadataIndex.load(metadata_path) if metadata_path
+                                   else MetadataIndex.build(self.vector_store))
+
+    def filtered_rows(self, filters: dict) -> np.ndarray | None:
+        """
+        Rows matching `filters`, loosening them (price, then brand, then category) until
+        some product matches; a non-strict filter then keeps the rows of the other types too.
+        None means no restriction: no filters, or nothing matched at all.
+        """
+        if not filters:
+            return None
+        for candidate in relaxed_filters(filters):
+            matched = self.metadata_index.select({**candidate, "strict": True})
+            if matched is not None and len(matched):
+                rows = matched if candidate.get("strict", True) else self.metadata_index.select(candidate)
+                tracing.annotate(filters=candidate, filtered_rows=len(rows))
+                return rows
+        return None
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever() -> Retriever:
+    """Lazily loads the retrieval indexes on first use and shares them process-wide."""
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                _retriever = Retriever()
+    return _retriever
+
+
+def get_vector_store():
+    return get_retriever().vector_store
+
+
+def get_top_chunks(query_embedding: np.ndarray, top_k: int = 3, query_text: str = None, filters: dict = None) -> list:
     """
     Compares query embedding with all chunk embeddings and returns top-k relevant chunks.
+    When the query text is given, dense and BM25 rankings are merged with reciprocal-rank
+    fusion so exact tokens (model numbers, brands, SKUs) are not lost.
+
+    Structured filters ("laptops under $1500" → product, Laptops, price ≤ 1500) are inferred
+    from the query text unless given explicitly; only the matching rows are then scored,
+    with an exact scan of that subset in place of the dense backend.
 
     Args:
         query_embedding (np.ndarray): The embedding of the user question.
         top_k (int): Number of top relevant chunks to return.
+        query_text (str): Raw user question for the lexical side of hybrid retrieval.
+        filters (dict): Optional metadata filters (see metadata_index.MetadataIndex.select).
 
     Returns:
         list of dicts: Top-k most relevant chunks (including content, type, section, etc.)
     """
-    # Extract just the vectors from embedded chunks
-    chunk_vectors = np.array([chunk["embedding"] for chunk in embedded_chunks])
+    retriever = get_retriever()
+    vector_store, dense_index, bm25_index = retriever.vector_store, retriever.dense_index, retriever.bm25_index
+    query = _normalize_rows(np.atleast_2d(query_embedding))
+    if filters is None and query_text and METADATA_FILTERS:
+        filters = parse_filters(query_text, retriever.metadata_index)
+    rows = retriever.filtered_rows(filters)
+
+    candidates = max(top_k, HYBRID_CANDIDATES)
+    if rows is not None:
+        dense_rows = retriever.chunk_index.top_k_in_rows(query, rows, candidates if query_text else top_k)
+        if not query_text:
+            return [vector_store[row] for row in dense_rows]
+        lexical_scores = bm25_index.score(query_text)[rows]
+        matched = lexical_scores > 0
+        lexical_rows = _top_k_rows(lexical_scores[matched], rows[matched], candidates)
+    elif not query_text:
+        return [vector_store[row] for row in dense_index.top_k_indices(query, top_k)[0]]
+    else:
+        dense_rows = dense_index.top_k_indices(query, candidates)[0]
+        lexical_rows = bm25_index.top_k(query_text, candidates)
+    fused = reciprocal_rank_fusion([dense_rows, lexical_rows], k=RRF_K)
+    return [vector_store[row] for row in fused[:top_k]]
 
-    # Compute cosine similarity
-    similarities = cosine_similarity([query_embedding], chunk_vectors)[0]
 
-    # Rank chunks by similarity
-    top_indices = similarities.argsort()[-top_k:][::-1]
+def get_exact_matches(question: str, top_k: int = 3) -> list:
+    """
+    Resolves a question that is just a model number / SKU straight from the BM25 exact-match
+    table, without a transformer pass. Returns [] when the question is not an obvious SKU.
+    """
+    retriever = get_retriever()
+    return [retriever.vector_store[row] for row in retriever.bm25_index.exact_lookup(question)[:top_k]]
 
-    # Get the actual top chunks
-    top_chunks = [embedded_chunks[i] for i in top_indices]
 
-    return top_chunks
+def get_top_chunks_batch(query_embeddings: np.ndarray, top_k: int = 3) -> list:
+    """
+    Batch version of get_top_chunks: scores many query vectors in one matrix multiply.
+
+    Args:
+        query_embeddings (np.ndarray): Shape (q, d) array of query embeddings.
+        top_k (int): Number of top relevant chunks to return per query.
+
+    Returns:
+        list of lists of dicts: Top-k chunks for each query, in input order.
+    """
+    retriever = get_retriever()
+    rows = retriever.dense_index.top_k_indices(_normalize_rows(np.atleast_2d(query_embeddings)), top_k)
+    return [[retriever.vector_store[i] for i in row] for row in rows]
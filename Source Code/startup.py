@@ -0,0 +1,37 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Reference point for "time since boot"; this module is imported first by the entry points
+BOOT_TIME = time.perf_counter()
+
+_stages = {}
+_lock = threading.Lock()
+
+
+@contextmanager
+def timed(stage: str):
+    """Records how long a startup stage took and prints it as soon as it finishes."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _stages[stage] = elapsed
+        print(f"⏱️ {stage}: {elapsed:.2f}s")
+
+
+def stages() -> dict:
+    with _lock:
+        return dict(_stages)
+
+
+def report() -> str:
+    """Startup-time breakdown, slowest stage first, for tracking cold-start regressions."""
+    recorded = stages()
+    lines = ["⏱️ Startup breakdown:"]
+    for stage, elapsed in sorted(recorded.items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"  {stage:<32} {elapsed:>7.2f}s")
+    lines.append(f"  {'since boot':<32} {time.perf_counter() - BOOT_TIME:>7.2f}s")
+    return "\n".join(lines)
@@ -0,0 +1,33 @@
+import os
+import re
+import threading
+
+# Local Hugging Face tokenizer used for counting (already on disk once the embedding model was downloaded)
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "intfloat/e5-base-v2")
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def _get_tokenizer():
+    """Loads the tokenizer once; returns False if it is unavailable so counting falls back to a heuristic."""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                try:
+                    from transformers import AutoTokenizer
+                    _tokenizer = AutoTokenizer.from_pretrained(PROMPT_TOKENIZER, local_files_only=True)
+                except Exception as e:
+                    print(f"⚠️ Tokenizer '{PROMPT_TOKENIZER}' unavailable ({e}); using approximate token counts.")
+                    _tokenizer = False
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in `text` (subword tokenizer when available, else a word/punctuation estimate)."""
+    tokenizer = _get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    # Subword tokenizers split roughly 1.3 pieces per word
+    return int(len(re.findall(r"\w+|[^\w\s]", text)) * 1.3) + 1
@@ -0,0 +1,354 @@
+import argparse
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from query_log import QueryLogError, QueryLogWriter
+
+# === Tracing settings (override with environment variables) ===
+TRACING = os.getenv("TRACING", "1") == "1"
+# One JSON line per finished request; empty disables the file export (in-memory window only)
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", str(Path(__file__).resolve().parent / "Assets" / "traces.jsonl"))
+TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+TRACE_WINDOW = int(os.getenv("TRACE_WINDOW", "2048"))  # recent traces kept in memory for percentiles
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """
+    Timings and attributes of one chat request.
+
+    Spans are (name, offset from the trace start, duration) in milliseconds. Attributes hold
+    per-request facts such as prompt_tokens, llm_retries or cache hit flags. A trace is
+    finished exactly once; later calls are ignored.
+    """
+
+    def __init__(self, name: str = "chat", **attributes):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+        self.attributes = dict(attributes)
+        self.first_token_ms = None
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def _offset_ms(self, moment: float) -> float:
+        return (moment - self._start) * 1000
+
+    def add_span(self, name: str, start: float, end: float = None):
+        """Records a span from perf_counter timestamps (end defaults to now)."""
+        end = time.perf_counter() if end is None else end
+        with self._lock:
+            self.spans.append({"name": name, "start_ms": round(self._offset_ms(start), 3),
+                               "duration_ms": round((end - start) * 1000, 3)})
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, start)
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def incr(self, key: str, amount: int = 1):
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def mark_first_token(self):
+        if self.first_token_ms is None:
+            self.first_token_ms = round(self._offset_ms(time.perf_counter()), 3)
+
+    def finish(self, status: str = "ok"):
+        """Closes the trace and hands it to the recorder."""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        record = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "timestamp": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "status": status,
+            "total_ms": round(self._offset_ms(time.perf_counter()), 3),
+            "first_token_ms": self.first_token_ms,
+            "spans": self.spans,
+            "attributes": self.attributes,
+        }
+        recorder.record(record)
+
+
+# === Context helpers: no-ops when no trace is active, so library code can call them unconditionally ===
+
+def start_trace(name: str = "chat", **attributes):
+    """Returns a new Trace, or None when tracing is disabled."""
+    return Trace(name, **attributes) if TRACING else None
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def activate(trace):
+    """Makes `trace` the current trace for span()/annotate()/incr() calls in this context."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def annotate(**attributes):
+    trace = _current.get()
+    if trace is not None:
+        trace.set(**attributes)
+
+
+def incr(key: str, amount: int = 1):
+    trace = _current.get()
+    if trace is not None:
+        trace.incr(key, amount)
+
+
+def traced_stream(deltas, trace, started: float):
+    """
+    Passes LLM deltas through, recording llm_first_token (request start → first delta) and
+    llm_stream (request start → last delta) on `trace`.
+    """
+    if trace is None:
+        yield from deltas
+        return
+    count = 0
+    try:
+        for delta in deltas:
+            if count == 0:
+                trace.add_span("llm_first_token", started)
+                trace.mark_first_token()
+            count += 1
+            yield delta
+    finally:
+        trace.add_span("llm_stream", started)
+        trace.set(completion_deltas=count)
+
+
+# === Aggregation and export ===
+
+def _percentile(sorted_values: list, q: float) -> float:
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+
+def stage_durations(traces) -> dict:
+    """Stage name → list of durations in ms; "total" and "time_to_first_token" are included as stages."""
+    durations = {}
+    for trace in traces:
+        for item in trace["spans"]:
+            durations.setdefault(item["name"], []).append(item["duration_ms"])
+        durations.setdefault("total", []).append(trace["total_ms"])
+        if trace.get("first_token_ms") is not None:
+            durations.setdefault("time_to_first_token", []).append(trace["first_token_ms"])
+    return durations
+
+
+def summarize(traces) -> dict:
+    """Per-stage count / mean / p50 / p95 / p99 in ms, plus request-level counters."""
+    traces = list(traces)
+    stages = {}
+    for name, values in stage_durations(traces).items():
+        values.sort()
+        stages[name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            **{f"p{round(q * 100)}": _percentile(values, q) for q in QUANTILES},
+        }
+    prompt_tokens = sorted(t["attributes"]["prompt_tokens"] for t in traces if "prompt_tokens" in t["attributes"])
+    counters = {
+        "requests": len(traces),
+        "errors": sum(1 for t in traces if t["status"] != "ok"),
+        "llm_retries": sum(t["attributes"].get("llm_retries", 0) for t in traces),
+        "llm_hedges": sum(t["attributes"].get("llm_hedges", 0) for t in traces),
+        "llm_failovers": sum(t["attributes"].get("llm_failovers", 0) for t in traces),
+        "response_cache_hits": sum(1 for t in traces if t["attributes"].get("response_cache_hit")),
+        "query_cache_hits": sum(1 for t in traces if t["attributes"].get("query_cache") in ("memory", "disk")),
+        "exact_match_hits": sum(1 for t in traces if t["attributes"].get("exact_match")),
+        "prompt_tokens_p50": _percentile(prompt_tokens, 0.5),
+        "prompt_tokens_p95": _percentile(prompt_tokens, 0.95),
+    }
+    return {"stages": stages, "counters": counters}
+
+
+def render_report(traces) -> str:
+    """Text table of per-stage latency percentiles, slowest p95 first."""
+    summary = summarize(traces)
+    counters = summary["counters"]
+    lines = [f"📊 {counters['requests']} requests, {counters['errors']} errors, {counters['llm_retries']} LLM retries, "
+             f"{counters['llm_hedges']} hedges, {counters['llm_failovers']} failovers, "
+             f"cache hits: response {counters['response_cache_hits']} / query {counters['query_cache_hits']} / "
+             f"exact {counters['exact_match_hits']}",
+             f"   prompt tokens p50={counters['prompt_tokens_p50']:.0f} p95={counters['prompt_tokens_p95']:.0f}",
+             f"  {'stage':<24} {'n':>6} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}  (ms)"]
+    for name, stats in sorted(summary["stages"].items(), key=lambda item: item[1]["p95"], reverse=True):
+        lines.append(f"  {name:<24} {stats['count']:>6} {stats['mean']:>9.1f} {stats['p50']:>9.1f} "
+                     f"{stats['p95']:>9.1f} {stats['p99']:>9.1f}")
+    return "\n".join(lines)
+
+
+def render_prometheus(traces) -> str:
+    """Prometheus text exposition format: a summary per stage (seconds) and request counters."""
+    traces = list(traces)
+    lines = ["# HELP rag_stage_seconds Duration of each RAG pipeline stage.", "# TYPE rag_stage_seconds summary"]
+    for name, values in sorted(stage_durations(traces).items()):
+        values.sort()
+        for q in QUANTILES:
+            lines.append(f'rag_stage_seconds{{stage="{name}",quantile="{q}"}} {_percentile(values, q) / 1000:.6f}')
+        lines.append(f'rag_stage_seconds_sum{{stage="{name}"}} {sum(values) / 1000:.6f}')
+        lines.append(f'rag_stage_seconds_count{{stage="{name}"}} {len(values)}')
+
+    counters = summarize(traces)["counters"]
+    for key, help_text in (("requests", "Chat requests traced."),
+                           ("errors", "Chat requests that did not finish with status ok."),
+                           ("llm_retries", "LLM request retries."),
+                           ("llm_hedges", "Hedged duplicate LLM requests sent to a second model."),
+                           ("llm_failovers", "LLM requests failed over to the next model."),
+                           ("response_cache_hits", "Answers served from the semantic response cache."),
+                           ("query_cache_hits", "Query embeddings served from the embedding cache."),
+                           ("exact_match_hits", "Questions resolved by the exact SKU fast path.")):
+        lines.append(f"# HELP rag_{key}_total {help_text}")
+        lines.append(f"# TYPE rag_{key}_total counter")
+        lines.append(f"rag_{key}_total {counters[key]}")
+    return "\n".join(lines) + "\n"
+
+
+class TraceRecorder:
+    """
+    Keeps the most recent finished traces in memory and appends each one to a JSONL file
+    through the same background batched writer as the unanswered-query log.
+    """
+
+    def __init__(self, path: str = TRACE_LOG_PATH, window: int = TRACE_WINDOW):
+        self._traces = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.writer = QueryLogWriter(Path(path), fsync=False, max_bytes=TRACE_LOG_MAX_BYTES, backups=1) if path else None
+
+    def record(self, trace: dict):
+        with self._lock:
+            self._traces.append(trace)
+        if self.writer is not None:
+            try:
+                self.writer.write(trace)
+            except QueryLogError:
+                pass  # Traces are best effort; the writer has already reported the failure
+
+    def traces(self) -> list:
+        with self._lock:
+            return list(self._traces)
+
+    def summary(self) -> dict:
+        return summarize(self.traces())
+
+    def prometheus(self) -> str:
+        return render_prometheus(self.traces())
+
+
+recorder = TraceRecorder()
+if recorder.writer is not None:
+    atexit.register(recorder.writer.close)
+
+
+def load_traces(path=TRACE_LOG_PATH, last: int = None) -> list:
+    """Reads traces from a JSONL export (and its rotated .1 backup), oldest first."""
+    path = Path(path)
+    traces = []
+    for file in (path.with_name(path.name + ".1"), path):
+        if file.exists():
+            with open(file, "r", encoding="utf-8") as f:
+                traces.extend(json.loads(line) for line in f if line.strip())
+    return traces[-last:] if last else traces
+
+
+def _serve(path: Path, host: str, port: int, last: int):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            traces = load_traces(path, last)
+            if self.path.rstrip("/") == "/metrics":
+                body, content_type = render_prometheus(traces), "text/plain; version=0.0.4"
+            elif self.path in ("/", ""):
+                body, content_type = render_report(traces), "text/plain; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    print(f"📈 Serving the latency report on http://{host}:{port}/ and Prometheus metrics on /metrics")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Metrics server stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency report from the chat trace log")
+    parser.add_argument("command", nargs="?", choices=("report", "prometheus", "serve"), default="report")
+    parser.add_argument("--path", default=TRACE_LOG_PATH)
+    parser.add_argument("--last", type=int, default=None, help="only the most recent N requests")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9464)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        _serve(Path(args.path), args.host, args.port, args.last)
+        return
+    traces = load_traces(args.path, args.last)
+    if args.command == "prometheus":
+        print(render_prometheus(traces), end="")
+    elif args.json:
+        print(json.dumps(summarize(traces), indent=2))
+    else:
+        print(render_report(traces))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import pickle
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# === Paths ===
+INDEX_DIR = Path("Source Code/Assets/index")
+LEGACY_PICKLE_PATH = Path("Source Code/Assets/embedded_chunks.pkl")
+
+# === Format ===
+FORMAT_NAME = "quantum-arc-index"
+FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+SUPPORTED_DTYPES = ("float32", "float16")
+DEFAULT_MODEL_NAME = "intfloat/e5-base-v2"
+WRITE_BLOCK_ROWS = 65536  # vectors are normalized and written in blocks, so memmapped inputs are never fully loaded
+HASH_BLOCK_BYTES = 1 << 20  # files are read back into the content hash in blocks of this size
+
+# On-disk layout (all files live in INDEX_DIR):
+#   header.json          -> format/version, model name, dim, count, dtype, content hash, data file names
+#   vectors-<hash>.bin   -> raw row-major (count x dim) matrix, L2-normalized, opened with np.memmap
+#   offsets-<hash>.bin   -> int64 (count + 1) byte offsets into the records file
+#   records-<hash>.bin   -> concatenated UTF-8 JSON chunk records (text + metadata, no vectors)
+#   <name>-<hash>.bin    -> optional sidecars derived from the same rows (e.g. the BM25 index)
+#
+# Data files carry the content hash in their name and header.json is swapped in last with
+# os.replace, so a reader always sees either the old index or the new one, never a mix.
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2-normalizes each row of a 2D array into a contiguous float32 copy.
+    Zero rows are left as zeros instead of producing NaNs.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _encode_record(record: dict) -> bytes:
+    """Serializes one chunk record as stored in the records file (any "embedding" key is dropped)."""
+    clean = {k: v for k, v in record.items() if k != "embedding"}
+    return json.dumps(clean, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _write_file(path: Path, data: bytes):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_records(records_path: Path, offsets: np.ndarray):
+    """Yields the records of a records file one at a time."""
+    if not offsets[-1]:
+        return
+    with open(records_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield json.loads(data[start:end].decode("utf-8"))
+
+
+class IndexWriter:
+    """
+    Writes one index generation batch by batch, so a build never holds the whole corpus.
+
+    append() normalizes each batch of vectors and appends it, with the serialized records and
+    their offsets, to temporary files in `work_dir` while feeding the vectors into the content
+    hash. commit() hashes the records file block by block, moves the files into `index_dir`
+    under the content tag, builds the sidecars and swaps the header in, as write_index does.
+
+    Args:
+        index_dir (Path): Output directory (created if missing).
+        model_name (str): Embedding model recorded in the header.
+        dtype (str): "float32" or "float16" storage for the vectors.
+        work_dir (Path): Where the temporary files live (default: index_dir); must be on the same filesystem.
+        rows (int): Keep the first `rows` rows already in work_dir (an interrupted build) and append after them.
+        dim (int): Vector dimension; taken from the first batch if not given (required with `rows`).
+    """
+
+    def __init__(self, index_dir: Path, model_name: str = DEFAULT_MODEL_NAME, dtype: str = "float32",
+                 work_dir: Path = None, rows: int = 0, dim: int = None):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.work_dir = Path(work_dir) if work_dir else self.index_dir
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self.dtype = dtype
+        self.dim = dim
+        self.count = 0
+        self._position = 0  # bytes in the records file
+        self._digest = hashlib.sha256(model_name.encode("utf-8"))
+        self._paths = self.staged_files(self.work_dir)
+        if rows:
+            self._truncate(rows)
+            self._files = {name: open(path, "ab") for name, path in self._paths.items()}
+        else:
+            self._files = {name: open(path, "wb") for name, path in self._paths.items()}
+            self._files["offsets"].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    @staticmethod
+    def staged_files(work_dir: Path) -> dict:
+        """The temporary data files of a generation being written in `work_dir`."""
+        return {name: Path(work_dir) / f"{name}.bin.tmp" for name in ("vectors", "offsets", "records")}
+
+    def _truncate(self, rows: int):
+        if self.dim is None:
+            raise ValueError("Resuming an index write needs the vector dimension")
+        offsets = np.fromfile(self._paths["offsets"], dtype=np.int64, count=rows + 1)
+        if len(offsets) != rows + 1:
+            raise ValueError(f"{self._paths['offsets']} holds fewer than {rows} rows")
+        self._position = int(offsets[rows])
+        sizes = {"vectors": rows * self.dim * np.dtype(self.dtype).itemsize,
+                 "offsets": (rows + 1) * offsets.itemsize,
+                 "records": self._position}
+        for name, size in sizes.items():
+            if self._paths[name].stat().st_size < size:
+                raise ValueError(f"{self._paths[name]} is shorter than its {rows} rows")
+            os.truncate(self._paths[name], size)
+        # Rebuild the running hash from the vectors already on disk
+        with open(self._paths["vectors"], "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                self._digest.update(block)
+        self.count = rows
+
+    def append(self, records: list, vectors: np.ndarray):
+        """Appends a batch of records and their row-aligned (n, d) vectors."""
+        vectors = np.atleast_2d(np.asarray(vectors))
+        if len(records) != vectors.shape[0]:
+            raise ValueError(f"Got {len(records)} records but {vectors.shape[0]} vectors")
+        if not len(records):
+            return
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Got {vectors.shape[1]}-dimensional vectors for a {self.dim}-dimensional index")
+
+        for start in range(0, vectors.shape[0], WRITE_BLOCK_ROWS):
+            block = _normalize_rows(vectors[start:start + WRITE_BLOCK_ROWS]).astype(self.dtype).tobytes()
+            self._digest.update(block)
+            self._files["vectors"].write(block)
+        offsets = np.empty(len(records), dtype=np.int64)
+        for i, record in enumerate(records):
+            data = _encode_record(record)
+            self._files["records"].write(data)
+            self._position += len(data)
+            offsets[i] = self._position
+        # Offsets go last: a row only counts once its vector and record are written
+        self._files["offsets"].write(offsets.tobytes())
+        self.count += len(records)
+
+    def sync(self):
+        """Flushes everything appended so far to disk (call before recording progress elsewhere)."""
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def abort(self):
+        """Closes the temporary files and removes them; the current index is left untouched."""
+        for f in self._files.values():
+            f.close()
+        for path in self._paths.values():
+            path.unlink(missing_ok=True)
+
+    def commit(self, sidecars: dict = None) -> dict:
+        """
+        Publishes the generation and drops the data files of previous ones.
+
+        Args:
+            sidecars (dict): Optional {name: builder} where builder(records, vectors) returns the
+                bytes of an auxiliary structure stored in the same index generation. It gets an
+                iterable of the written records and the stored (normalized) vectors.
+
+        Returns:
+            dict: The header that was written.
+        """
+        self.sync()
+        for f in self._files.values():
+            f.close()
+        # The records follow the vectors in the content hash
+        with open(self._paths["records"], "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                self._digest.update(block)
+        content_hash = self._digest.hexdigest()
+        tag = content_hash[:16]
+
+        files = {name: f"{name}-{tag}.bin" for name in self._paths}
+        for name, path in self._paths.items():
+            os.replace(path, self.index_dir / files[name])
+
+        dim = self.dim or 0
+        if sidecars:
+            offsets = np.fromfile(self.index_dir / files["offsets"], dtype=np.int64)
+            if self.count:
+                vectors = np.memmap(self.index_dir / files["vectors"], dtype=self.dtype, mode="r", shape=(self.count, dim))
+            else:
+                vectors = np.zeros((0, dim), dtype=self.dtype)
+            for name, builder in sidecars.items():
+                files[name] = f"{name}-{tag}.bin"
+                _write_file(self.index_dir / files[name], builder(_read_records(self.index_dir / files["records"], offsets), vectors))
+            del vectors
+
+        header = {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "model": self.model_name,
+            "dim": dim,
+            "count": self.count,
+            "dtype": self.dtype,
+            "normalized": True,
+            "content_hash": content_hash,
+            "created": datetime.utcnow().isoformat(),
+            "sidecars": sorted(sidecars or {}),
+            "files": files,
+        }
+        _write_file(self.index_dir / HEADER_FILE, json.dumps(header, indent=2).encode("utf-8"))
+
+        # Drop data files from previous generations; readers still holding them keep their mapping
+        current = set(files.values()) | {HEADER_FILE}
+        for path in self.index_dir.glob("*.bin"):
+            if path.name not in current:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass  # Still mapped by another process (e.g. on Windows); cleaned up next write
+
+        return header
+
+
+def write_index(index_dir: Path, records: list, vectors: np.ndarray,
+                model_name: str = DEFAULT_MODEL_NAME, dtype: str = "float32", sidecars: dict = None) -> dict:
+    """
+    Writes chunk records and their vectors in the binary index format (see IndexWriter for
+    builds that produce the rows batch by batch).
+
+    Args:
+        index_dir (Path): Output directory (created if missing).
+        records (list): Chunk dicts (text + metadata). Any "embedding" key is dropped.
+        vectors (np.ndarray): Shape (n, d) embeddings, row-aligned with records (an np.memmap works).
+        model_name (str): Embedding model recorded in the header.
+        dtype (str): "float32" or "float16" storage for the vectors.
+        sidecars (dict): Optional {name: builder} where builder(records, vectors) returns the
+            bytes of an auxiliary structure stored in the same index generation.
+
+    Returns:
+        dict: The header that was written.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors))
+    if len(records) != vectors.shape[0]:
+        raise ValueError(f"Got {len(records)} records but {vectors.shape[0]} vectors")
+    writer = IndexWriter(index_dir, model_name, dtype, dim=int(vectors.shape[1]))
+    for start in range(0, len(records), WRITE_BLOCK_ROWS):
+        writer.append(records[start:start + WRITE_BLOCK_ROWS], vectors[start:start + WRITE_BLOCK_ROWS])
+    return writer.commit(sidecars)
+
+
+class VectorStore:
+    """
+    Read-only view of an on-disk index.
+
+    `vectors` is an np.memmap over the raw vector file, so several processes
+    opening the same index share one page-cached copy. Chunk records are decoded
+    lazily from the offset table when indexed.
+    """
+
+    def __init__(self, index_dir: Path = INDEX_DIR):
+        self.index_dir = Path(index_dir)
+        header_path = self.index_dir / HEADER_FILE
+        if not header_path.exists():
+            raise FileNotFoundError(
+                f"No index found at {self.index_dir}. Run embed_chunks.py, or convert a legacy "
+                f"pickle with: python \"Source Code/vector_store.py\" convert"
+            )
+        with open(header_path, "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+
+        if self.header.get("format") != FORMAT_NAME:
+            raise ValueError(f"{header_path} is not a {FORMAT_NAME} header")
+        if self.header.get("version") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported index version {self.header.get('version')} (expected {FORMAT_VERSION}); rebuild the index"
+            )
+
+        self.model_name = self.header["model"]
+        self.dim = self.header["dim"]
+        self.count = self.header["count"]
+        self.dtype = np.dtype(self.header["dtype"])
+        self.content_hash = self.header["content_hash"]
+        files = self.header["files"]
+
+        if self.count:
+            self.vectors = np.memmap(self.index_dir / files["vectors"], dtype=self.dtype, mode="r",
+                                     shape=(self.count, self.dim))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=self.dtype)
+        self.offsets = np.fromfile(self.index_dir / files["offsets"], dtype=np.int64)
+        if len(self.offsets) != self.count + 1:
+            raise ValueError(f"Offset table in {self.index_dir} does not match header count {self.count}")
+
+        with open(self.index_dir / files["records"], "rb") as f:
+            self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    def __len__(self) -> int:
+        return self.count
+
+    def sidecar_path(self, name: str) -> Path | None:
+        """Path of a sidecar written with this index generation, or None if it was not built."""
+        file_name = self.header["files"].get(name)
+        return self.index_dir / file_name if file_name else None
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return json.loads(self._records[start:end].decode("utf-8"))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def float32_vectors(self) -> np.ndarray:
+        """Vectors as float32. Zero-copy for float32 stores; float16 stores are upcast in memory."""
+        if self.dtype == np.float32:
+            return self.vectors
+        return np.asarray(self.vectors, dtype=np.float32)
+
+
+def read_header(index_dir: Path = INDEX_DIR) -> dict | None:
+    """The header of an existing index without opening its data files, or None if there is none."""
+    header_path = Path(index_dir) / HEADER_FILE
+    if not header_path.exists():
+        return None
+    with open(header_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_index(index_dir: Path = INDEX_DIR) -> VectorStore:
+    return VectorStore(index_dir)
+
+
+def convert_pickle(pickle_path: Path = LEGACY_PICKLE_PATH, index_dir: Path = INDEX_DIR,
+                   model_name: str = DEFAULT_MODEL_NAME, dtype: str = "float32") -> dict:
+    """
+    Converts a legacy embedded_chunks.pkl (list of dicts with an "embedding" key) to the binary index format.
+
+    Only run this on pickles you produced yourself: unpickling executes arbitrary code.
+    """
+    with open(pickle_path, "rb") as f:
+        embedded_chunks = pickle.load(f)
+    vectors = np.stack([chunk["embedding"] for chunk in embedded_chunks]) if embedded_chunks else np.zeros((0, 0))
+    return write_index(index_dir, embedded_chunks, vectors, model_name=model_name, dtype=dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantum Arc binary vector index tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert = subparsers.add_parser("convert", help="Convert a legacy embedded_chunks.pkl to the binary index")
+    convert.add_argument("--pkl", type=Path, default=LEGACY_PICKLE_PATH)
+    convert.add_argument("--out", type=Path, default=INDEX_DIR)
+    convert.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    convert.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="float32")
+
+    info = subparsers.add_parser("info", help="Print the header of an existing index")
+    info.add_argument("--index", type=Path, default=INDEX_DIR)
+
+    args = parser.parse_args()
+    if args.command == "convert":
+        header = convert_pickle(args.pkl, args.out, args.model, args.dtype)
+        print(f"✅ Converted {header['count']} chunks ({header['dtype']}, dim {header['dim']}) to {args.out}")
+    elif args.command == "info":
+        print(json.dumps(load_index(args.index).header, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import os
+import threading
+import startup
+
+# launcher.py sets this so the Streamlit process loads heavy resources in the background at boot
+WARMUP_ENV = "QA_WARMUP"
+
+
+def warmup_enabled() -> bool:
+    return os.getenv(WARMUP_ENV, "0") == "1"
+
+
+def warm_up():
+    """
+    Loads every lazily initialized resource (index, embedding model, tokenizer) and runs one
+    encode so the first user question does not pay for it. Prints the startup breakdown when done.
+    """
+    from embed_query import get_model
+    from tokens import count_tokens
+    from similarity import get_retriever
+
+    try:
+        with startup.timed("warm-up total"):
+            get_retriever()
+            with startup.timed("first encode"):
+                get_model().encode("query: warm up", convert_to_numpy=True)
+            with startup.timed("load prompt tokenizer"):
+                count_tokens("warm up")
+    except Exception as e:
+        print(f"❌ Warm-up failed (resources will load on first request): {e}")
+    print(startup.report())
+
+
+def start_background_warmup() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="resource-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SOURCE_DIR = ROOT / "Source Code"
+INDEX_DIR = SOURCE_DIR / "Assets" / "index"
+
+# Test runs must not append traces or unanswered questions to the files under Assets/
+os.environ.setdefault("TRACE_LOG_PATH", "")
+os.environ.setdefault("QUERY_LOG_PATH", str(Path(tempfile.mkdtemp(prefix="quantum-arc-tests-")) / "unanswered_queries.jsonl"))
+os.environ.setdefault("QUERY_CACHE_PATH", "")
+sys.path.insert(0, str(SOURCE_DIR))
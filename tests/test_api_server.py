@@ -0,0 +1,164 @@
+import asyncio
+import http.client
+import json
+import threading
+
+import pytest
+import api_server
+from api_server import ChatAPI, HTTPError, Overloaded, parse_chat_request, resolve_session
+from ProgramEngine import ChatStream
+
+
+def _fake_response(gate: threading.Event = None):
+    """Stands in for get_chatbot_response: streams "Echo: <message>" and enters fallback on "help"."""
+    def respond(question, history, stream=True, session=None):
+        if gate is not None:
+            gate.wait(5)
+
+        def complete(text):
+            if question == "help":
+                session.start_fallback(question)
+            return history + [{"role": "user", "content": question}, {"role": "assistant", "content": text}], question == "help"
+
+        return ChatStream(iter(["Echo: ", question]), complete)
+
+    return respond
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """serve(api, gate=None) -> port of `api` listening on a background event loop."""
+    loops = []
+
+    def start(api: ChatAPI, gate: threading.Event = None) -> int:
+        monkeypatch.setattr(api_server, "get_chatbot_response", _fake_response(gate))
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        loops.append((loop, api))
+
+        async def listen():
+            api._slots = asyncio.Semaphore(api.max_concurrency)
+            server = await asyncio.start_server(api.handle_connection, "127.0.0.1", 0)
+            return server.sockets[0].getsockname()[1]
+
+        return asyncio.run_coroutine_threadsafe(listen(), loop).result(5)
+
+    yield start
+    for loop, api in loops:
+        loop.call_soon_threadsafe(loop.stop)
+        api.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _post(port: int, path: str, payload) -> http.client.HTTPResponse:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    connection.request("POST", path, body=json.dumps(payload), headers={"Content-Type": "application/json"})
+    return connection.getresponse()
+
+
+# === Request parsing ===
+@pytest.mark.parametrize("body, error", [
+    (b"not json", "Body must be JSON"),
+    (b"[1, 2]", "Body must be a JSON object"),
+    (b'{"message": "  "}', "'message' must be a non-empty string"),
+    (b'{"message": "hi", "session_id": 7}', "'session_id' must be a string"),
+    (b'{"message": "hi", "history": [{"role": "system", "content": "x"}]}', "'history' must be a list"),
+    (b'{"message": "hi", "fallback": "yes"}', "'fallback' must be an object"),
+])
+def test_invalid_requests_are_rejected(body, error):
+    with pytest.raises(HTTPError, match=error) as raised:
+        parse_chat_request(body)
+    assert raised.value.status == 400
+
+
+def test_stateless_requests_must_carry_their_state():
+    follow_up = b'{"message": "and returns?", "session_id": "abc"}'
+    assert parse_chat_request(follow_up)["session_id"] == "abc"
+    with pytest.raises(HTTPError, match="keeps no sessions"):
+        parse_chat_request(follow_up, stateless=True)
+    assert parse_chat_request(b'{"message": "hi", "session_id": "abc", "history": []}', stateless=True)
+    assert parse_chat_request(b'{"message": "hi"}', stateless=True)
+
+
+def test_fallback_state_comes_from_the_request():
+    history = [{"role": "user", "content": "Can I pay in bitcoin?"}]
+    session, restored = resolve_session({"message": "me@example.com", "history": history,
+                                         "fallback": {"waiting": True, "question": "Can I pay in bitcoin?"}})
+    assert session.waiting_for_fallback_info and session.original_question == "Can I pay in bitcoin?"
+    assert restored == history
+    # Stateless: a first message starts a fresh session that is not kept in the worker
+    session, restored = resolve_session({"message": "hi"}, stateless=True)
+    assert restored == [] and not session.waiting_for_fallback_info
+    assert api_server.session_store.get_or_create(session.session_id) is not session
+
+
+def test_stateless_round_trip_keeps_fallback_state(serve):
+    port = serve(ChatAPI(stateless=True))
+    first = json.loads(_post(port, "/v1/chat", {"message": "help"}).read())
+    assert first["is_fallback"] and first["fallback"] == {"waiting": True, "question": "help"}
+    response = _post(port, "/v1/chat", {"message": "me@example.com", "session_id": first["session_id"],
+                                        "history": first["history"], "fallback": first["fallback"]})
+    second = json.loads(response.read())
+    assert response.status == 200 and len(second["history"]) == 4
+    assert _post(port, "/v1/chat", {"message": "again", "session_id": first["session_id"]}).status == 400
+
+
+# === Backpressure ===
+def test_admit_rejects_when_queue_is_full():
+    async def scenario():
+        api = ChatAPI(max_concurrency=1, max_queue=1, queue_timeout=0.2)
+        api._slots = asyncio.Semaphore(1)
+        async with api.admit():
+            waiter = asyncio.create_task(api.admit().__aenter__())
+            await asyncio.sleep(0.05)
+            assert api.waiting == 1
+            with pytest.raises(Overloaded, match="queue is full"):
+                async with api.admit():
+                    pass
+            with pytest.raises(Overloaded, match="No free slot") as raised:
+                await waiter
+        assert (raised.value.status, raised.value.headers) == (503, {"Retry-After": "1"})
+        assert (api.waiting, api.in_flight) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_overloaded_server_answers_503_with_retry_after(serve):
+    gate = threading.Event()
+    api = ChatAPI(max_concurrency=1, max_queue=0, queue_timeout=1)
+    port = serve(api, gate)
+    busy = threading.Thread(target=lambda: _post(port, "/v1/chat", {"message": "slow"}).read())
+    busy.start()
+    try:
+        for _ in range(100):
+            if api.in_flight:
+                break
+            threading.Event().wait(0.01)
+        response = _post(port, "/v1/chat", {"message": "one too many"})
+        assert response.status == 503 and response.getheader("Retry-After") == "1"
+        assert "queue is full" in json.loads(response.read())["error"]
+    finally:
+        gate.set()
+        busy.join(5)
+    assert api.rejected == 1
+
+
+# === Server-sent events ===
+def test_stream_frames_deltas_then_done(serve):
+    port = serve(ChatAPI())
+    response = _post(port, "/v1/chat/stream", {"message": "hello", "history": []})
+    assert response.status == 200 and response.getheader("Content-Type") == "text/event-stream"
+    frames = response.read().decode("utf-8").split("\n\n")
+    assert frames[-1] == ""
+    assert frames[0] == 'data: {"delta": "Echo: "}'
+    assert frames[1] == 'data: {"delta": "hello"}'
+    event, data = frames[2].split("\n")
+    assert event == "event: done"
+    done = json.loads(data.removeprefix("data: "))
+    assert done["response"] == "Echo: hello" and done["history"][-1]["content"] == "Echo: hello"
+    assert len(frames) == 4
+
+
+def test_stream_rejects_bad_requests_before_streaming(serve):
+    port = serve(ChatAPI(stateless=True))
+    response = _post(port, "/v1/chat/stream", {"message": "hi", "session_id": "abc"})
+    assert response.status == 400 and response.getheader("Content-Type") == "application/json"
@@ -0,0 +1,64 @@
+import threading
+
+import numpy as np
+import pytest
+from embedding_service import EmbeddingServiceStopped, MicroBatcher
+
+
+def _encode(texts: list) -> np.ndarray:
+    return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_concurrent_texts_share_a_batch():
+    gate = threading.Event()
+
+    def encode(texts):
+        gate.wait(5)
+        return _encode(texts)
+
+    batcher = MicroBatcher(encode, max_batch_size=8, max_wait_ms=50).start()
+    try:
+        futures = [batcher.submit("x" * n) for n in range(1, 5)]
+        gate.set()
+        assert [future.result(5)[0] for future in futures] == [1, 2, 3, 4]
+        assert batcher.stats()["batches"] == 1
+    finally:
+        batcher.stop()
+
+
+def test_stop_fails_queued_texts_and_refuses_new_ones():
+    gate, encoding = threading.Event(), threading.Event()
+
+    def encode(texts):
+        encoding.set()
+        gate.wait(5)
+        return _encode(texts)
+
+    batcher = MicroBatcher(encode, max_batch_size=1, max_wait_ms=0).start()
+    running = batcher.submit("first")
+    assert encoding.wait(5)
+    queued = [batcher.submit("second"), batcher.submit("third")]
+    stopper = threading.Thread(target=batcher.stop)
+    stopper.start()
+    assert batcher._stop.wait(5)
+    gate.set()
+    stopper.join(5)
+
+    # The batch being encoded finishes; texts still waiting fail at once instead of timing out
+    assert running.result(1)[0] == 5
+    for future in queued:
+        assert isinstance(future.exception(1), EmbeddingServiceStopped)
+    with pytest.raises(EmbeddingServiceStopped):
+        batcher.submit("late")
+    with pytest.raises(EmbeddingServiceStopped):
+        batcher.embed("late", timeout=1)
+
+
+def test_restart_after_stop():
+    batcher = MicroBatcher(_encode).start()
+    batcher.stop()
+    batcher.start()
+    try:
+        assert batcher.embed("abc", timeout=5)[0] == 3
+    finally:
+        batcher.stop()
@@ -0,0 +1,149 @@
+import json
+import zlib
+import numpy as np
+import pytest
+from ann import IVFIndex, load_ann_index, synthetic_vectors
+from vector_store import IndexWriter, load_index, write_index
+import embed_chunks
+
+
+def _chunks(n: int) -> list:
+    return [{"type": "faq", "section": "Orders", "question": f"Question {i}?", "content": f"Q: Question {i}?\nA: Answer {i}."}
+            for i in range(n)]
+
+
+@pytest.fixture
+def ivf_index(tmp_path):
+    """An index built with --ann ivf."""
+    records = list(embed_chunks._tag_chunks(_chunks(300)))
+    write_index(tmp_path, records, synthetic_vectors(len(records), dim=16, clusters=8),
+                sidecars=embed_chunks.build_sidecars(tmp_path, add_ann=["ivf"]))
+    return tmp_path
+
+
+def test_header_records_sidecars(ivf_index):
+    header = json.loads((ivf_index / "header.json").read_text(encoding="utf-8"))
+    assert header["sidecars"] == ["bm25", "ivf", "metadata"]
+    assert embed_chunks.configured_ann(ivf_index) == ["ivf"]
+
+
+def test_incremental_build_keeps_ann_sidecar(ivf_index):
+    # Unchanged chunks: nothing is encoded, but the index is rewritten as a new generation
+    plan = embed_chunks.build_incremental(_chunks(300), ivf_index)
+    assert plan["encode"] == [] and "header" in plan
+    store = load_index(ivf_index)
+    assert store.sidecar_path("ivf") is not None and store.sidecar_path("ivf").exists()
+    assert isinstance(load_ann_index("ivf", store, store.float32_vectors()), IVFIndex)
+    assert len(list(ivf_index.glob("ivf-*.bin"))) == 1
+
+
+def test_drop_ann(ivf_index):
+    assert "ivf" not in embed_chunks.build_sidecars(ivf_index, drop_ann=["ivf"])
+    embed_chunks.build_incremental(_chunks(300), ivf_index, sidecars=embed_chunks.build_sidecars(ivf_index, drop_ann=["ivf"]))
+    assert embed_chunks.configured_ann(ivf_index) == []
+
+
+def test_missing_ann_sidecar_is_an_error(tmp_path):
+    records = list(embed_chunks._tag_chunks(_chunks(10)))
+    write_index(tmp_path, records, np.eye(10, 16, dtype=np.float32), sidecars=embed_chunks.SIDECARS)
+    store = load_index(tmp_path)
+    assert load_ann_index("exact", store, store.float32_vectors()) is None
+    with pytest.raises(FileNotFoundError, match="--ann ivf"):
+        load_ann_index("ivf", store, store.float32_vectors())
+
+
+def test_ivf_batch_rows_are_not_cut_to_the_sparsest_probe():
+    vectors = synthetic_vectors(200, dim=16, clusters=8)
+    index = IVFIndex.build(vectors, nlist=40)
+    index.nprobe = 1
+    sizes = np.diff(index.list_offsets)
+    # One query aimed at the smallest non-empty list, one at the largest
+    small, large = np.argmin(np.where(sizes > 0, sizes, sizes.max() + 1)), np.argmax(sizes)
+    queries = np.stack([index.centroids[small], index.centroids[large]])
+    top_k = int(sizes[small]) + 5
+    result = index.top_k_indices(queries, top_k)
+    assert result.shape == (2, top_k)
+    assert all(len(set(row.tolist())) == top_k for row in result)
+    # The well-covered query keeps its full single-probe answer
+    rows = index.list_rows[index.list_offsets[large]:index.list_offsets[large + 1]]
+    if len(rows) >= top_k:
+        assert set(result[1].tolist()) <= set(rows.tolist())
+
+
+class _FakeModel:
+    """Deterministic stand-in for the sentence-transformers model; fails after `fail_after` batches."""
+
+    def __init__(self, fail_after: int = None):
+        self.fail_after = fail_after
+        self.encoded = []
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        if self.fail_after is not None and len(self.encoded) >= self.fail_after:
+            raise KeyboardInterrupt
+        self.encoded.append(len(texts))
+        return np.stack([np.random.default_rng(zlib.crc32(text.encode("utf-8"))).normal(size=16)
+                         for text in texts]).astype(np.float32)
+
+
+def test_write_index_hash_does_not_depend_on_batching(tmp_path):
+    records = list(embed_chunks._tag_chunks(_chunks(50)))
+    vectors = synthetic_vectors(50, dim=16)
+    whole = write_index(tmp_path / "whole", records, vectors)
+    writer = IndexWriter(tmp_path / "batched")
+    for start in range(0, 50, 7):
+        writer.append(records[start:start + 7], vectors[start:start + 7])
+    batched = writer.commit()
+    assert batched["content_hash"] == whole["content_hash"]
+    assert [record["id"] for record in load_index(tmp_path / "batched")] == [record["id"] for record in records]
+
+
+def test_full_build_streams_and_resumes(tmp_path, monkeypatch):
+    # Chunks come from a generator, as read_chunks() yields them
+    monkeypatch.setattr(embed_chunks, "_worker_model", _FakeModel())
+    reference = embed_chunks.build_full((chunk for chunk in _chunks(100)), tmp_path / "reference", batch_size=16)
+
+    monkeypatch.setattr(embed_chunks, "_worker_model", _FakeModel(fail_after=3))
+    with pytest.raises(KeyboardInterrupt):
+        embed_chunks.build_full((chunk for chunk in _chunks(100)), tmp_path / "index", batch_size=16)
+    checkpoint = json.loads((tmp_path / "index" / "staging" / "checkpoint.json").read_text(encoding="utf-8"))
+    assert len(checkpoint["batches"]) == 3
+
+    model = _FakeModel()
+    monkeypatch.setattr(embed_chunks, "_worker_model", model)
+    header = embed_chunks.build_full((chunk for chunk in _chunks(100)), tmp_path / "index", batch_size=16)
+    assert sum(model.encoded) == 100 - 3 * 16
+    assert header["content_hash"] == reference["content_hash"]
+    assert header["sidecars"] == ["bm25", "metadata"]
+    assert not (tmp_path / "index" / "staging").exists()
+
+
+def test_incremental_build_encodes_only_changed_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(embed_chunks, "_worker_model", _FakeModel())
+    embed_chunks.build_full(_chunks(40), tmp_path, batch_size=16)
+    chunks = _chunks(41)
+    chunks[5]["content"] += " Updated."
+    del chunks[10]
+
+    model = _FakeModel()
+    monkeypatch.setattr(embed_chunks, "_worker_model", model)
+    plan = embed_chunks.build_incremental(iter(chunks), tmp_path, batch_size=16)
+    assert sum(model.encoded) == 2
+    assert plan["count"] == 40 and len(plan["encode"]) == 2
+    assert plan["updated"] == ["faq:Question 5?"]
+    assert plan["added"] == ["faq:Question 40?"]
+    assert plan["removed"] == ["faq:Question 10?"]
+    store = load_index(tmp_path)
+    assert len(store) == 40 and store[39]["id"] == "faq:Question 40?"
+
+
+def test_failed_incremental_build_leaves_no_temporary_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(embed_chunks, "_worker_model", _FakeModel())
+    header = embed_chunks.build_full(_chunks(40), tmp_path, batch_size=16)
+    chunks = _chunks(40)
+    chunks[30]["content"] += " Updated."
+
+    monkeypatch.setattr(embed_chunks, "_worker_model", _FakeModel(fail_after=0))
+    with pytest.raises(KeyboardInterrupt):
+        embed_chunks.build_incremental(chunks, tmp_path, batch_size=16)
+    assert list(tmp_path.glob("*.tmp")) == []
+    assert load_index(tmp_path).content_hash == header["content_hash"]
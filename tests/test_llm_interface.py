@@ -0,0 +1,132 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+import llm_interface
+from mock_llm_server import DEFAULT_REPLY, MockLLMConfig, start_mock_server
+
+MESSAGES = [{"role": "user", "content": "Where is my order?"}]
+
+
+@pytest.fixture
+def mock_llm(monkeypatch):
+    """start(**MockLLMConfig settings) -> config, with aquery_llm pointed at the new server."""
+    servers = []
+
+    def start(**settings):
+        config = MockLLMConfig(**settings)
+        server, url = start_mock_server(config=config)
+        servers.append(server)
+        monkeypatch.setattr(llm_interface, "OPENROUTER_API_URL", url)
+        return config
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def backoff_calls(monkeypatch):
+    """Records (attempt, retry_delay, retry_after, seconds) for every backoff aquery_llm takes."""
+    calls = []
+    backoff_delay = llm_interface._backoff_delay
+
+    def recording(attempt, retry_delay, retry_after=None):
+        seconds = backoff_delay(attempt, retry_delay, retry_after)
+        calls.append((attempt, retry_delay, retry_after, seconds))
+        return seconds
+
+    monkeypatch.setattr(llm_interface, "_backoff_delay", recording)
+    return calls
+
+
+def _run(*args, **kwargs):
+    """Calls aquery_llm on a fresh event loop, closing that loop's client afterwards."""
+    async def call():
+        try:
+            success, response = await llm_interface.aquery_llm(*args, **kwargs)
+            if success and not isinstance(response, str):
+                response = "".join([delta async for delta in response])
+            return success, response
+        finally:
+            await llm_interface.aclose_async_client()
+
+    return asyncio.run(call())
+
+
+def test_backoff_delay():
+    assert llm_interface._backoff_delay(0, 1.0, "3") == 3.0
+    assert llm_interface._backoff_delay(0, 1.0, "600") == llm_interface.MAX_BACKOFF
+    assert 0 <= llm_interface._backoff_delay(2, 0.5) <= 2.0
+    assert llm_interface._backoff_delay(20, 1.0) <= llm_interface.MAX_BACKOFF
+    # Retry-After may also be an HTTP date
+    assert 1.0 < llm_interface._backoff_delay(0, 1.0, formatdate(time.time() + 5, usegmt=True)) <= 5.0
+    assert llm_interface._parse_retry_after("soon") is None
+
+
+def test_retries_server_errors_with_growing_backoff(mock_llm, backoff_calls):
+    config = mock_llm(fail_first=2, error_status=502)
+    assert _run(MESSAGES, max_retries=3, retry_delay=0.05) == (True, DEFAULT_REPLY)
+    assert config.requests == 3
+    assert [(attempt, retry_after) for attempt, _, retry_after, _ in backoff_calls] == [(0, None), (1, None)]
+    assert all(seconds <= 0.05 * 2 ** attempt for attempt, _, _, seconds in backoff_calls)
+
+
+def test_gives_up_after_max_retries(mock_llm, backoff_calls):
+    config = mock_llm(error_rate=1.0, error_status=502)
+    assert _run(MESSAGES, max_retries=3, retry_delay=0.01) == (False, llm_interface.SERVER_ERROR_MESSAGE)
+    assert config.requests == 3 and len(backoff_calls) == 2
+
+
+def test_honours_retry_after(mock_llm, backoff_calls):
+    config = mock_llm(fail_first=1, error_status=429, retry_after=0.5)
+    started = time.perf_counter()
+    # Without the header the backoff could be anything up to retry_delay
+    assert _run(MESSAGES, max_retries=2, retry_delay=5.0, stream=True) == (True, DEFAULT_REPLY)
+    assert 0.5 <= time.perf_counter() - started < 1.5
+    assert backoff_calls[0][2] == "0.5" and config.requests == 2
+
+
+def test_rate_limit_message_when_retries_run_out(mock_llm):
+    mock_llm(error_rate=1.0, error_status=429, retry_after=0)
+    assert _run(MESSAGES, max_retries=2) == (False, llm_interface.RATE_LIMIT_MESSAGE)
+
+
+def test_client_errors_are_not_retried(mock_llm, backoff_calls):
+    config = mock_llm(error_rate=1.0, error_status=400)
+    assert _run(MESSAGES, max_retries=3) == (False, llm_interface.API_ERROR_MESSAGE)
+    assert config.requests == 1 and backoff_calls == []
+
+
+def test_stream_releases_its_slot_and_client_closes(mock_llm):
+    mock_llm()
+
+    async def scenario():
+        success, deltas = await llm_interface.aquery_llm(MESSAGES, stream=True)
+        client, semaphore = llm_interface._get_async_client()
+        assert semaphore._value == llm_interface.MAX_CONCURRENT_REQUESTS - 1
+        text = "".join([delta async for delta in deltas])
+        assert semaphore._value == llm_interface.MAX_CONCURRENT_REQUESTS
+        await llm_interface.aclose_async_client()
+        assert client.is_closed
+        assert asyncio.get_running_loop() not in llm_interface._async_clients
+        # The loop gets a fresh client on the next call
+        assert await llm_interface.aquery_llm(MESSAGES) == (True, DEFAULT_REPLY)
+        await llm_interface.aclose_async_client()
+        return success, text
+
+    assert asyncio.run(scenario()) == (True, DEFAULT_REPLY)
+
+
+def test_fallback_extraction_counts_are_not_lost_across_threads(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    found = {"email": "jane.doe@example.com", "question": "Do you ship to Norway?"}
+    monkeypatch.setattr(llm_interface, "extract_fallback_info_locally", lambda history, question: (dict(found), 1.0))
+    monkeypatch.setitem(llm_interface.fallback_extraction_stats, "local", 0)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: llm_interface.extract_fallback_info_with_history([], ""), range(2000)))
+    assert all(result == found for result in results)
+    assert llm_interface.fallback_extraction_stats["local"] == 2000
@@ -0,0 +1,193 @@
+import time
+
+import pytest
+import llm_interface
+import llm_router
+from llm_router import Route, Router
+from mock_llm_server import DEFAULT_REPLY, MockLLMConfig, start_mock_server
+
+MESSAGES = [{"role": "user", "content": "Where is my order?"}]
+
+
+class _RecordingConfig(MockLLMConfig):
+    """Mock config that logs which server each request reached, in arrival order."""
+
+    def __init__(self, name: str, calls: list, **settings):
+        super().__init__(**settings)
+        self.name = name
+        self.calls = calls
+
+    def should_fail(self) -> bool:
+        self.calls.append(self.name)
+        return super().should_fail()
+
+
+@pytest.fixture
+def mock_servers():
+    """start(name, **MockLLMConfig settings) -> (config, url); `start.calls` lists requests in order."""
+    servers, calls = [], []
+
+    def start(name: str, **settings):
+        config = _RecordingConfig(name, calls, **settings)
+        server, url = start_mock_server(config=config)
+        servers.append(server)
+        return config, url
+
+    start.calls = calls
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def fast_breaker(monkeypatch):
+    monkeypatch.setattr(llm_router, "BREAKER_CONSECUTIVE_FAILURES", 2)
+    monkeypatch.setattr(llm_router, "BREAKER_COOLDOWN", 0.3)
+
+
+def test_slow_primary_is_hedged(mock_servers, monkeypatch):
+    monkeypatch.setattr(llm_router, "HEDGE_DEFAULT_DELAY", 0.2)
+    _, slow_url = mock_servers("slow", first_token_delay=2.0)
+    _, fast_url = mock_servers("fast", reply="hedged answer")
+    router = Router([Route("slow", slow_url), Route("fast", fast_url)], hedging=True)
+
+    started = time.perf_counter()
+    success, reply = router.query(MESSAGES)
+    elapsed = time.perf_counter() - started
+    assert success and reply == "hedged answer"
+    # The hedge goes out after the delay, not before, and wins well before the primary
+    assert 0.2 <= elapsed < 1.0
+    status = router.status(stream=False)
+    assert status["fast"]["hedges"] == 1 and status["fast"]["wins"] == 1
+    assert status["slow"]["cancelled"] == 1 and status["slow"]["errors"] == 0
+
+
+def test_fast_primary_is_not_hedged(mock_servers, monkeypatch):
+    monkeypatch.setattr(llm_router, "HEDGE_DEFAULT_DELAY", 0.5)
+    _, primary_url = mock_servers("primary")
+    backup, backup_url = mock_servers("backup")
+    router = Router([Route("primary", primary_url), Route("backup", backup_url)], hedging=True)
+
+    success, reply = router.query(MESSAGES, stream=True)
+    assert success and "".join(reply) == DEFAULT_REPLY
+    assert mock_servers.calls == ["primary"] and backup.requests == 0
+
+
+def test_failover_follows_route_order(mock_servers):
+    _, first_url = mock_servers("first", error_rate=1.0, error_status=502)
+    _, second_url = mock_servers("second", error_rate=1.0, error_status=503)
+    _, third_url = mock_servers("third", reply="third answer")
+    router = Router([Route("first", first_url), Route("second", second_url), Route("third", third_url)],
+                    hedging=False)
+
+    success, reply = router.query(MESSAGES, max_retries=1)
+    assert success and reply == "third answer"
+    assert mock_servers.calls == ["first", "second", "third"]
+    status = router.status(stream=False)
+    assert (status["first"]["errors"], status["second"]["errors"], status["third"]["wins"]) == (1, 1, 1)
+
+
+def test_breaker_opens_and_probes_after_cooldown(mock_servers, fast_breaker):
+    config, url = mock_servers("flaky", error_rate=1.0, error_status=502)
+    router = Router([Route("flaky", url)], hedging=False)
+    health = router.health["flaky"]
+
+    for _ in range(2):
+        assert router.query(MESSAGES, max_retries=1) == (False, llm_interface.SERVER_ERROR_MESSAGE)
+    assert health.state == "open" and health.counters["trips"] == 1
+
+    # While open, requests are refused without reaching the server
+    assert router.query(MESSAGES, max_retries=1) == (False, llm_interface.SERVER_ERROR_MESSAGE)
+    assert config.requests == 2
+
+    # After the cooldown a single probe is let through; its failure reopens the breaker
+    time.sleep(0.35)
+    assert health.allow() and health.state == "half_open"
+    assert not health.allow()
+    health.record_failure()
+    assert health.state == "open" and health.counters["trips"] == 2
+
+    # A successful probe closes it again
+    config.error_rate = 0
+    time.sleep(0.35)
+    success, reply = router.query(MESSAGES, max_retries=1)
+    assert success and reply == DEFAULT_REPLY
+    assert health.state == "closed" and config.requests == 3
+
+
+def test_cancelled_probe_frees_the_half_open_slot(mock_servers, fast_breaker):
+    _, url = mock_servers("flaky", error_rate=1.0)
+    router = Router([Route("flaky", url)], hedging=False)
+    health = router.health["flaky"]
+    for _ in range(2):
+        router.query(MESSAGES, max_retries=1)
+    time.sleep(0.35)
+    assert health.allow()
+    health.record_cancelled()
+    assert health.state == "half_open" and health.allow()
+
+
+def test_open_breaker_fails_over_to_the_next_route(mock_servers, fast_breaker):
+    _, down_url = mock_servers("down", error_rate=1.0)
+    _, up_url = mock_servers("up")
+    router = Router([Route("down", down_url), Route("up", up_url)], hedging=False)
+    for _ in range(2):
+        assert router.query(MESSAGES, max_retries=1)[0]
+    assert router.health["down"].state == "open"
+
+    mock_servers.calls.clear()
+    assert router.query(MESSAGES, max_retries=1) == (True, DEFAULT_REPLY)
+    assert mock_servers.calls == ["up"]
+
+
+def test_retry_waits_for_retry_after(mock_servers):
+    config, url = mock_servers("limited", error_status=429, retry_after=0.5, fail_first=1)
+    router = Router([Route("limited", url)], hedging=False)
+
+    # Without the header the first backoff could be anything up to retry_delay
+    started = time.perf_counter()
+    success, reply = router.query(MESSAGES, max_retries=2, retry_delay=5.0)
+    elapsed = time.perf_counter() - started
+    assert success and reply == DEFAULT_REPLY
+    assert 0.5 <= elapsed < 1.5
+    assert config.requests == 2
+
+
+def test_rate_limit_is_reported_when_retries_run_out(mock_servers, monkeypatch):
+    monkeypatch.setattr(llm_interface, "MAX_BACKOFF", 0.1)
+    config, url = mock_servers("limited", error_rate=1.0, error_status=429, retry_after=30)
+    router = Router([Route("limited", url)], hedging=False)
+
+    started = time.perf_counter()
+    assert router.query(MESSAGES, max_retries=2) == (False, llm_interface.RATE_LIMIT_MESSAGE)
+    # Retry-After is capped at MAX_BACKOFF
+    assert time.perf_counter() - started < 1.0
+    assert config.requests == 2
+
+
+def test_client_errors_are_not_retried(mock_servers):
+    config, url = mock_servers("bad", error_rate=1.0, error_status=400)
+    router = Router([Route("bad", url)], hedging=False)
+    assert router.query(MESSAGES, max_retries=3) == (False, llm_interface.API_ERROR_MESSAGE)
+    assert config.requests == 1
+
+
+def test_bad_request_neither_trips_the_breaker_nor_fails_over(mock_servers, fast_breaker):
+    first, first_url = mock_servers("first", error_rate=1.0, error_status=413)
+    backup, backup_url = mock_servers("backup")
+    router = Router([Route("first", first_url), Route("backup", backup_url)], hedging=False)
+    for _ in range(3):
+        assert router.query(MESSAGES, max_retries=2) == (False, llm_interface.API_ERROR_MESSAGE)
+    assert mock_servers.calls == ["first"] * 3 and backup.requests == 0
+    health = router.health["first"]
+    assert health.state == "closed" and health.counters["errors"] == 0 and health.consecutive_failures == 0
+
+
+def test_rejected_credentials_fail_over(mock_servers):
+    _, first_url = mock_servers("first", error_rate=1.0, error_status=401)
+    _, backup_url = mock_servers("backup")
+    router = Router([Route("first", first_url), Route("backup", backup_url)], hedging=False)
+    assert router.query(MESSAGES, max_retries=1) == (True, DEFAULT_REPLY)
+    assert mock_servers.calls == ["first", "backup"]
+    assert router.health["first"].counters["errors"] == 1
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+from conftest import INDEX_DIR
+from metadata_index import MetadataIndex, parse_filters, parse_price
+
+
+@pytest.fixture(scope="module")
+def retriever():
+    import similarity
+
+    return similarity.Retriever(INDEX_DIR, backend="exact")
+
+
+def _row(retriever, **fields) -> int:
+    for row in range(len(retriever.vector_store)):
+        chunk = retriever.vector_store[row]
+        if all(chunk.get(key) == value for key, value in fields.items()):
+            return row
+    raise LookupError(fields)
+
+
+@pytest.mark.parametrize("question, bounds", [
+    ("laptops under $1500", (None, 1500.0)),
+    ("phones between $500 and $900", (500.0, 900.0)),
+    ("gpus over 2k dollars", (2000.0, None)),
+    ("$300-$600 accessories", (300.0, 600.0)),
+    ("Is shipping free for orders over 100?", (None, None)),
+    ("Do you price match from 2 stores?", (None, None)),
+    ("laptops with 16GB RAM under 2 years old", (None, None)),
+])
+def test_parse_price(question, bounds):
+    assert parse_price(question, nouns=("laptops", "phones", "gpus")) == bounds
+
+
+def test_bare_amount_needs_a_product_noun():
+    assert parse_price("laptops under 1500", nouns=("laptops",)) == (None, 1500.0)
+    assert parse_price("I paid 1200 for it, over 30 days ago", nouns=("laptops",)) == (None, None)
+
+
+def test_product_search_is_strict(retriever):
+    filters = parse_filters("Show me laptops under $1500", retriever.metadata_index)
+    assert filters["strict"] and filters["category"] == ["laptops"] and filters["price_max"] == 1500.0
+    rows = retriever.filtered_rows(filters)
+    assert {retriever.vector_store[int(row)]["type"] for row in rows} == {"product"}
+
+
+@pytest.mark.parametrize("question", [
+    "Is shipping free for orders over $100?",
+    "Do you price match from 2 stores?",
+    "Do Apple products have a warranty?",
+])
+def test_support_questions_are_not_filtered(retriever, question):
+    assert parse_filters(question, retriever.metadata_index) == {}
+
+
+@pytest.mark.parametrize("question, section", [
+    ("What is the warranty on phones?", "Warranty Policy"),
+    ("Is there a restocking fee on laptops?", "Returns Policy"),
+    ("I paid 1200 for a laptop, can I return it?", "Returns Policy"),
+])
+def test_support_questions_keep_policy_chunks(retriever, question, section):
+    import similarity
+
+    filters = parse_filters(question, retriever.metadata_index)
+    assert not filters.get("strict", False)
+    assert "price_min" not in filters and "price_max" not in filters
+
+    policy_row = _row(retriever, type="policy", section=section)
+    rows = retriever.filtered_rows(filters)
+    assert rows is None or policy_row in rows
+
+    # Retrieval end to end, with the policy's own vector standing in for the query embedding:
+    # the best FAQ / policy chunks found without filters are still found with them
+    previous, similarity._retriever = similarity._retriever, retriever
+    try:
+        query = np.asarray(retriever.chunk_index.matrix[policy_row], dtype=np.float32)
+        filtered = similarity.get_top_chunks(query, top_k=5, query_text=question)
+        unfiltered = similarity.get_top_chunks(query, top_k=5, query_text=question, filters={})
+    finally:
+        similarity._retriever = previous
+    support = [chunk["content"] for chunk in unfiltered if chunk["type"] != "product"]
+    assert support and set(support[:2]) <= {chunk["content"] for chunk in filtered}
+    assert any(chunk["type"] == "policy" for chunk in filtered)
+
+
+@pytest.mark.parametrize("question, sections", [
+    ("What does your return policy say about opened boxes?", ["returns policy"]),
+    ("Which payment methods do you accept?", ["payment methods"]),
+    ("What are your delivery and shipping times?", ["delivery & shipping"]),
+    # One-word section names are everyday words, not references to a section
+    ("Where is my order?", None),
+    ("How do I delete my account?", None),
+])
+def test_named_sections_are_inferred(retriever, question, sections):
+    filters = parse_filters(question, retriever.metadata_index)
+    assert filters.get("section") == sections
+    if sections:
+        rows = retriever.filtered_rows(filters)
+        assert {retriever.vector_store[int(row)]["section"].lower() for row in rows} == set(sections)
+
+
+def test_named_section_is_kept_next_to_narrowed_products(retriever):
+    filters = parse_filters("Does the warranty policy cover laptops?", retriever.metadata_index)
+    assert filters == {"type": ["product"], "strict": False, "category": ["laptops"], "section": ["warranty policy"]}
+    chunks = [retriever.vector_store[int(row)] for row in retriever.filtered_rows(filters)]
+    assert {chunk["type"] for chunk in chunks} == {"product", "policy"}
+    assert {chunk["section"] for chunk in chunks if chunk["type"] != "product"} == {"Warranty Policy"}
+    assert {chunk["category"] for chunk in chunks if chunk["type"] == "product"} == {"Laptops"}
+
+
+def test_non_strict_select_adds_other_types():
+    records = [{"type": "product", "category": "Laptops", "price_usd": 900},
+               {"type": "product", "category": "Smartphones", "price_usd": 500},
+               {"type": "policy", "section": "Warranty Policy"},
+               {"type": "faq", "section": "Orders"}]
+    index = MetadataIndex.from_bytes(MetadataIndex.build(records).to_bytes())
+    strict = {"type": ["product"], "category": ["laptops"]}
+    assert index.select(strict).tolist() == [0]
+    assert index.select({**strict, "strict": False}).tolist() == [0, 2, 3]
+    assert index.select({**strict, "strict": False, "section": ["orders"]}).tolist() == [0, 3]
+    assert index.select({"section": ["warranty policy"]}).tolist() == [2]
@@ -0,0 +1,100 @@
+import pytest
+import prompt_builder
+import tokens
+from prompt_builder import (
+    CONTEXT_TOKEN_BUDGET, HISTORY_TOKEN_BUDGET, SUMMARY_TOKEN_BUDGET, _truncate_to_tokens, build_context,
+    build_prompt, count_message_tokens, window_history,
+)
+from tokens import count_tokens
+
+
+@pytest.fixture(autouse=True)
+def heuristic_token_counts(monkeypatch):
+    """Counts with the word/punctuation estimate so results do not depend on a downloaded tokenizer."""
+    monkeypatch.setattr(tokens, "_tokenizer", False)
+
+
+def _turns(count: int, words: int = 40) -> list:
+    """Alternating user/assistant turns, each opening with a sentence that names its turn number."""
+    return [
+        {"role": "user" if n % 2 == 0 else "assistant",
+         "content": f"Turn {n} opens here. " + " ".join(f"word{n}_{w}" for w in range(words))}
+        for n in range(count)
+    ]
+
+
+def _chunk(n: int, words: int = 100) -> dict:
+    return {"type": "faq", "section": f"Section {n}", "content": " ".join(f"chunk{n}_{w}" for w in range(words))}
+
+
+def test_truncate_to_tokens():
+    text = " ".join(f"word{n}" for n in range(200))
+    assert _truncate_to_tokens("short enough", 50) == "short enough"
+    truncated = _truncate_to_tokens(text, 50)
+    assert truncated.endswith(" …") and text.startswith(truncated[:-2])
+    assert count_tokens(truncated[:-2]) <= 50
+    # Cut on a word boundary, as many words as the budget allows
+    kept = truncated[:-2].split()
+    assert count_tokens(" ".join(text.split()[:len(kept) + 1])) > 50
+
+
+def test_window_history_keeps_the_newest_turns_within_budget():
+    history = _turns(60)
+    older, recent = window_history(history, budget=500)
+    assert older + recent == history and recent and older
+    assert sum(count_message_tokens(message) for message in recent) <= 500
+    # The next older turn would not have fit
+    assert sum(count_message_tokens(message) for message in [older[-1]] + recent) > 500
+    assert window_history(history[:2], budget=500) == ([], history[:2])
+
+
+def test_build_context_truncates_to_budget():
+    context = build_context([_chunk(n) for n in range(10)], budget=400)
+    assert count_tokens(context) <= 400 and "chunk0_0" in context
+    assert "chunk9_0" not in context
+    # The top chunk is always kept, cut to the budget when it is too long on its own
+    context = build_context([_chunk(0, words=2000), _chunk(1)], budget=100)
+    assert context.startswith("---\n[Faq - Section 0]") and context.endswith(" …")
+    assert count_tokens(context[:-2]) <= 100 and "chunk1_0" not in context
+
+
+def test_build_prompt_stays_within_budgets():
+    history = _turns(60)
+    messages = build_prompt("Does the X200 laptop ship to Norway?", [_chunk(n, words=400) for n in range(3)], history)
+
+    system, context, summary, *recent, question = messages
+    assert system["role"] == "system" and context["content"].startswith("Support Context:\n")
+    assert count_tokens(context["content"]) <= CONTEXT_TOKEN_BUDGET + count_tokens("Support Context:\n")
+    assert summary["content"].startswith("Summary of the earlier conversation:\n")
+    assert count_tokens(summary["content"].split("\n", 1)[1]) <= SUMMARY_TOKEN_BUDGET
+    assert recent == history[-len(recent):]
+    assert sum(count_message_tokens(message) for message in recent) <= HISTORY_TOKEN_BUDGET
+    assert question == {"role": "user", "content": "Does the X200 laptop ship to Norway?"}
+
+
+def test_summary_replaces_dropped_turns():
+    history = _turns(60)
+    older, recent = window_history(history)
+    messages = build_prompt("Any update?", [_chunk(0)], history)
+    summary = messages[2]["content"]
+
+    # Dropped turns only appear as their first sentence, newest first when the summary budget runs out
+    assert f"- {older[-1]['role'].capitalize()}: Turn {len(older) - 1} opens here." in summary
+    assert "word0_" not in summary and f"word{len(older) - 1}_" not in summary
+    assert summary.index(f"Turn {len(older) - 2} ") < summary.index(f"Turn {len(older) - 1} ")
+    assert not any(message in messages for message in older)
+
+
+def test_short_history_is_kept_verbatim():
+    history = _turns(4, words=5)
+    messages = build_prompt("Any update?", [_chunk(0)], history)
+    assert messages[2:-1] == history
+    assert not any(message["content"].startswith("Summary") for message in messages)
+
+
+def test_prompt_size_is_recorded(monkeypatch):
+    histogram = prompt_builder.PromptSizeHistogram()
+    monkeypatch.setattr(prompt_builder, "prompt_size_histogram", histogram)
+    messages = build_prompt("Any update?", [_chunk(0)])
+    assert histogram.snapshot()["count"] == 1
+    assert histogram.sum == sum(count_message_tokens(message) for message in messages)
@@ -0,0 +1,81 @@
+import json
+import time
+
+import pytest
+from query_log import QueryLogError, QueryLogWriter
+
+
+def _lines(path) -> list:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def _wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.01)
+
+
+def test_entries_are_written_in_order(tmp_path):
+    writer = QueryLogWriter(tmp_path / "log.jsonl", flush_interval=0.01)
+    for n in range(5):
+        writer.write({"n": n})
+    assert writer.flush()
+    writer.close()
+    assert [entry["n"] for entry in _lines(tmp_path / "log.jsonl")] == list(range(5))
+    assert writer.stats()["errors"] == 0
+
+
+def test_failed_batch_is_reported_and_retried(tmp_path):
+    # A file where the log directory should be makes every commit fail
+    blocker = tmp_path / "logs"
+    blocker.write_text("not a directory")
+    path = blocker / "log.jsonl"
+    writer = QueryLogWriter(path, flush_interval=0.01, retry_delay=0.05)
+
+    writer.write({"n": 0})
+    _wait_for(lambda: writer.stats()["pending"] == 1)
+    assert writer.failing
+    # While the log is failing, callers are told their entry was not saved
+    with pytest.raises(QueryLogError):
+        writer.write({"n": 1})
+
+    # flush() waits for the batch awaiting a retry, not just for the queue to empty
+    assert not writer.flush(timeout=0.2)
+
+    blocker.unlink()
+    assert writer.flush(timeout=5)
+    assert not writer.failing and writer.stats()["pending"] == 0
+    writer.write({"n": 2})
+    assert writer.flush()
+    writer.close()
+    assert [entry["n"] for entry in _lines(path)] == [0, 2]
+
+
+def test_closed_writer_raises_on_failure(tmp_path):
+    blocker = tmp_path / "logs"
+    blocker.write_text("not a directory")
+    writer = QueryLogWriter(blocker / "log.jsonl")
+    writer.close()
+    with pytest.raises(QueryLogError):
+        writer.write({"n": 0})
+    assert writer.stats()["errors"] == 1
+
+
+def test_unsaved_fallback_question_is_not_confirmed(tmp_path, monkeypatch):
+    import ProgramEngine
+    from sessions import ChatSession
+
+    blocker = tmp_path / "logs"
+    blocker.write_text("not a directory")
+    writer = QueryLogWriter(blocker / "log.jsonl")
+    writer.close()
+    monkeypatch.setattr(ProgramEngine, "query_log", writer)
+    monkeypatch.setattr(ProgramEngine, "extract_fallback_info_with_history",
+                        lambda history, question: {"email": "user@example.com", "question": question})
+
+    session = ChatSession()
+    session.start_fallback("Do you ship to Norway?")
+    stream = ProgramEngine._respond("user@example.com", [], session)
+    assert "couldn’t save your question" in stream.text
+    assert session.waiting_for_fallback_info
@@ -0,0 +1,154 @@
+import types
+
+import numpy as np
+import pytest
+import response_cache as response_cache_module
+from response_cache import SemanticResponseCache
+
+CHUNKS = [{"id": "faq-1", "content": "Orders ship within 2 days."}, {"id": "faq-2", "content": "Returns: 30 days."}]
+QUESTION = "How long does shipping take?"
+HISTORY = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello! How can I help?"}]
+
+
+def _vector(*values) -> np.ndarray:
+    """Stub query embedding; the cache normalises it."""
+    return np.array(values, dtype=np.float32)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake wall clock for the cache; advance it with clock.now += seconds."""
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(response_cache_module, "time", types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_hit_requires_similarity_above_threshold(clock):
+    cache = SemanticResponseCache(max_size=4, threshold=0.95)
+    cache.store(_vector(1, 0, 0), CHUNKS, [], "Two days.")
+    # cos ~0.995 (a paraphrase) hits, cos ~0.89 does not
+    assert cache.lookup(_vector(1, 0.1, 0), CHUNKS, []) == "Two days."
+    assert cache.lookup(_vector(1, 0.5, 0), CHUNKS, []) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_similar_query_with_different_chunks_misses(clock):
+    cache = SemanticResponseCache(max_size=4, threshold=0.95)
+    cache.store(_vector(1, 0, 0), CHUNKS, [], "Two days.")
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS[:1], []) is None
+    assert cache.lookup(_vector(1, 0, 0), list(reversed(CHUNKS)), []) is None
+    assert cache.near_misses == 2
+
+
+def test_changed_index_drops_every_entry(clock):
+    cache = SemanticResponseCache(max_size=4)
+    cache.store(_vector(1, 0, 0), CHUNKS, [], "Two days.", index_version="v1")
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS, [], index_version="v1") == "Two days."
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS, [], index_version="v2") is None
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS, [], index_version="v1") is None
+    assert cache.invalidations == 1 and cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = SemanticResponseCache(max_size=2)
+    cache.store(_vector(1, 0, 0), CHUNKS, [], "first")
+    clock.now += 1
+    cache.store(_vector(0, 1, 0), CHUNKS, [], "second")
+    clock.now += 1
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS, []) == "first"
+    clock.now += 1
+    cache.store(_vector(0, 0, 1), CHUNKS, [], "third")
+
+    assert cache.lookup(_vector(0, 1, 0), CHUNKS, []) is None
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS, []) == "first"
+    assert cache.lookup(_vector(0, 0, 1), CHUNKS, []) == "third"
+    assert cache.evictions == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = SemanticResponseCache(max_size=2, ttl=60)
+    cache.store(_vector(1, 0, 0), CHUNKS, [], "Two days.")
+    clock.now += 59
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS, []) == "Two days."
+    clock.now += 2
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS, []) is None
+    # The expired slot is reused before anything live is evicted
+    cache.store(_vector(0, 1, 0), CHUNKS, [], "a")
+    cache.store(_vector(0, 0, 1), CHUNKS, [], "b")
+    assert cache.evictions == 0
+
+
+def test_empty_answers_are_not_stored(clock):
+    cache = SemanticResponseCache(max_size=2)
+    cache.store(_vector(1, 0, 0), CHUNKS, [], "")
+    assert cache.inserts == 0
+
+
+@pytest.mark.parametrize("question, cacheable", [
+    (QUESTION, True),
+    ("Do you ship to Norway?", True),
+    ("What about Norway?", False),
+    ("And in black?", False),
+    ("Does it come with a charger?", False),
+    ("How much is the other one?", False),
+    ("Price?", False),
+])
+def test_multi_turn_questions_are_cached_only_when_self_contained(question, cacheable):
+    assert SemanticResponseCache.is_cacheable_context([], question)
+    assert SemanticResponseCache.is_cacheable_context(HISTORY, question) is cacheable
+
+
+def test_conversation_answer_is_reused_for_a_self_contained_question(clock):
+    cache = SemanticResponseCache(max_size=2)
+    cache.store(_vector(1, 0, 0), CHUNKS, [], "Two days.", question=QUESTION)
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS, HISTORY, question=QUESTION) == "Two days."
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS, HISTORY, question="Does it ship fast?") is None
+    # Without the question text a conversation is never cached
+    assert cache.lookup(_vector(1, 0, 0), CHUNKS, HISTORY) is None
+    cache.store(_vector(0, 1, 0), CHUNKS, HISTORY, "Yes, it does.", question="Does it ship fast?")
+    assert cache.inserts == 1
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """ProgramEngine with retrieval and the LLM stubbed out and a fresh cache; set engine.reply."""
+    import ProgramEngine
+
+    cache = SemanticResponseCache(max_size=4)
+    monkeypatch.setattr(ProgramEngine, "response_cache", cache)
+    monkeypatch.setattr(ProgramEngine, "get_exact_matches", lambda question, top_k=3: [])
+    monkeypatch.setattr(ProgramEngine, "embed_user_query", lambda question: _vector(1, 0, 0))
+    monkeypatch.setattr(ProgramEngine, "get_top_chunks", lambda embedding, top_k=3, query_text="": CHUNKS)
+    monkeypatch.setattr(ProgramEngine, "get_vector_store", lambda: types.SimpleNamespace(content_hash="v1"))
+    monkeypatch.setattr(ProgramEngine, "query_llm", lambda messages, stream=True: (True, iter([engine.reply])))
+    engine = types.SimpleNamespace(module=ProgramEngine, cache=cache, reply="")
+    return engine
+
+
+def _ask(engine, question: str):
+    from sessions import ChatSession
+
+    session = ChatSession()
+    stream = engine.module._respond(question, [], session)
+    text = "".join(stream)
+    return text, session
+
+
+def test_fallback_answers_are_never_cached(engine):
+    engine.reply = "Sorry, I couldn’t find an answer to that in our support database."
+    _, session = _ask(engine, QUESTION)
+    assert session.waiting_for_fallback_info
+    assert engine.cache.inserts == 0
+
+    # A second ask goes to the LLM again and so reaches the email-capture flow again
+    _, session = _ask(engine, QUESTION)
+    assert session.waiting_for_fallback_info and engine.cache.hits == 0
+
+
+def test_answers_are_cached_and_reused(engine):
+    engine.reply = "Orders ship within 2 days."
+    _ask(engine, QUESTION)
+    engine.reply = "a different answer the LLM would give"
+    text, _ = _ask(engine, QUESTION)
+    assert text == "Orders ship within 2 days."
+    assert (engine.cache.inserts, engine.cache.hits) == (1, 1)
@@ -0,0 +1,91 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sessions import SessionStore
+
+
+class _Clock:
+    """Injected SessionStore clock; advance it by assigning to `now`."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return _Clock()
+
+
+def test_idle_sessions_expire(clock):
+    store = SessionStore(max_sessions=10, idle_ttl=60, clock=clock)
+    session = store.get_or_create("abc")
+    clock.now += 60
+    assert store.get("abc") is session
+
+    clock.now += 1
+    assert store.get("abc") is None
+    assert store.get_or_create("abc") is not session
+    assert store.stats()["expired"] == 1
+
+
+def test_activity_keeps_a_session_alive(clock):
+    store = SessionStore(max_sessions=10, idle_ttl=60, clock=clock)
+    active = store.get_or_create("active")
+    store.get_or_create("idle")
+    for _ in range(3):
+        clock.now += 40
+        assert store.get_or_create("active") is active
+    assert store.get("idle") is None and len(store) == 1
+    clock.now += 61
+    assert store.expire_idle() == 1 and len(store) == 0
+
+
+def test_least_recently_active_session_is_evicted(clock):
+    store = SessionStore(max_sessions=2, idle_ttl=600, clock=clock)
+    first = store.get_or_create("first")
+    clock.now += 1
+    store.get_or_create("second")
+    clock.now += 1
+    assert store.get_or_create("first") is first
+    clock.now += 1
+    store.get_or_create("third")
+
+    assert store.get("second") is None
+    assert store.get("first") is first and store.get("third") is not None
+    assert store.stats()["evicted"] == 1 and len(store) == 2
+
+
+def test_concurrent_requests_share_one_session(clock):
+    store = SessionStore(max_sessions=10, idle_ttl=60, clock=clock)
+    with ThreadPoolExecutor(8) as pool:
+        sessions = list(pool.map(lambda _: store.get_or_create("shared"), range(200)))
+    assert all(session is sessions[0] for session in sessions)
+    assert store.stats()["created"] == 1
+
+
+def test_session_lock_serializes_one_session_only(clock):
+    store = SessionStore(max_sessions=10, idle_ttl=60, clock=clock)
+    busy, other = store.get_or_create("busy"), store.get_or_create("other")
+
+    def start_fallback(session):
+        session.start_fallback("Do you ship to Norway?")
+        done.set()
+
+    with busy.lock:
+        # A state transition on another session is not held up
+        done = threading.Event()
+        threading.Thread(target=start_fallback, args=(other,)).start()
+        assert done.wait(5) and other.waiting_for_fallback_info
+
+        # The same session waits until the lock holder has finished
+        done = threading.Event()
+        waiter = threading.Thread(target=start_fallback, args=(busy,))
+        waiter.start()
+        assert not done.wait(0.2)
+        assert not busy.waiting_for_fallback_info
+    waiter.join(5)
+    assert busy.waiting_for_fallback_info and busy.original_question == "Do you ship to Norway?"
@@ -0,0 +1,23 @@
+import numpy as np
+from similarity import ChunkIndex
+
+
+def _chunks(vectors) -> list:
+    return [{"content": f"chunk {i}", "embedding": vector} for i, vector in enumerate(vectors)]
+
+
+def test_top_k_is_best_first():
+    index = ChunkIndex.from_chunks(_chunks(np.eye(4, dtype=np.float32)))
+    query = np.array([0.1, 0.0, 1.0, 0.5], dtype=np.float32)
+    assert index.top_k_indices(query, 3).tolist() == [[2, 3, 0]]
+    assert [chunk["content"] for chunk in index.search(query, 2)] == ["chunk 2", "chunk 3"]
+
+
+def test_empty_index_returns_no_results():
+    index = ChunkIndex.from_chunks([])
+    queries = np.ones((2, 8), dtype=np.float32)
+    assert len(index) == 0
+    assert index.score(queries).shape == (2, 0)
+    assert index.top_k_indices(queries, 3).shape == (2, 0)
+    assert index.search(queries[0], 3) == []
+    assert index.search_batch(queries, 3) == [[], []]